@@ -1,109 +1,322 @@
 import os
 import sys
 import json
-from sentence_transformers import SentenceTransformer
-import chromadb
+import hashlib
+import argparse
+from itertools import islice
 from tqdm import tqdm
 
 # Add the scripts directory to the path to import local modules
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from chunking import chunk_service_json, chunk_vendor_health_json
+from embedding_cache import EmbeddingCache, EMBEDDING_CACHE_ENABLED
+from vector_backends import export_numpy_index, numpy_index_exists, DEFAULT_NUMPY_INDEX_DIR
+from kb_snapshot import load_snapshot, KnowledgeBaseError
 
 
-def list_json_files(root_folder):
-    """Recursively get all JSON files under the root folder."""
-    files = []
-    for dirpath, _, filenames in os.walk(root_folder):
-        for fname in filenames:
-            if fname.lower().endswith('.json'):
-                files.append(os.path.join(dirpath, fname))
-    return files
+# Number of chunks encoded per forward pass
+DEFAULT_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+# Number of chunks written to Chroma per add() call (also bounds peak memory)
+DEFAULT_WRITE_BATCH_SIZE = int(os.getenv("EMBEDDING_WRITE_BATCH_SIZE", "256"))
+# Number of encode worker processes (0 = encode in this process)
+DEFAULT_NUM_PROCESSES = int(os.getenv("EMBEDDING_NUM_PROCESSES", "0"))
 
+EMBEDDING_MODEL_NAME = "BAAI/bge-base-en-v1.5"
+# Encoder that embeds chunks when no model is passed in (see ENCODER_BACKEND in query_db.py for the others)
+DEFAULT_ENCODER = "torch"
+COLLECTION_NAME = "fintech_services"
+# Per-file and per-chunk content hashes of what is currently in the collection
+MANIFEST_FILENAME = "index_manifest.json"
+MANIFEST_VERSION = 1
+# Storage dtype of the exported NumPy retrieval index ("float32" or "float16")
+NUMPY_INDEX_DTYPE = os.getenv("NUMPY_INDEX_DTYPE", "float32")
 
-def get_relative_path(root_folder, abspath):
-    """Get relative path to use in metadata and IDs."""
-    return os.path.relpath(abspath, root_folder)
 
+def hash_bytes(data):
+    """Hex SHA-256 of raw bytes."""
+    return hashlib.sha256(data).hexdigest()
 
-def main():
+
+def hash_chunk(document, metadata):
+    """Content hash of a chunk: text plus metadata, since both are stored in Chroma."""
+    payload = json.dumps({"document": document, "metadata": metadata}, sort_keys=True)
+    return hash_bytes(payload.encode('utf-8'))
+
+
+def chunk_document(relative_path, service_json):
+    """Chunk one parsed knowledge base file into a list of (id, document, metadata) tuples."""
+    # Use special chunking for vendor health data
+    if "vendor_health.json" in relative_path:
+        chunks = chunk_vendor_health_json(service_json)
+    else:
+        chunks = chunk_service_json(service_json)
+
+    records = []
+    for chunk in chunks:
+        # Add file path in metadata for hierarchy preservation
+        chunk_meta = chunk["metadata"].copy()
+        chunk_meta["file_path"] = relative_path
+
+        # Create unique ID: replace os separators for consistency in IDs
+        clean_path = relative_path.replace(os.sep, "_")
+        chunk_name_sanitized = chunk['chunk_name'].replace(' ', '_')
+        unique_id = f"{clean_path}:{chunk_name_sanitized}"
+        records.append((unique_id, chunk["content"], chunk_meta))
+    return records
+
+
+def load_manifest(db_path):
+    """Load the index manifest, or an empty one if missing/unreadable."""
+    path = os.path.join(db_path, MANIFEST_FILENAME)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest
+        print(f"⚠️  Ignoring manifest with unsupported version: {manifest.get('version')}")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"⚠️  Ignoring unreadable manifest {path}: {e}")
+    return {"version": MANIFEST_VERSION, "model": None, "encoder": None, "files": {}}
+
+
+def manifest_encoder(manifest):
+    """Encoder that built the manifest's vectors (manifests from before it was recorded were all built with torch)."""
+    return manifest.get("encoder") or (DEFAULT_ENCODER if manifest.get("model") else None)
+
+
+def save_manifest(db_path, manifest):
+    """Atomically replace the manifest on disk."""
+    os.makedirs(db_path, exist_ok=True)
+    path = os.path.join(db_path, MANIFEST_FILENAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def iter_changed_chunks(snapshot, old_files, new_files, stale_ids, full=False):
+    """
+    Yield (id, document, metadata) for chunks that must be (re-)embedded.
+
+    Files come parsed from the knowledge base snapshot; unchanged files (same
+    content hash as in the manifest) are skipped without chunking, and for changed
+    files only chunks whose content hash differs from the manifest are yielded. As
+    a side effect, fills `new_files` with the updated manifest entries and
+    `stale_ids` with chunk IDs that no longer exist and must be deleted.
+    """
+    for relative_path in tqdm(sorted(snapshot.sources), desc="Checking JSON files"):
+        old_entry = old_files.get(relative_path)
+        file_hash = snapshot.sources[relative_path]["hash"]
+        if not full and old_entry and old_entry.get("hash") == file_hash:
+            new_files[relative_path] = old_entry
+            continue
+
+        try:
+            records = chunk_document(relative_path, snapshot.documents[relative_path])
+        except Exception as e:
+            # Keep serving the previously indexed version of a file the chunker cannot handle
+            print(f"⚠️  Skipping {relative_path} due to error: {e}")
+            if old_entry:
+                new_files[relative_path] = old_entry
+            continue
+
+        old_chunks = old_entry.get("chunks", {}) if old_entry else {}
+        new_chunks = {}
+        for unique_id, document, metadata in records:
+            chunk_hash = hash_chunk(document, metadata)
+            new_chunks[unique_id] = chunk_hash
+            if full or old_chunks.get(unique_id) != chunk_hash:
+                yield unique_id, document, metadata
+
+        stale_ids.extend(chunk_id for chunk_id in old_chunks if chunk_id not in new_chunks)
+        new_files[relative_path] = {"hash": file_hash, "chunks": new_chunks}
+
+    # Files removed from the knowledge base since the last run
+    for relative_path, old_entry in old_files.items():
+        if relative_path not in new_files:
+            stale_ids.extend(old_entry.get("chunks", {}).keys())
+
+
+def batched(iterable, size):
+    """Yield lists of at most `size` items from `iterable`."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def encode_documents(model, documents, batch_size, pool=None):
+    """Encode a list of documents in batches, optionally through a multi-process pool."""
+    if pool is not None:
+        embeddings = model.encode(documents, pool=pool, batch_size=batch_size)
+    else:
+        embeddings = model.encode(documents, batch_size=batch_size)
+    return embeddings
+
+
+def main(batch_size=DEFAULT_BATCH_SIZE,
+         write_batch_size=DEFAULT_WRITE_BATCH_SIZE,
+         num_processes=DEFAULT_NUM_PROCESSES,
+         full=False,
+         use_cache=EMBEDDING_CACHE_ENABLED,
+         snapshot=None,
+         client=None,
+         model=None,
+         encoder=DEFAULT_ENCODER):
+    """
+    Bring the Chroma collection in line with the knowledge base.
+
+    By default only changed files are re-chunked and only changed chunks re-embedded;
+    `full=True` re-embeds everything. Either way vectors are upserted in place and
+    stale IDs deleted afterwards, so the live collection is never emptied.
+
+    A running chatbot (kb_watcher.py) passes its own `snapshot`, Chroma `client` and
+    encoder `model` (named by `encoder`) instead of having them loaded here. The
+    manifest records the encoder, and a different one re-embeds everything, so the
+    collection never mixes vectors from two encoders. Returns the number of chunks
+    upserted and deleted.
+    """
     # Get the project root directory (parent of scripts)
     script_dir = os.path.dirname(os.path.abspath(__file__))
     project_root = os.path.dirname(script_dir)
     
-    root_folder = os.path.join(project_root, 'knowledge_base')
     db_path = os.path.join(project_root, 'vector_db')
 
-    print(f"Scanning for JSON files under: {root_folder}")
-    json_files = list_json_files(root_folder)
-    print(f"Found {len(json_files)} JSON files.")
+    # One parse of the knowledge base, shared with the chatbot (rebuilt here if any file changed)
+    if snapshot is None:
+        try:
+            snapshot = load_snapshot()
+        except KnowledgeBaseError as e:
+            raise SystemExit(f"❌ Invalid knowledge base: {e}")
+    print(f"Knowledge base snapshot {snapshot.hash[:12]}: {len(snapshot.sources)} JSON files.")
 
-    documents = []
-    metadatas = []
-    ids = []
+    if client is None:
+        import chromadb
+        print("Connecting to ChromaDB...")
+        client = chromadb.PersistentClient(path=db_path)
+    collection = client.get_or_create_collection(name=COLLECTION_NAME)
 
-    print("Processing and chunking JSON files...")
-    for file_path in tqdm(json_files, desc="Processing JSON files"):
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                service_json = json.load(f)
-        except Exception as e:
-            print(f"⚠️  Skipping {file_path} due to error: {e}")
-            continue
+    manifest = load_manifest(db_path)
+    if not full and (manifest.get("model"), manifest_encoder(manifest)) != (EMBEDDING_MODEL_NAME, encoder):
+        if manifest.get("files"):
+            print(f"⚠️  Manifest was built with {manifest.get('model')} ({manifest_encoder(manifest)}), "
+                  f"re-embedding everything with {encoder}.")
+        full = True
+    # Without a trusted manifest we cannot know which IDs are stale, so sweep the collection
+    sweep_collection = full
+    print("Mode: full re-index" if full else "Mode: incremental re-index")
 
-        # Use special chunking for vendor health data
-        if "vendor_health.json" in file_path:
-            chunks = chunk_vendor_health_json(service_json)
-        else:
-            chunks = chunk_service_json(service_json)
-
-        relative_path = get_relative_path(root_folder, file_path)
-        for chunk in chunks:
-            documents.append(chunk["content"])
-            # Add file path in metadata for hierarchy preservation
-            chunk_meta = chunk["metadata"].copy()
-            chunk_meta["file_path"] = relative_path
-            metadatas.append(chunk_meta)
-
-            # Create unique ID: replace os separators for consistency in IDs
-            clean_path = relative_path.replace(os.sep, "_")
-            chunk_name_sanitized = chunk['chunk_name'].replace(' ', '_')
-            unique_id = f"{clean_path}:{chunk_name_sanitized}"
-            ids.append(unique_id)
-
-    print(f"Total chunks prepared: {len(documents)}")
-
-    print("Loading embedding model...")
-    # BGE models are better for structured data and RAG applications
-    model = SentenceTransformer("BAAI/bge-base-en-v1.5")
-    # Alternative: model = SentenceTransformer("BAAI/bge-large-en-v1.5") for better performance
-
-    print("Generating embeddings for chunks...")
-    embeddings = []
-    for doc in tqdm(documents, desc="Embedding chunks"):
-        emb = model.encode(doc)
-        embeddings.append(emb.tolist())
-
-    print("Connecting to ChromaDB and storing vectors...")
-    client = chromadb.PersistentClient(path=db_path)
-    collection = client.get_or_create_collection(name="fintech_services")
-
-    # Clear existing collection to avoid duplicates when re-running
+    old_files = manifest.get("files", {})
+    new_files = {}
+    stale_ids = []
+
+    # Chroma rejects add()/upsert() calls above its own limit
+    write_batch_size = min(write_batch_size, client.get_max_batch_size())
+
+    # Texts embedded before (by earlier runs or by queries) are served from disk
+    # Keyed like query_db's cache, so each encoder only reads its own vectors
+    cache_name = EMBEDDING_MODEL_NAME if encoder == DEFAULT_ENCODER else f"{EMBEDDING_MODEL_NAME}@{encoder}"
+    cache = EmbeddingCache(cache_name) if use_cache else None
+
+    pool = None
+    upserted = 0
     try:
-        collection.delete()
-        collection = client.get_or_create_collection(name="fintech_services")
-        print("✅ Cleared existing collection for fresh data.")
-    except Exception as e:
-        print(f"⚠️  Note: Could not clear collection (might be empty): {e}")
+        changed = iter_changed_chunks(snapshot, old_files, new_files, stale_ids, full)
+        for batch in batched(changed, write_batch_size):
+            ids = [item[0] for item in batch]
+            documents = [item[1] for item in batch]
+            metadatas = [item[2] for item in batch]
+
+            embeddings = cache.get_many(documents) if cache else [None] * len(documents)
+            missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+            if missing:
+                if model is None:
+                    from sentence_transformers import SentenceTransformer
+                    print("Loading embedding model...")
+                    # BGE models are better for structured data and RAG applications
+                    model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+                    # Alternative: model = SentenceTransformer("BAAI/bge-large-en-v1.5") for better performance
+                    if num_processes > 0:
+                        print(f"Starting multi-process encode pool with {num_processes} workers...")
+                        pool = model.start_multi_process_pool(["cpu"] * num_processes)
+
+                missing_documents = [documents[i] for i in missing]
+                encoded = encode_documents(model, missing_documents, batch_size, pool)
+                if cache:
+                    cache.put_many(missing_documents, encoded)
+                for i, embedding in zip(missing, encoded):
+                    embeddings[i] = embedding
+            embeddings = [embedding.tolist() for embedding in embeddings]
+
+            collection.upsert(
+                documents=documents,
+                metadatas=metadatas,
+                ids=ids,
+                embeddings=embeddings
+            )
+            upserted += len(batch)
+    finally:
+        if pool is not None:
+            model.stop_multi_process_pool(pool)
+        if cache:
+            cache.flush()
+
+    if sweep_collection:
+        live_ids = {
+            chunk_id
+            for entry in new_files.values()
+            for chunk_id in entry.get("chunks", {})
+        }
+        existing_ids = collection.get(include=[])["ids"]
+        stale_ids.extend(chunk_id for chunk_id in existing_ids if chunk_id not in live_ids)
+
+    stale_ids = sorted(set(stale_ids))
+    for batch in batched(stale_ids, write_batch_size):
+        collection.delete(ids=batch)
+
+    # Keep the in-process NumPy retrieval index in sync with the collection
+    if upserted or stale_ids or not numpy_index_exists():
+        count = export_numpy_index(collection, dtype=NUMPY_INDEX_DTYPE)
+        print(f"✅ Exported {count} vectors to the NumPy index at '{DEFAULT_NUMPY_INDEX_DIR}'.")
+
+    save_manifest(db_path, {
+        "version": MANIFEST_VERSION,
+        "model": EMBEDDING_MODEL_NAME,
+        "encoder": encoder,
+        "kb_version": snapshot.hash,
+        "files": new_files,
+    })
+
+    print(f"✅ Upserted {upserted} chunks and deleted {len(stale_ids)} stale chunks in ChromaDB at '{db_path}'.")
+    if cache:
+        stats = cache.stats()
+        print(f"📦 Embedding cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries.")
+    return upserted, len(stale_ids)
 
-    collection.add(
-        documents=documents,
-        metadatas=metadatas,
-        ids=ids,
-        embeddings=embeddings
-    )
 
-    print(f"✅ Successfully embedded and stored {len(documents)} chunks in ChromaDB at '{db_path}'.")
+def parse_args():
+    parser = argparse.ArgumentParser(description="Chunk and embed the knowledge base into ChromaDB.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Chunks encoded per forward pass.")
+    parser.add_argument("--write-batch-size", type=int, default=DEFAULT_WRITE_BATCH_SIZE,
+                        help="Chunks written to Chroma per add() call.")
+    parser.add_argument("--processes", type=int, default=DEFAULT_NUM_PROCESSES,
+                        help="Encode worker processes for CPU-only hosts (0 = single process).")
+    parser.add_argument("--full", action="store_true",
+                        help="Re-embed every chunk instead of only those changed since the last run.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bypass the on-disk embedding cache.")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    main(batch_size=args.batch_size,
+         write_batch_size=args.write_batch_size,
+         num_processes=args.processes,
+         full=args.full,
+         use_cache=EMBEDDING_CACHE_ENABLED and not args.no_cache)
@@ -0,0 +1,251 @@
+import os
+import re
+import json
+import fcntl
+import atexit
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+
+# Get the project root directory (parent of scripts)
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+DEFAULT_CACHE_DIR = os.path.join(project_root, 'vector_db', 'embedding_cache')
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Maximum number of vectors kept per model; least recently used entries are evicted beyond this
+DEFAULT_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "20000"))
+# Minimum seconds between syncs of the cache files to disk when new vectors arrive (always flushed at exit)
+DEFAULT_FLUSH_INTERVAL = float(os.getenv("EMBEDDING_CACHE_FLUSH_INTERVAL", "5"))
+# Slots a key may occupy, starting at its home slot (digest prefix mod capacity); bounds every lookup
+PROBE_LENGTH = 8
+
+INDEX_FILENAME = "index.json"
+VECTORS_FILENAME = "vectors.f32"
+KEYS_FILENAME = "keys.bin"
+LAST_USED_FILENAME = "last_used.f64"
+LOCK_FILENAME = "lock"
+KEY_BYTES = 32  # raw SHA-256 digest stored per slot
+# Bumped when the on-disk layout changes; caches in another format are started over
+CACHE_FORMAT = 2
+
+
+class EmbeddingCache:
+    """
+    Content-addressed, on-disk cache of embeddings for one model, safe to share
+    between processes (prefork workers, embedding.py runs).
+
+    Vectors live in a memory-mapped float32 array with a fixed number of slots.
+    The slot table itself is on disk as well: each slot stores the digest of the
+    text it holds (all zeros when free) and its last-used time, so every process
+    sees the same slots. A text can only live in the PROBE_LENGTH slots after its
+    home slot (digest prefix mod capacity), so a lookup reads those few slots
+    and a full cache evicts the least recently used of them. Slots are only
+    written under a file lock; lookups take no lock and re-check the slot's
+    digest after reading the vector, so a slot overwritten meanwhile is a miss,
+    never a wrong vector.
+    """
+
+    def __init__(self, model_name, cache_dir=DEFAULT_CACHE_DIR,
+                 max_entries=DEFAULT_MAX_ENTRIES, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.model_name = model_name
+        self.dir = os.path.join(cache_dir, re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name))
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+
+        self.dim = None
+        self.vectors = None
+        self.keys = None
+        self.last_used = None
+        self.dirty = False
+        self.last_flush = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._load()
+        atexit.register(self.flush)
+
+    def key(self, text):
+        """Hash of (model name, text) identifying one cached vector."""
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode('utf-8')).digest()
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock over slot allocation, shared by every process using this cache directory."""
+        os.makedirs(self.dir, exist_ok=True)
+        with open(os.path.join(self.dir, LOCK_FILENAME), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        index_path = os.path.join(self.dir, INDEX_FILENAME)
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"⚠️  Ignoring unreadable embedding cache index {index_path}: {e}")
+            return None
+        if (index.get("format") != CACHE_FORMAT or index.get("model") != self.model_name
+                or index.get("capacity") != self.max_entries):
+            # Layout, capacity or model changed: start over rather than remap slots
+            return None
+        return index
+
+    def _load(self):
+        """Open the cache another process (or an earlier run) created; False if there is none yet."""
+        index = self._read_index()
+        if index is None:
+            return False
+        try:
+            self._open_arrays(index["dim"], mode='r+')
+        except Exception as e:
+            print(f"⚠️  Ignoring unreadable embedding cache {self.dir}: {e}")
+            self.vectors = self.keys = self.last_used = None
+            return False
+        return True
+
+    def _open_arrays(self, dim, mode):
+        os.makedirs(self.dir, exist_ok=True)
+        self.vectors = np.memmap(os.path.join(self.dir, VECTORS_FILENAME), dtype=np.float32,
+                                 mode=mode, shape=(self.max_entries, dim))
+        self.keys = np.memmap(os.path.join(self.dir, KEYS_FILENAME), dtype=np.uint8,
+                              mode=mode, shape=(self.max_entries, KEY_BYTES))
+        self.last_used = np.memmap(os.path.join(self.dir, LAST_USED_FILENAME), dtype=np.float64,
+                                   mode=mode, shape=(self.max_entries,))
+        self.dim = dim
+
+    def _create(self, dim):
+        """Create the cache files (under the file lock), unless another process just did."""
+        if self._load():
+            return
+        self._open_arrays(dim, mode='w+')
+        index_path = os.path.join(self.dir, INDEX_FILENAME)
+        with open(index_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({"format": CACHE_FORMAT, "model": self.model_name,
+                       "dim": dim, "capacity": self.max_entries}, f)
+        os.replace(index_path + ".tmp", index_path)
+
+    def _probe_slots(self, digests):
+        """The slots each digest may occupy, one row per digest."""
+        homes = np.frombuffer(b"".join(digests), dtype="<u8").reshape(-1, KEY_BYTES // 8)[:, 0]
+        offsets = np.arange(min(PROBE_LENGTH, self.max_entries), dtype=np.uint64)
+        return ((homes[:, None] + offsets) % np.uint64(self.max_entries)).astype(np.intp)
+
+    def _find(self, digests):
+        """Slot holding each digest, -1 where it is not cached."""
+        if not digests:
+            return np.empty(0, dtype=np.intp)
+        candidates = self._probe_slots(digests)
+        wanted = np.frombuffer(b"".join(digests), dtype=np.uint8).reshape(-1, 1, KEY_BYTES)
+        matches = (self.keys[candidates] == wanted).all(axis=2)
+        return np.where(matches.any(axis=1), candidates[np.arange(len(digests)), matches.argmax(axis=1)], -1)
+
+    def _claim_slot(self, digest):
+        """Slot to write `digest` to: its own, else a free one, else its window's least recently used (file lock held)."""
+        candidates = self._probe_slots([digest])[0]
+        keys = self.keys[candidates]
+        own = (keys == np.frombuffer(digest, dtype=np.uint8)).all(axis=1)
+        if own.any():
+            return int(candidates[own.argmax()])
+        free = ~keys.any(axis=1)
+        if free.any():
+            return int(candidates[free.argmax()])
+        self.evictions += 1
+        return int(candidates[self.last_used[candidates].argmin()])
+
+    def get_many(self, texts):
+        """Return a list with the cached vector for each text, or None where missing."""
+        results = [None] * len(texts)
+        with self.lock:
+            if self.vectors is None and not self._load():
+                self.misses += len(texts)
+                return results
+            now = time.time()
+            digests = [self.key(text) for text in texts]
+            for i, (digest, slot) in enumerate(zip(digests, self._find(digests))):
+                if slot >= 0:
+                    vector = np.array(self.vectors[slot])
+                    # The slot may have been evicted and reused while it was copied
+                    if bytes(self.keys[slot]) == digest:
+                        self.last_used[slot] = now
+                        results[i] = vector
+                        self.hits += 1
+                        continue
+                self.misses += 1
+        return results
+
+    def put_many(self, texts, vectors):
+        """Store one vector per text."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self.lock, self._file_lock():
+            if self.vectors is None:
+                self._create(vectors.shape[1])
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match cache dimension {self.dim}")
+            now = time.time()
+            for text, vector in zip(texts, vectors):
+                digest = self.key(text)
+                slot = self._claim_slot(digest)
+                # Clear the digest first so readers never pair it with a half-written vector
+                self.keys[slot] = 0
+                self.vectors[slot] = vector
+                self.keys[slot] = np.frombuffer(digest, dtype=np.uint8)
+                self.last_used[slot] = now
+            self.dirty = True
+            due = time.monotonic() - self.last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write pending vectors and slots to disk."""
+        with self.lock:
+            if not self.dirty or self.vectors is None:
+                return
+            self.vectors.flush()
+            self.keys.flush()
+            self.last_used.flush()
+            self.dirty = False
+            self.last_flush = time.monotonic()
+
+    def stats(self):
+        """Hit/miss/eviction counters and current size."""
+        entries = int(self.keys.any(axis=1).sum()) if self.keys is not None else 0
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": entries,
+            "capacity": self.max_entries,
+        }
+
+
+def encode_with_cache(model, texts, cache=None, **encode_kwargs):
+    """
+    Encode `texts` with `model`, serving repeated texts from `cache`.
+
+    Only cache misses are passed to `model.encode`; returns a float32 array with one
+    row per input text, in order.
+    """
+    if cache is None:
+        return np.asarray(model.encode(texts, **encode_kwargs), dtype=np.float32)
+
+    cached = cache.get_many(texts)
+    missing = [i for i, vector in enumerate(cached) if vector is None]
+    if missing:
+        encoded = np.asarray(model.encode([texts[i] for i in missing], **encode_kwargs), dtype=np.float32)
+        cache.put_many([texts[i] for i in missing], encoded)
+        for i, vector in zip(missing, encoded):
+            cached[i] = vector
+    return np.stack(cached) if cached else np.zeros((0, cache.dim or 0), dtype=np.float32)
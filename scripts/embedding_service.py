@@ -0,0 +1,325 @@
+import os
+import json
+import time
+import struct
+import socket
+import asyncio
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+# Get the project root directory (parent of scripts)
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+DEFAULT_SOCKET_PATH = os.path.join(project_root, 'vector_db', 'embedding_service.sock')
+
+# Set in chat workers to encode queries through the service instead of loading the model
+EMBEDDING_SERVICE_SOCKET = os.getenv("EMBEDDING_SERVICE_SOCKET")
+# A batch is encoded when it reaches this many texts or its oldest text waited this long
+EMBED_MAX_BATCH_SIZE = int(os.getenv("EMBED_MAX_BATCH_SIZE", "32"))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+EMBED_CLIENT_TIMEOUT_SECONDS = float(os.getenv("EMBED_CLIENT_TIMEOUT_SECONDS", "30"))
+
+# Frames are a 4-byte big-endian length followed by that many bytes. A request is
+# one JSON frame ({"texts": [...]} or {"stats": true}); a reply is a JSON header
+# frame ({"shape": [n, dim], ...} or {"error": ...}) followed, for encodes, by a
+# frame of n * dim float32 values.
+_LENGTH = struct.Struct(">I")
+
+
+class EmbeddingServiceError(RuntimeError):
+    """The embedding service could not be reached or failed to encode."""
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+class EmbeddingService:
+    """
+    Holds one copy of the query encoder and serves encode requests over a Unix socket.
+
+    Texts from all connections are queued together and encoded in micro-batches:
+    a batch goes to the model once it holds `max_batch_size` texts or its oldest
+    text has waited `max_wait_ms`. The model runs on one background thread so the
+    event loop keeps accepting requests while a batch is encoding.
+    """
+
+    def __init__(self, model, max_batch_size=EMBED_MAX_BATCH_SIZE, max_wait_ms=EMBED_MAX_WAIT_MS):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encode")
+        self.pending = deque()
+        self.wake = None
+        self.started = time.perf_counter()
+        self.stats_counters = {"requests": 0, "texts": 0, "batches": 0, "encode_s": 0.0}
+        self.queue_waits = deque(maxlen=5000)
+        self.batch_sizes = deque(maxlen=5000)
+
+    async def encode(self, texts):
+        """Queue texts for the next micro-batches; returns (float32 array, seconds queued)."""
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            self.pending.append((text, future, time.perf_counter()))
+            futures.append(future)
+        self.wake.set()
+        vectors = await asyncio.gather(*futures)
+        queued = [queue_s for _, queue_s in vectors]
+        return np.stack([vector for vector, _ in vectors]), max(queued, default=0.0)
+
+    async def batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.pending:
+                self.wake.clear()
+                await self.wake.wait()
+            # Give concurrent requests until the oldest text's deadline to join the batch
+            deadline = self.pending[0][2] + self.max_wait
+            while len(self.pending) < self.max_batch_size and time.perf_counter() < deadline:
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), deadline - time.perf_counter())
+                except asyncio.TimeoutError:
+                    break
+            batch = [self.pending.popleft() for _ in range(min(self.max_batch_size, len(self.pending)))]
+            texts = [text for text, _, _ in batch]
+            start = time.perf_counter()
+            try:
+                vectors = await loop.run_in_executor(
+                    self.executor,
+                    lambda: np.asarray(self.model.encode(texts, batch_size=len(texts)), dtype=np.float32)
+                )
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(EmbeddingServiceError(f"encode failed: {e}"))
+                continue
+            self.stats_counters["batches"] += 1
+            self.stats_counters["texts"] += len(batch)
+            self.stats_counters["encode_s"] += time.perf_counter() - start
+            self.batch_sizes.append(len(batch))
+            for (_, future, queued_at), vector in zip(batch, vectors):
+                self.queue_waits.append(start - queued_at)
+                if not future.done():
+                    future.set_result((vector, start - queued_at))
+
+    def stats(self):
+        counters = self.stats_counters
+        uptime = time.perf_counter() - self.started
+        return {
+            **counters,
+            "queued_texts": len(self.pending),
+            "texts_per_s": counters["texts"] / uptime if uptime else 0.0,
+            "avg_batch_size": sum(self.batch_sizes) / len(self.batch_sizes) if self.batch_sizes else 0.0,
+            "queue_wait_p50_ms": 1000 * _percentile(self.queue_waits, 0.5),
+            "queue_wait_p95_ms": 1000 * _percentile(self.queue_waits, 0.95),
+        }
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = json.loads(await _read_frame(reader))
+                except asyncio.IncompleteReadError:
+                    return
+                if request.get("stats"):
+                    _write_frame(writer, json.dumps(self.stats()).encode("utf-8"))
+                    await writer.drain()
+                    continue
+                texts = request.get("texts")
+                if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                    _write_frame(writer, json.dumps({"error": "'texts' must be a list of strings"}).encode("utf-8"))
+                    await writer.drain()
+                    continue
+                self.stats_counters["requests"] += 1
+                try:
+                    vectors, queue_s = await self.encode(texts) if texts else (np.zeros((0, 0), np.float32), 0.0)
+                except EmbeddingServiceError as e:
+                    _write_frame(writer, json.dumps({"error": str(e)}).encode("utf-8"))
+                    await writer.drain()
+                    continue
+                header = {"shape": list(vectors.shape), "queue_ms": 1000 * queue_s}
+                _write_frame(writer, json.dumps(header).encode("utf-8"))
+                _write_frame(writer, vectors.tobytes())
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            return
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path=DEFAULT_SOCKET_PATH):
+        self.wake = asyncio.Event()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = await asyncio.start_unix_server(self.handle, path=socket_path)
+        batcher = asyncio.ensure_future(self.batcher())
+        print(f"✅ Embedding service listening on {socket_path} "
+              f"(batches of up to {self.max_batch_size}, {self.max_wait * 1000:.0f} ms max wait)")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+
+async def _read_frame(reader):
+    (length,) = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+    return await reader.readexactly(length)
+
+
+def _write_frame(writer, payload):
+    writer.write(_LENGTH.pack(len(payload)) + payload)
+
+
+def _recv_exactly(sock, count):
+    buffer = bytearray()
+    while len(buffer) < count:
+        chunk = sock.recv(count - len(buffer))
+        if not chunk:
+            raise ConnectionError("embedding service closed the connection")
+        buffer.extend(chunk)
+    return bytes(buffer)
+
+
+class EmbeddingServiceClient:
+    """
+    Stand-in for the local encoder that sends texts to the embedding service.
+
+    `encode(texts)` has the shape of SentenceTransformer.encode, so it plugs into
+    encode_with_cache and query_db unchanged. Each thread keeps its own
+    connection so concurrent turns in one worker are batched by the service
+    rather than serialised here.
+    """
+
+    def __init__(self, socket_path=EMBEDDING_SERVICE_SOCKET or DEFAULT_SOCKET_PATH,
+                 timeout=EMBED_CLIENT_TIMEOUT_SECONDS):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "texts": 0, "round_trip_s": 0.0, "queue_s": 0.0, "reconnects": 0}
+
+    def _connection(self):
+        sock = getattr(self.local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+            except OSError as e:
+                sock.close()
+                raise EmbeddingServiceError(f"cannot reach the embedding service at {self.socket_path}: {e}") from e
+            self.local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self.local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self.local.sock = None
+
+    def _request(self, request):
+        payload = json.dumps(request).encode("utf-8")
+        # One reconnect covers a service restart between calls
+        for attempt in range(2):
+            sock = self._connection()
+            try:
+                sock.sendall(_LENGTH.pack(len(payload)) + payload)
+                (length,) = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))
+                header = json.loads(_recv_exactly(sock, length))
+                if "shape" not in header:
+                    return header, None
+                (length,) = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))
+                return header, _recv_exactly(sock, length)
+            except (OSError, ConnectionError) as e:
+                self._close()
+                if attempt:
+                    raise EmbeddingServiceError(f"embedding service request failed: {e}") from e
+                with self.lock:
+                    self.counters["reconnects"] += 1
+
+    def encode(self, sentences, batch_size=None, **kwargs):
+        """Encode a string or list of strings into float32 embeddings via the service."""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        start = time.perf_counter()
+        header, body = self._request({"texts": texts})
+        if "error" in header:
+            raise EmbeddingServiceError(header["error"])
+        vectors = np.frombuffer(body, dtype=np.float32).reshape(header["shape"])
+        with self.lock:
+            self.counters["requests"] += 1
+            self.counters["texts"] += len(texts)
+            self.counters["round_trip_s"] += time.perf_counter() - start
+            self.counters["queue_s"] += header.get("queue_ms", 0.0) / 1000
+        return vectors[0] if single else vectors
+
+    def stats(self):
+        """Client-side counters plus the service's own throughput and queueing metrics."""
+        with self.lock:
+            counters = dict(self.counters)
+        requests = counters["requests"] or 1
+        header, _ = self._request({"stats": True})
+        return {
+            "client": {
+                **counters,
+                "avg_round_trip_ms": 1000 * counters["round_trip_s"] / requests,
+                "avg_queue_ms": 1000 * counters["queue_s"] / requests,
+            },
+            "service": header,
+        }
+
+
+def benchmark(socket_path, threads=16, requests_per_thread=20):
+    """Encode from many threads at once and report throughput and batching."""
+    client = EmbeddingServiceClient(socket_path)
+    queries = ["PAN verification for lending", "bank account verification API",
+               "vendor with lowest p95 latency", "employment verification service"]
+
+    def worker(index):
+        for i in range(requests_per_thread):
+            client.encode([f"{queries[(index + i) % len(queries)]} #{index}-{i}"])
+
+    start = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stats = client.stats()
+    total = threads * requests_per_thread
+    print(f"⏱️  {total} encodes from {threads} threads in {elapsed:.2f}s ({total / elapsed:.0f}/s), "
+          f"avg round trip {stats['client']['avg_round_trip_ms']:.1f} ms")
+    service = stats["service"]
+    print(f"📦 Service: avg batch {service['avg_batch_size']:.1f}, queue wait p50 "
+          f"{service['queue_wait_p50_ms']:.1f} ms / p95 {service['queue_wait_p95_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve query embeddings to chat workers over a Unix socket.")
+    parser.add_argument("--socket", default=EMBEDDING_SERVICE_SOCKET or DEFAULT_SOCKET_PATH)
+    parser.add_argument("--max-batch-size", type=int, default=EMBED_MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=EMBED_MAX_WAIT_MS)
+    parser.add_argument("--bench", action="store_true", help="Benchmark a running service instead of serving.")
+    args = parser.parse_args()
+
+    if args.bench:
+        benchmark(args.socket)
+    else:
+        from onnx_encoder import load_encoder
+        # Same encoder choice as query_db (not imported here: it loads the knowledge base)
+        backend = os.getenv("ENCODER_BACKEND", "torch").lower()
+        print(f"🔄 Loading embedding model into memory ({backend})...")
+        service = EmbeddingService(load_encoder(backend), args.max_batch_size, args.max_wait_ms)
+        asyncio.run(service.serve(args.socket))
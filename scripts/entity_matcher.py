@@ -0,0 +1,282 @@
+import re
+import time
+import argparse
+from collections import namedtuple
+
+from prompt_utils import ALLOWED_HEALTH_METRICS, current_kb
+
+
+# Intent phrases that may precede a mention, normalised to single spaces
+INTENT_PATTERNS = [
+    r'proceed\s+with',
+    r'go\s+with',
+    r'interested\s+in(?:\s+the)?',
+    r'using\s+our\s+platform\s+for',
+    r'category\s+of',
+    r'selected',
+    r'select',
+    r'choose',
+    r'chosen',
+    r'want',
+    r'pick',
+]
+# Characters before a mention searched for an intent phrase
+INTENT_WINDOW = 40
+# Intents that mean the user is picking the entity, per entity type
+# ("category" is the "<name> category" suffix form)
+SELECTION_INTENTS = {
+    "vendor": {"proceed with", "select", "choose", "want", "go with", "pick"},
+    "category": {"category", "selected", "interested in", "interested in the", "want", "chosen",
+                 "category of", "using our platform for"},
+}
+
+# Two or more capitalised parts glued together, like the vendor names ("AzureRaven")
+VENDOR_LIKE_PATTERN = re.compile(r'\b[A-Z][a-z]+(?:[A-Z][a-z]+)+\b')
+# A vendor-like name right after these is being offered as a vendor ("go with X", "backup vendor: X")
+VENDOR_SLOT_BEFORE = re.compile(
+    r'(?:\bvendors?|\bproviders?|\bpartners?|\bgo\s+with|\bproceed\s+with|\brecommend(?:ed|s)?|\bselect(?:ed)?'
+    r'|\bchoose|\bchosen|\bpick(?:ed)?|\bbackup|\bprimary|\balternatives?)\W{0,5}$',
+    re.IGNORECASE
+)
+# ... and so is one followed by "vendor" or its health metrics ("X: successRate 94%", "X (p95 2.1 Secs)")
+VENDOR_SLOT_AFTER = re.compile(
+    r'\W{0,5}(?:vendors?\b|success|latency|avglatency|p\d\d\b|uptime|health|5xx|fivexx|user.?side)',
+    re.IGNORECASE
+)
+# Text between two names of one list ("X, Y and Z"): a name after a slotted name is slotted too
+LIST_SEPARATOR = re.compile(r'\s*(?:,|/|&|\band\b|\bor\b)\s*(?:(?:and|or)\s+)?', re.IGNORECASE)
+
+Mention = namedtuple("Mention", ["type", "name", "intent", "start", "end"])
+
+
+def trie_pattern(words):
+    """Regex source matching any of words, factored into a prefix trie so matching cost does not grow with the word count."""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        alternatives = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not alternatives:
+            return ""
+        body = alternatives[0] if len(alternatives) == 1 else "(?:" + "|".join(alternatives) + ")"
+        # Greedy optional group: the longer name is tried first
+        return "(?:" + body + ")?" if "" in node else body
+
+    return build(trie)
+
+
+class EntityMatcher:
+    """
+    Finds vendor, service, category and health metric mentions in one pass.
+
+    All names are compiled into a single trie-shaped regex over the lower-cased
+    text (longest name wins, so "Phone to Address Advanced (BFSI)" is not read as
+    its prefix). For each mention the intent phrase right before it ("go with",
+    "select", ...) or a "category" suffix after it is recorded.
+    """
+
+    def __init__(self, vendors=None, services=None, categories=None, metrics=ALLOWED_HEALTH_METRICS):
+        if vendors is None or services is None or categories is None:
+            kb = current_kb()
+            vendors = kb.vendors if vendors is None else vendors
+            services = kb.services if services is None else services
+            categories = kb.categories if categories is None else categories
+        # Lower-cased name -> [(type, canonical name)]; a name can belong to several types
+        self.entities = {}
+        for entity_type, names in (("vendor", vendors), ("service", services),
+                                   ("category", categories), ("metric", metrics)):
+            for name in names:
+                entry = (entity_type, name)
+                targets = self.entities.setdefault(name.lower(), [])
+                if entry not in targets:
+                    targets.append(entry)
+
+        self.pattern = re.compile(r'(?<!\w)(?:' + trie_pattern(self.entities) + r')(?!\w)')
+        self.intent_before = re.compile(r'(?<!\w)(' + "|".join(INTENT_PATTERNS) + r')\s+["\']?$')
+        self.category_after = re.compile(r'\s+category\b')
+
+    def find(self, text):
+        """Every mention in text, in order of appearance."""
+        text = text or ""
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            # Some characters change length when lower-cased; keep offsets aligned
+            lowered = "".join(char if len(char.lower()) != 1 else char.lower() for char in text)
+        mentions = []
+        for match in self.pattern.finditer(lowered):
+            start, end = match.span()
+            intent = self.intent_before.search(lowered, max(0, start - INTENT_WINDOW), start)
+            intent = " ".join(intent.group(1).split()) if intent else None
+            for entity_type, name in self.entities[match.group()]:
+                # "<name> category" selects a category whatever verb comes before it
+                if (entity_type == "category" and intent not in SELECTION_INTENTS["category"]
+                        and self.category_after.match(lowered, end)):
+                    mentions.append(Mention(entity_type, name, "category", start, end))
+                else:
+                    mentions.append(Mention(entity_type, name, intent, start, end))
+        return mentions
+
+    def mentioned(self, text, entity_type, mentions=None):
+        """Distinct names of one type mentioned in text, in order of first appearance."""
+        mentions = self.find(text) if mentions is None else mentions
+        return list(dict.fromkeys(m.name for m in mentions if m.type == entity_type))
+
+    def selected(self, text, entity_type, mentions=None):
+        """Distinct names of one type mentioned with a selection intent, in order of appearance."""
+        mentions = self.find(text) if mentions is None else mentions
+        intents = SELECTION_INTENTS.get(entity_type, set())
+        return list(dict.fromkeys(m.name for m in mentions if m.type == entity_type and m.intent in intents))
+
+
+class CurrentMatcher:
+    """
+    The matcher of the current knowledge base state (prompt_utils.current_kb()).
+
+    Each state builds its own EntityMatcher; this forwards to it, so MATCHER
+    follows hot reloads while a turn keeps the one it pinned.
+    """
+
+    def __getattr__(self, name):
+        return getattr(current_kb().matcher, name)
+
+
+MATCHER = CurrentMatcher()
+
+
+def vendor_like_names(value):
+    """Every vendor-like name in the strings (and keys) of a parsed JSON value."""
+    if isinstance(value, str):
+        return set(VENDOR_LIKE_PATTERN.findall(value))
+    names = set()
+    if isinstance(value, dict):
+        for key, item in value.items():
+            names |= vendor_like_names(key) | vendor_like_names(item)
+    elif isinstance(value, list):
+        for item in value:
+            names |= vendor_like_names(item)
+    return names
+
+
+def find_unknown_vendors(text):
+    """
+    Vendor-like names (CamelCase, e.g. "BlueHeron") offered as vendors that the knowledge base does not know.
+
+    Only names in a vendor slot count (see VENDOR_SLOT_BEFORE/AFTER, and lists
+    continuing a slotted name); product names in free text ("LinkedIn") do not.
+    Names used anywhere in the knowledge base ("WhatsApp") are known.
+    """
+    text = text or ""
+    known = current_kb().known_names
+    unknown = []
+    previous_end, previous_slotted = None, False
+    for match in VENDOR_LIKE_PATTERN.finditer(text):
+        start, end = match.span()
+        slotted = (
+            bool(VENDOR_SLOT_BEFORE.search(text, max(0, start - 40), start))
+            or bool(VENDOR_SLOT_AFTER.match(text, end))
+            or (previous_slotted and LIST_SEPARATOR.fullmatch(text, previous_end, start) is not None)
+        )
+        if slotted and match.group() not in known:
+            unknown.append(match.group())
+        previous_end, previous_slotted = end, slotted
+    return list(dict.fromkeys(unknown))
+
+
+# The per-item selection phrases the intent table above replaced, kept for the benchmark
+LEGACY_CATEGORY_PATTERNS = [
+    r'\b{name}\s+category\b',
+    r'selected\s+{name}\b',
+    r'interested\s+in\s+(?:the\s+)?{name}\b',
+    r'want\s+{name}\b',
+    r'chosen\s+{name}\b',
+    r'category\s+of\s+["\']?{name}["\']?',
+    r'using\s+our\s+platform\s+for\s+["\']?{name}["\']?'
+]
+LEGACY_VENDOR_PATTERNS = [
+    r'proceed\s+with\s+{name}\b',
+    r'select\s+{name}\b',
+    r'choose\s+{name}\b',
+    r'want\s+{name}\b',
+    r'go\s+with\s+{name}\b',
+    r'pick\s+{name}\b'
+]
+
+
+def legacy_scan(text):
+    """The per-call loops the matcher replaces (one regex per item and pattern), for benchmarking."""
+    found = {}
+    text_lower = text.lower()
+    kb = current_kb()
+    for entity_type, names in (("vendor", kb.vendors), ("service", kb.services),
+                               ("category", kb.categories), ("metric", ALLOWED_HEALTH_METRICS)):
+        found[entity_type] = [name for name in names
+                              if re.search(r'\b' + re.escape(name.lower()) + r'\b', text_lower)]
+    found["selected_vendor"] = [vendor for vendor in kb.vendors
+                                if any(re.search(p.format(name=re.escape(vendor)), text, re.IGNORECASE)
+                                       for p in LEGACY_VENDOR_PATTERNS)]
+    found["selected_category"] = [category for category in kb.categories
+                                  if any(re.search(p.format(name=re.escape(category)), text, re.IGNORECASE)
+                                         for p in LEGACY_CATEGORY_PATTERNS)]
+    return found
+
+
+def matcher_scan(text):
+    """The same information as legacy_scan from a single matcher pass."""
+    mentions = MATCHER.find(text)
+    found = {entity_type: MATCHER.mentioned(text, entity_type, mentions)
+             for entity_type in ("vendor", "service", "category", "metric")}
+    found["selected_vendor"] = MATCHER.selected(text, "vendor", mentions)
+    found["selected_category"] = MATCHER.selected(text, "category", mentions)
+    return found
+
+
+def benchmark(repeats=200):
+    """
+    Compare the legacy per-item regex loops with the single-pass matcher.
+
+    The legacy r'\\b' + name + r'\\b' patterns never match names ending in ")"
+    (e.g. "PAN Basic (verification)"), so those show up as differences where the
+    matcher is right.
+    """
+    texts = [
+        "Hi, I'm interested in the ONBOARDING KYC/AML category for our lending app.",
+        "STAGE_2\nServices: PAN ADVANCED, PAN Basic (verification), Phone to Address Advanced (BFSI). "
+        "Which one fits your use case?",
+        "Let's go with AzureRaven. EmeraldWhale and GoldenOtter look good too; p95 and successRate matter most.",
+        "STAGE_3\n" + " ".join(f"{vendor}: successRate 90%, avgLatency 1.2 Secs, p99 4 Secs." for vendor in current_kb().vendors),
+    ]
+    for name, scan in (("legacy loops", legacy_scan), ("matcher", matcher_scan)):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for text in texts:
+                scan(text)
+        per_text = (time.perf_counter() - start) / (repeats * len(texts))
+        print(f"⏱️  {name:>12}: {1e6 * per_text:.1f} µs per text")
+
+    differences = 0
+    for text in texts:
+        legacy, matched = legacy_scan(text), matcher_scan(text)
+        for key in legacy:
+            if set(legacy[key]) != set(matched[key]):
+                differences += 1
+                print(f"⚠️  {key} differs for {text[:40]!r}: legacy={legacy[key]} matcher={matched[key]}")
+    print(f"{'✅' if not differences else '⚠️ '} {differences} differences between legacy loops and matcher.")
+    return differences
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or benchmark the entity matcher.")
+    parser.add_argument("text", nargs="?", help="Print the mentions found in this text.")
+    parser.add_argument("--bench", action="store_true", help="Benchmark against the per-item regex loops.")
+    args = parser.parse_args()
+
+    if args.text:
+        for mention in MATCHER.find(args.text):
+            print(mention)
+        print(f"Unknown vendor-like names: {find_unknown_vendors(args.text)}")
+    if args.bench:
+        benchmark()
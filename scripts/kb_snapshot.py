@@ -0,0 +1,334 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+
+import orjson
+
+
+# Get the project root directory (parent of scripts)
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+KNOWLEDGE_BASE_PATH = os.path.join(project_root, 'knowledge_base')
+# Compiled knowledge base read at startup instead of the JSON files
+KB_SNAPSHOT_PATH = os.getenv("KB_SNAPSHOT_PATH", os.path.join(project_root, 'vector_db', 'kb_snapshot.json'))
+# Rebuild the snapshot at load time when a knowledge base file changed since it was built
+KB_SNAPSHOT_AUTO_REBUILD = os.getenv("KB_SNAPSHOT_AUTO_REBUILD", "true").lower() in ("1", "true", "yes")
+
+# Bump when the snapshot layout changes; older snapshots are rebuilt (or rejected without a knowledge base)
+SNAPSHOT_FORMAT_VERSION = 1
+
+SERVICES_DIR = "services"
+VENDOR_HEALTH_FILE = os.path.join("vendors", "vendor_health.json")
+VENDOR_LIST_FILE = os.path.join("vendors", "vendors.json")
+SERVICE_LIST_FILE = "list_of_services.json"
+
+
+class KnowledgeBaseError(RuntimeError):
+    """The knowledge base or its snapshot is missing, unreadable or malformed."""
+
+
+def list_source_files(knowledge_base_path=KNOWLEDGE_BASE_PATH):
+    """Relative paths of every JSON file in the knowledge base, sorted."""
+    paths = []
+    for dirpath, _, filenames in os.walk(knowledge_base_path):
+        paths.extend(os.path.relpath(os.path.join(dirpath, fname), knowledge_base_path)
+                     for fname in filenames if fname.lower().endswith('.json'))
+    return sorted(paths)
+
+
+def source_stamps(knowledge_base_path=KNOWLEDGE_BASE_PATH):
+    """relative path -> [size, mtime_ns]; cheap enough to check on every startup."""
+    stamps = {}
+    for relative_path in list_source_files(knowledge_base_path):
+        stat = os.stat(os.path.join(knowledge_base_path, relative_path))
+        stamps[relative_path] = [stat.st_size, stat.st_mtime_ns]
+    return stamps
+
+
+def content_hash(file_hashes):
+    """Hash of the snapshot format and every source file; identical knowledge bases share it."""
+    digest = hashlib.sha256(f"kb-snapshot-v{SNAPSHOT_FORMAT_VERSION}".encode('utf-8'))
+    for relative_path in sorted(file_hashes):
+        digest.update(relative_path.replace(os.sep, "/").encode('utf-8'))
+        digest.update(bytes.fromhex(file_hashes[relative_path]))
+    return digest.hexdigest()
+
+
+def _require(condition, relative_path, message):
+    if not condition:
+        raise KnowledgeBaseError(f"{relative_path}: {message}")
+
+
+def build_indexes(documents):
+    """
+    The lookup tables the chatbot needs, from parsed knowledge base documents.
+
+    Service files are taken in path order, so allowlists (and therefore prompts)
+    are identical across processes. A service defined by several files keeps the
+    first file's category and validation rules and the union of their vendors.
+    """
+    services = []
+    category_to_services = {}
+    service_to_vendors = {}
+    vendor_to_services = {}
+    service_files = {}
+    validation_rules = {}
+    warnings = []
+
+    service_prefix = SERVICES_DIR + os.sep
+    for relative_path in sorted(path for path in documents if path.startswith(service_prefix)):
+        data = documents[relative_path]
+        _require(isinstance(data, dict), relative_path, "expected a JSON object")
+        service_name = data.get('service_name', data.get('name'))
+        _require(isinstance(service_name, str) and service_name.strip(), relative_path, "missing 'service_name'")
+        category = data.get('category')
+        _require(isinstance(category, str) and category.strip(), relative_path, "missing 'category'")
+        vendors = data.get('available_vendors', [])
+        _require(isinstance(vendors, list), relative_path, "'available_vendors' must be a list")
+
+        service_files.setdefault(service_name, []).append(relative_path)
+        if service_name not in service_to_vendors:
+            services.append(service_name)
+            category_to_services.setdefault(category, []).append(service_name)
+            validation_rules[service_name] = [
+                {key: field.get(key) for key in ("field", "type", "required", "validations")}
+                for field in data.get('request_schema') or [] if isinstance(field, dict)
+            ]
+        available = service_to_vendors.setdefault(service_name, [])
+        for vendor_name in vendors:
+            if vendor_name not in available:
+                available.append(vendor_name)
+            served = vendor_to_services.setdefault(vendor_name, [])
+            if service_name not in served:
+                served.append(service_name)
+
+    _require(services, SERVICES_DIR, "no service files found")
+
+    health = documents.get(VENDOR_HEALTH_FILE)
+    _require(health is not None, VENDOR_HEALTH_FILE, "file is missing")
+    try:
+        health_rows = health['data']['rowData']
+    except (KeyError, TypeError):
+        raise KnowledgeBaseError(f"{VENDOR_HEALTH_FILE}: expected data.rowData") from None
+    vendors = []
+    vendor_metrics = {}
+    for row in health_rows:
+        name = row.get('name') if isinstance(row, dict) else None
+        _require(name, VENDOR_HEALTH_FILE, f"row without a vendor name: {row!r}")
+        vendors.append(name)
+        vendor_metrics[name] = row
+
+    vendor_ids = {}
+    vendor_list = documents.get(VENDOR_LIST_FILE)
+    if vendor_list is not None:
+        for row in vendor_list.get('data') or []:
+            if isinstance(row, dict) and row.get('name'):
+                vendor_ids[row['name']] = row.get('vendor_id')
+
+    service_display_names = {}
+    service_list = documents.get(SERVICE_LIST_FILE)
+    if service_list is not None:
+        for row in (service_list.get('data') or {}).get('rowData') or []:
+            if isinstance(row, dict) and row.get('name'):
+                service_display_names[row['name']] = " ".join(str(row.get('displayName') or row['name']).split())
+
+    for service_name, paths in service_files.items():
+        if len(paths) > 1:
+            warnings.append(f"service '{service_name}' is defined by {len(paths)} files: {', '.join(paths)}")
+    unknown = sorted(set(vendor_to_services) - set(vendor_metrics))
+    if unknown:
+        warnings.append(f"vendors offered by services but missing from {VENDOR_HEALTH_FILE}: {', '.join(unknown)}")
+
+    return {
+        "categories": sorted(category_to_services),
+        "services": services,
+        "category_to_services": category_to_services,
+        "service_to_vendors": service_to_vendors,
+        "vendor_to_services": vendor_to_services,
+        "vendors": vendors,
+        "vendor_metrics": vendor_metrics,
+        "vendor_ids": vendor_ids,
+        "service_display_names": service_display_names,
+        "validation_rules": validation_rules,
+    }, warnings
+
+
+def build_snapshot(knowledge_base_path=KNOWLEDGE_BASE_PATH):
+    """Parse every knowledge base file once and return the snapshot dict; KnowledgeBaseError on any bad file."""
+    if not os.path.isdir(knowledge_base_path):
+        raise KnowledgeBaseError(f"knowledge base not found at {knowledge_base_path}")
+    documents = {}
+    sources = {}
+    for relative_path in list_source_files(knowledge_base_path):
+        path = os.path.join(knowledge_base_path, relative_path)
+        try:
+            with open(path, 'rb') as f:
+                raw = f.read()
+                stat = os.fstat(f.fileno())
+            documents[relative_path] = orjson.loads(raw)
+        except (OSError, orjson.JSONDecodeError) as e:
+            raise KnowledgeBaseError(f"{relative_path}: {e}") from e
+        sources[relative_path] = {"hash": hashlib.sha256(raw).hexdigest(),
+                                  "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    indexes, warnings = build_indexes(documents)
+    return {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "hash": content_hash({path: source["hash"] for path, source in sources.items()}),
+        "built_at": time.time(),
+        "sources": sources,
+        "documents": documents,
+        "indexes": indexes,
+        "warnings": warnings,
+    }
+
+
+def write_snapshot(snapshot, path=KB_SNAPSHOT_PATH):
+    """Atomically replace the snapshot file."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(orjson.dumps(snapshot))
+    os.replace(tmp_path, path)
+
+
+class KnowledgeBaseSnapshot:
+    """
+    The compiled knowledge base: every source document plus prebuilt indexes.
+
+    `hash` identifies the knowledge base content; downstream caches (LLM replies,
+    the Chroma manifest) are only valid for one value.
+    """
+
+    def __init__(self, snapshot, path=None):
+        self.path = path
+        self.format_version = snapshot["format_version"]
+        self.hash = snapshot["hash"]
+        self.built_at = snapshot["built_at"]
+        self.sources = snapshot["sources"]
+        self.documents = snapshot["documents"]
+        self.warnings = snapshot.get("warnings", [])
+        indexes = snapshot["indexes"]
+        self.categories = indexes["categories"]
+        self.services = indexes["services"]
+        self.category_to_services = indexes["category_to_services"]
+        self.service_to_vendors = indexes["service_to_vendors"]
+        self.vendor_to_services = indexes["vendor_to_services"]
+        self.vendors = indexes["vendors"]
+        self.vendor_metrics = indexes["vendor_metrics"]
+        self.vendor_ids = indexes["vendor_ids"]
+        self.service_display_names = indexes["service_display_names"]
+        self.validation_rules = indexes["validation_rules"]
+
+    def is_stale(self, knowledge_base_path=KNOWLEDGE_BASE_PATH):
+        """True when a knowledge base file was added, removed or modified since the build."""
+        recorded = {path: [source["size"], source["mtime_ns"]] for path, source in self.sources.items()}
+        return source_stamps(knowledge_base_path) != recorded
+
+
+def load_snapshot(path=KB_SNAPSHOT_PATH, knowledge_base_path=KNOWLEDGE_BASE_PATH,
+                  auto_rebuild=KB_SNAPSHOT_AUTO_REBUILD):
+    """
+    Load the snapshot, rebuilding it first if it is missing or out of date.
+
+    Without a knowledge base directory (a deployment shipping only the snapshot)
+    the file is used as is. Raises KnowledgeBaseError when neither gives a usable
+    knowledge base.
+    """
+    have_sources = os.path.isdir(knowledge_base_path)
+    snapshot = None
+    try:
+        with open(path, 'rb') as f:
+            data = orjson.loads(f.read())
+        if data.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+            raise KnowledgeBaseError(f"snapshot format {data.get('format_version')}, "
+                                     f"expected {SNAPSHOT_FORMAT_VERSION}")
+        snapshot = KnowledgeBaseSnapshot(data, path)
+    except FileNotFoundError:
+        if not have_sources:
+            raise KnowledgeBaseError(f"no knowledge base snapshot at {path} and no knowledge base "
+                                     f"at {knowledge_base_path}") from None
+    except (OSError, orjson.JSONDecodeError, KeyError, KnowledgeBaseError) as e:
+        if not have_sources:
+            raise KnowledgeBaseError(f"unusable knowledge base snapshot {path}: {e}") from e
+        print(f"⚠️  Ignoring unusable knowledge base snapshot {path}: {e}")
+
+    if snapshot is not None and not (have_sources and auto_rebuild and snapshot.is_stale(knowledge_base_path)):
+        return snapshot
+
+    if snapshot is not None:
+        print("🔄 Knowledge base changed since the snapshot was built, rebuilding it...")
+    data = build_snapshot(knowledge_base_path)
+    for warning in data["warnings"]:
+        print(f"⚠️  Knowledge base: {warning}")
+    try:
+        write_snapshot(data, path)
+    except OSError as e:
+        # Still usable from memory; the next start rebuilds again
+        print(f"⚠️  Could not write knowledge base snapshot {path}: {e}")
+    return KnowledgeBaseSnapshot(data, path)
+
+
+_snapshot = None
+
+
+def get_snapshot():
+    """The process-wide knowledge base snapshot, loaded on first use."""
+    global _snapshot
+    if _snapshot is None:
+        _snapshot = load_snapshot()
+    return _snapshot
+
+
+def set_snapshot(snapshot):
+    """Make `snapshot` the process-wide one (after a hot reload, see kb_watcher.py)."""
+    global _snapshot
+    _snapshot = snapshot
+
+
+def benchmark(repeats=20):
+    """Compare loading the snapshot with parsing the knowledge base directory."""
+    def timed(fn):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            fn()
+        return (time.perf_counter() - start) / repeats
+
+    def parse_directory():
+        for relative_path in list_source_files():
+            with open(os.path.join(KNOWLEDGE_BASE_PATH, relative_path), 'r', encoding='utf-8') as f:
+                json.load(f)
+
+    directory_s = timed(parse_directory)
+    snapshot_s = timed(lambda: load_snapshot(auto_rebuild=False))
+    checked_s = timed(lambda: load_snapshot())
+    print(f"⏱️  Parse {len(list_source_files())} JSON files: {directory_s * 1000:.1f} ms | load snapshot: "
+          f"{snapshot_s * 1000:.1f} ms ({checked_s * 1000:.1f} ms with the staleness check)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile the knowledge base into a versioned snapshot.")
+    parser.add_argument("--output", default=KB_SNAPSHOT_PATH)
+    parser.add_argument("--check", action="store_true", help="Validate the knowledge base without writing.")
+    parser.add_argument("--bench", action="store_true", help="Time snapshot loading against parsing the files.")
+    args = parser.parse_args()
+
+    if args.bench:
+        benchmark()
+        raise SystemExit(0)
+    start = time.perf_counter()
+    try:
+        data = build_snapshot()
+    except KnowledgeBaseError as e:
+        raise SystemExit(f"❌ Invalid knowledge base: {e}")
+    for warning in data["warnings"]:
+        print(f"⚠️  {warning}")
+    indexes = data["indexes"]
+    print(f"✅ {len(data['sources'])} files: {len(indexes['categories'])} categories, "
+          f"{len(indexes['services'])} services, {len(indexes['vendors'])} vendors "
+          f"in {time.perf_counter() - start:.2f}s (hash {data['hash'][:12]})")
+    if not args.check:
+        write_snapshot(data, args.output)
+        print(f"📦 Snapshot written to {args.output} ({os.path.getsize(args.output) / 1024:.0f} KB)")
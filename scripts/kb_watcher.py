@@ -0,0 +1,130 @@
+import os
+import sys
+import time
+import argparse
+import threading
+import subprocess
+
+from kb_snapshot import KNOWLEDGE_BASE_PATH, KnowledgeBaseError, load_snapshot, set_snapshot
+from prompt_utils import KnowledgeBaseState, current_kb, swap_kb
+
+
+# Watch knowledge_base/ and hot-reload edits in the running chatbot (main.py, server.py, prefork.py)
+KB_WATCH = os.getenv("KB_WATCH", "false").lower() in ("1", "true", "yes")
+# Quiet period after the last change before reloading, so a save or a multi-file copy is one reload
+KB_WATCH_DEBOUNCE_MS = int(os.getenv("KB_WATCH_DEBOUNCE_MS", "500"))
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def is_kb_file(change, path):
+    """watchfiles filter: only the JSON files make up the knowledge base."""
+    return path.endswith(".json")
+
+
+def reindex_in_process(snapshot):
+    """
+    Upsert the changed chunks with this process's Chroma client and encoder, then
+    reload the retrieval index. The chunks are embedded by the query encoder
+    (the embedding service uses the same ENCODER_BACKEND), so torch is only
+    loaded here if the chatbot already runs it.
+    """
+    import embedding
+    import query_db
+    upserted, deleted = embedding.main(num_processes=0, snapshot=snapshot, client=query_db.get_chroma_client(),
+                                       model=query_db.get_model(), encoder=query_db.ENCODER_BACKEND)
+    if upserted or deleted:
+        query_db.reload_index()
+    return upserted, deleted
+
+
+def reindex_in_subprocess(snapshot=None):
+    """
+    Run embedding.py (incremental) in a child process, for parents that must not
+    open Chroma or run the encoder themselves (prefork.py). The caller reloads the
+    index from disk afterwards.
+    """
+    subprocess.run([sys.executable, os.path.join(script_dir, "embedding.py"), "--processes", "0"], check=True)
+    return None, None
+
+
+def reload_knowledge_base(reindex=reindex_in_process):
+    """
+    Bring the running chatbot in line with knowledge_base/.
+
+    Rebuilds the snapshot, re-chunks and upserts only the chunks of changed files
+    (`reindex`, None to skip), builds the new allowlists, prompt prefixes, matcher
+    and vendor table, and only then swaps the new state in. Turns already running
+    finish on the state they pinned; the next turn sees the new one. An invalid
+    knowledge base or a failed re-index keeps the current state.
+    Returns the new state, or None if nothing was swapped.
+    """
+    start = time.perf_counter()
+    previous = current_kb()
+    try:
+        snapshot = load_snapshot()
+    except KnowledgeBaseError as e:
+        print(f"⚠️  Invalid knowledge base, keeping version {previous.version[:12]}: {e}")
+        return None
+    # The index can lag the snapshot (e.g. the snapshot was rebuilt on import), so re-index either way
+    state = previous if snapshot.hash == previous.version else KnowledgeBaseState(snapshot).warm()
+    if reindex is not None:
+        try:
+            upserted, deleted = reindex(snapshot)
+        except Exception as e:
+            print(f"⚠️  Re-index failed, keeping version {previous.version[:12]}: {e}")
+            return None
+        if upserted is not None:
+            print(f"📦 Re-indexed {upserted} changed chunks, deleted {deleted} stale chunks.")
+    if state is previous:
+        print(f"✅ Knowledge base content unchanged ({previous.version[:12]}).")
+        return None
+
+    set_snapshot(snapshot)
+    swap_kb(state)
+    print(f"✅ Knowledge base {previous.version[:12]} → {state.version[:12]} live in "
+          f"{time.perf_counter() - start:.2f}s ({len(state.categories)} categories, "
+          f"{len(state.services)} services, {len(state.vendors)} vendors).")
+    return state
+
+
+def watch(path=KNOWLEDGE_BASE_PATH, on_change=reload_knowledge_base,
+          debounce_ms=KB_WATCH_DEBOUNCE_MS, stop_event=None):
+    """Call on_change() after every (debounced) batch of JSON file changes under path, until stop_event is set."""
+    from watchfiles import watch as watch_changes
+
+    print(f"🔄 Watching {path} for knowledge base changes...")
+    for changes in watch_changes(path, watch_filter=is_kb_file, debounce=debounce_ms, stop_event=stop_event):
+        changed = sorted({os.path.relpath(changed_path, path) for _, changed_path in changes})
+        print(f"🔄 Knowledge base changed: {', '.join(changed)}")
+        try:
+            on_change()
+        except Exception as e:
+            # A bad edit must not kill the watcher; the next save is picked up again
+            print(f"⚠️  Knowledge base reload failed: {e}")
+
+
+def start_watcher(path=KNOWLEDGE_BASE_PATH, on_change=reload_knowledge_base):
+    """Run watch() in a daemon thread; returns (thread, stop_event)."""
+    stop_event = threading.Event()
+    thread = threading.Thread(target=watch, kwargs={"path": path, "on_change": on_change, "stop_event": stop_event},
+                              name="kb-watcher", daemon=True)
+    thread.start()
+    return thread, stop_event
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Re-index knowledge_base/ whenever a JSON file changes (the chatbot itself does this with KB_WATCH=true)."
+    )
+    parser.add_argument("--path", default=KNOWLEDGE_BASE_PATH)
+    parser.add_argument("--once", action="store_true", help="Reload once now and exit instead of watching.")
+    args = parser.parse_args()
+
+    if args.once:
+        reload_knowledge_base()
+    else:
+        try:
+            watch(args.path)
+        except KeyboardInterrupt:
+            pass
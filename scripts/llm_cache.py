@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+# Get the project root directory (parent of scripts)
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+DEFAULT_CACHE_PATH = os.path.join(project_root, 'vector_db', 'llm_cache.sqlite3')
+# Templates whose edits must invalidate cached replies
+PROMPT_TEMPLATE_FILES = [os.path.join(script_dir, 'prompt_utils.py')]
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+DEFAULT_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(24 * 3600)))
+DEFAULT_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+
+
+def cache_key(model, system_message, prompt, params, fingerprint=""):
+    """Hash of everything that determines a temperature-0 completion, under one knowledge base fingerprint."""
+    payload = json.dumps([model, system_message, prompt, params, fingerprint], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def compute_fingerprint(kb_version=None, template_files=PROMPT_TEMPLATE_FILES):
+    """Hash of the knowledge base snapshot and prompt templates; cached replies are only valid for one value."""
+    if kb_version is None:
+        from kb_snapshot import get_snapshot
+        kb_version = get_snapshot().hash
+    digest = hashlib.sha256(kb_version.encode('utf-8'))
+    for path in template_files:
+        digest.update(os.path.relpath(path, project_root).encode('utf-8'))
+        with open(path, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Persistent (SQLite) cache of LLM replies keyed by prompt hash.
+
+    Entries expire after `ttl` seconds and the least recently used ones are evicted
+    beyond `max_entries`. Keys include the fingerprint (knowledge base + prompt
+    templates, see compute_fingerprint), so processes on different knowledge base
+    versions can share the file: replies of other versions are never matched and
+    age out like any other entry.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+
+    def get(self, key):
+        """Return the cached reply for `key`, or None on a miss."""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT response, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            response, created_at = row
+            with self.conn:
+                if now - created_at > self.ttl:
+                    self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    self.expirations += 1
+                    self.misses += 1
+                    return None
+                self.conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return response
+
+    def put(self, key, response):
+        """Store a reply, evicting least recently used entries beyond max_entries. Storing a key again keeps its age."""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO entries (key, response, created_at, last_access) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET response = excluded.response, last_access = excluded.last_access",
+                (key, response, now, now)
+            )
+            (count,) = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+            excess = count - self.max_entries
+            if excess > 0:
+                self.conn.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_access LIMIT ?)",
+                    (excess,)
+                )
+                self.evictions += excess
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM entries")
+
+    def stats(self):
+        """Hit/miss counters and current size."""
+        with self.lock:
+            (count,) = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "entries": count,
+        }
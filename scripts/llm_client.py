@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import threading
+
+import httpx
+from tenacity import (
+    AsyncRetrying,
+    retry_if_exception_type,
+    stop_after_attempt,
+    stop_before_delay,
+    wait_random_exponential,
+)
+
+
+# OpenAI-compatible endpoint; point it at stub_llm_server.py to run without the real API
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.groq.com/openai/v1")
+# Seconds per HTTP attempt, and for the whole call including retries
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "60"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+# Requests in flight at once (further calls wait) and pooled keep-alive connections
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+# Append every completion to this JSONL file so stub_llm_server.py can replay it
+LLM_RECORD_PATH = os.getenv("LLM_RECORD_PATH")
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMError(RuntimeError):
+    """An LLM call failed for good (bad request, retries or deadline exhausted)."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class RetryableLLMError(LLMError):
+    """A transient failure (rate limit, 5XX, timeout, dropped connection)."""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message, status)
+        self.retry_after = retry_after
+
+
+def recording_key(model, messages):
+    """Hash identifying a completion request in a recordings file."""
+    payload = json.dumps([model, messages], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def parse_retry_after(value):
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+_jitter = wait_random_exponential(multiplier=0.5, max=8)
+
+
+def wait_for_retry(retry_state):
+    """Full-jitter exponential backoff, but never sooner than the server's Retry-After."""
+    error = retry_state.outcome.exception()
+    return max(_jitter(retry_state), getattr(error, "retry_after", None) or 0.0)
+
+
+def _error_for_status(status, body, headers):
+    message = f"LLM API returned {status}: {body[:200]}"
+    if status in RETRYABLE_STATUS_CODES:
+        return RetryableLLMError(message, status, parse_retry_after(headers.get("retry-after")))
+    return LLMError(message, status)
+
+
+class AsyncLLMClient:
+    """
+    OpenAI-compatible chat completions client for asyncio code.
+
+    One pooled httpx.AsyncClient is reused for every call. At most
+    `max_concurrency` requests are in flight; transient failures (429, 5XX,
+    timeouts) are retried with jittered exponential backoff, honouring
+    Retry-After, until `max_attempts` or the `deadline` (seconds for the whole
+    call) runs out. Streams are only retried before their first token.
+    """
+
+    def __init__(self, base_url=LLM_BASE_URL, api_key=None, timeout=LLM_TIMEOUT_SECONDS,
+                 deadline=LLM_DEADLINE_SECONDS, max_attempts=LLM_MAX_ATTEMPTS,
+                 max_concurrency=LLM_MAX_CONCURRENCY, max_connections=LLM_MAX_CONNECTIONS,
+                 record_path=LLM_RECORD_PATH):
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.http = httpx.AsyncClient(
+            base_url=base_url.rstrip("/"),
+            headers=headers,
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 10.0)),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.record_path = record_path
+        self._record_lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "in_flight": 0}
+
+    async def _call(self, attempt_fn):
+        """Run attempt_fn(timeout) under the concurrency cap with deadline-aware retries."""
+        deadline_at = time.monotonic() + self.deadline
+
+        def count_retry(retry_state):
+            self.stats["retries"] += 1
+            print(f"🔄 LLM call failed ({retry_state.outcome.exception()}), "
+                  f"retrying in {retry_state.next_action.sleep:.1f}s")
+
+        async with self.semaphore:
+            self.stats["requests"] += 1
+            self.stats["in_flight"] += 1
+            try:
+                async for attempt in AsyncRetrying(
+                    stop=stop_after_attempt(self.max_attempts) | stop_before_delay(self.deadline),
+                    wait=wait_for_retry,
+                    retry=retry_if_exception_type(RetryableLLMError),
+                    before_sleep=count_retry,
+                    reraise=True,
+                ):
+                    with attempt:
+                        remaining = deadline_at - time.monotonic()
+                        if remaining <= 0:
+                            raise LLMError(f"LLM call exceeded its {self.deadline:.0f}s deadline")
+                        try:
+                            return await attempt_fn(min(self.timeout, remaining))
+                        except httpx.TimeoutException as e:
+                            raise RetryableLLMError(f"LLM request timed out ({type(e).__name__})") from e
+                        except httpx.TransportError as e:
+                            raise RetryableLLMError(f"LLM connection failed ({e})") from e
+            except LLMError:
+                self.stats["failures"] += 1
+                raise
+            finally:
+                self.stats["in_flight"] -= 1
+
+    async def complete(self, model, messages, **params):
+        """The assistant reply for a chat completion request."""
+        async def attempt(timeout):
+            response = await self.http.post(
+                "/chat/completions",
+                json={"model": model, "messages": messages, **params},
+                timeout=timeout,
+            )
+            if response.status_code != 200:
+                raise _error_for_status(response.status_code, response.text, response.headers)
+            return response.json()["choices"][0]["message"]["content"] or ""
+
+        reply = await self._call(attempt)
+        self.record(model, messages, reply)
+        return reply
+
+    async def stream(self, model, messages, on_token=None, **params):
+        """
+        Stream a chat completion, calling on_token(text) for each piece.
+
+        Returns (reply, metrics) with "ttft_s" (time to first token) and "total_s".
+        """
+        start = time.perf_counter()
+        parts = []
+        first_token_at = None
+
+        async def attempt(timeout):
+            nonlocal first_token_at
+            async with self.http.stream(
+                "POST", "/chat/completions",
+                json={"model": model, "messages": messages, "stream": True, **params},
+                timeout=timeout,
+            ) as response:
+                if response.status_code != 200:
+                    body = (await response.aread()).decode("utf-8", "replace")
+                    raise _error_for_status(response.status_code, body, response.headers)
+                try:
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            break
+                        choices = json.loads(data).get("choices") or []
+                        token = choices[0].get("delta", {}).get("content") if choices else None
+                        if not token:
+                            continue
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        parts.append(token)
+                        if on_token:
+                            on_token(token)
+                except (httpx.TimeoutException, httpx.TransportError) as e:
+                    if parts:
+                        # Tokens already reached the caller; a retry would repeat them
+                        raise LLMError(f"LLM stream broke after {len(parts)} tokens ({e})") from e
+                    raise
+
+        await self._call(attempt)
+        end = time.perf_counter()
+        reply = "".join(parts)
+        self.record(model, messages, reply)
+        return reply, {"ttft_s": (first_token_at or end) - start, "total_s": end - start}
+
+    def record(self, model, messages, reply):
+        if not self.record_path or not reply:
+            return
+        line = json.dumps({"key": recording_key(model, messages), "model": model,
+                           "messages": messages, "reply": reply})
+        with self._record_lock, open(self.record_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+class LLMClient:
+    """
+    Blocking facade over AsyncLLMClient for threaded callers.
+
+    The async client lives on a private event loop thread, so every caller (the
+    terminal loop or the server's turn threads) shares its connection pool,
+    concurrency cap and retry policy.
+    """
+
+    def __init__(self, **kwargs):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="llm-client", daemon=True)
+        self.thread.start()
+        self.client = self._run(self._create(kwargs))
+
+    @staticmethod
+    async def _create(kwargs):
+        return AsyncLLMClient(**kwargs)
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def complete(self, model, messages, **params):
+        return self._run(self.client.complete(model, messages, **params))
+
+    def stream(self, model, messages, on_token=None, **params):
+        """Like AsyncLLMClient.stream; on_token is called from the client's loop thread."""
+        return self._run(self.client.stream(model, messages, on_token=on_token, **params))
+
+    @property
+    def stats(self):
+        return dict(self.client.stats)
+
+    def close(self):
+        self._run(self.client.aclose())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+async def load_test(base_url, model, requests, concurrency, stream):
+    """Fire `requests` completions, `concurrency` at a time, and report latency and throughput."""
+    client = AsyncLLMClient(base_url=base_url, api_key=os.getenv("GROQ_API_KEY"), max_concurrency=concurrency)
+    messages = [{"role": "user", "content": "Which fintech category fits a lending app?"}]
+    latencies = []
+    failures = 0
+
+    async def one():
+        nonlocal failures
+        start = time.perf_counter()
+        try:
+            if stream:
+                await client.stream(model, messages)
+            else:
+                await client.complete(model, messages)
+        except LLMError as e:
+            failures += 1
+            print(f"⚠️  {e}")
+            return
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    await client.aclose()
+
+    latencies.sort()
+    if latencies:
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"⏱️  {len(latencies)} ok, {failures} failed in {elapsed:.2f}s "
+              f"({len(latencies) / elapsed:.1f} req/s), p50 {p50:.3f}s, p95 {p95:.3f}s, "
+              f"{client.stats['retries']} retries")
+    else:
+        print(f"⚠️  All {failures} requests failed.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test an OpenAI-compatible LLM endpoint.")
+    parser.add_argument("--base-url", default=LLM_BASE_URL)
+    parser.add_argument("--model", default="llama-3.1-8b-instant")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=LLM_MAX_CONCURRENCY)
+    parser.add_argument("--stream", action="store_true", help="Use streaming completions.")
+    args = parser.parse_args()
+
+    asyncio.run(load_test(args.base_url, args.model, args.requests, args.concurrency, args.stream))
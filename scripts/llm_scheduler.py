@@ -0,0 +1,234 @@
+import os
+import time
+import heapq
+import random
+import argparse
+import itertools
+import threading
+from collections import deque
+
+
+# Provider quotas (requests and tokens per minute); 0 disables a limit
+LLM_RPM_LIMIT = int(os.getenv("LLM_RPM_LIMIT", "30"))
+LLM_TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", "6000"))
+# Completion tokens charged up front per call; corrected once the reply is known
+LLM_EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "300"))
+# A call that would have to wait is shed at once when this many are queued (0 = never queue),
+# and shed if it cannot start within the wait limit
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "100"))
+LLM_MAX_QUEUE_WAIT_SECONDS = float(os.getenv("LLM_MAX_QUEUE_WAIT_SECONDS", "20"))
+
+# Lower runs first: short greetings and workflow explanations ahead of large vendor analyses
+STAGE_PRIORITIES = {
+    "STAGE_1": 0,
+    "STAGE_4": 1,
+    "STAGE_2": 2,
+    "STAGE_3": 3,
+}
+DEFAULT_PRIORITY = 2
+
+
+class LLMOverloaded(RuntimeError):
+    """The scheduler shed the call: the queue is full or the quota would not free up in time."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows `rate` units per minute with bursts up to one minute's worth; may go into debt."""
+
+    def __init__(self, rate, now=None, time_scale=1.0):
+        self.capacity = float(rate)
+        # time_scale > 1 runs the clock faster, for simulations
+        self.refill_per_second = rate / 60.0 * time_scale
+        self.level = self.capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` units are available."""
+        self.refill(now)
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.refill_per_second)
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount):
+        """Charge (positive) or refund (negative) units after the fact."""
+        self.level = min(self.capacity, self.level - amount)
+
+
+class Ticket:
+    """An admitted call; settle() corrects the token charge with the actual usage."""
+
+    def __init__(self, scheduler, tokens, waited):
+        self.scheduler = scheduler
+        self.tokens = tokens
+        self.waited = waited
+
+    def settle(self, actual_tokens):
+        self.scheduler.settle(actual_tokens - self.tokens)
+        self.tokens = actual_tokens
+
+
+class LLMScheduler:
+    """
+    Process-wide admission control in front of the LLM.
+
+    Each call asks for one request and its estimated tokens from the RPM and TPM
+    buckets. Waiting calls are admitted strictly by (priority, arrival), so a
+    burst of STAGE_3 analyses cannot starve STAGE_1 greetings. A call that fits
+    the quota with nobody ahead of it goes out without queueing. Instead of
+    letting calls fail against the provider's quota, a call that would have to
+    wait is shed (LLMOverloaded) when the queue already holds `max_queue` calls
+    or when it could not start within `max_wait` seconds.
+    """
+
+    def __init__(self, rpm=LLM_RPM_LIMIT, tpm=LLM_TPM_LIMIT, max_queue=LLM_MAX_QUEUE,
+                 max_wait=LLM_MAX_QUEUE_WAIT_SECONDS, time_scale=1.0):
+        self.requests = TokenBucket(rpm, time_scale=time_scale) if rpm else None
+        self.tokens = TokenBucket(tpm, time_scale=time_scale) if tpm else None
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.condition = threading.Condition()
+        self.queue = []
+        self.arrivals = itertools.count()
+        self.waits = deque(maxlen=1000)
+        self.admitted = {}
+        self.shed = {}
+        self.max_queue_depth = 0
+
+    def _wait_time(self, tokens, now):
+        return max(
+            self.requests.wait_time(1, now) if self.requests else 0.0,
+            self.tokens.wait_time(tokens, now) if self.tokens else 0.0,
+        )
+
+    def _admit(self, tokens, priority, waited):
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens:
+            self.tokens.take(tokens)
+        self.waits.append(waited)
+        self.admitted[priority] = self.admitted.get(priority, 0) + 1
+        return Ticket(self, tokens, waited)
+
+    def _shed(self, priority, message, retry_after=None):
+        self.shed[priority] = self.shed.get(priority, 0) + 1
+        raise LLMOverloaded(message, retry_after)
+
+    def admit(self, tokens, priority=DEFAULT_PRIORITY, max_wait=None):
+        """Block until the call may go out and return its Ticket, or raise LLMOverloaded."""
+        max_wait = self.max_wait if max_wait is None else max_wait
+        with self.condition:
+            entry = (priority, next(self.arrivals))
+            if (not self.queue or entry < self.queue[0]) and self._wait_time(tokens, time.monotonic()) <= 0:
+                return self._admit(tokens, priority, 0.0)
+            if len(self.queue) >= self.max_queue:
+                self._shed(priority, f"LLM queue full ({len(self.queue)} calls waiting)")
+            heapq.heappush(self.queue, entry)
+            self.max_queue_depth = max(self.max_queue_depth, len(self.queue))
+            start = time.monotonic()
+            try:
+                while True:
+                    now = time.monotonic()
+                    remaining = start + max_wait - now
+                    if self.queue[0] == entry:
+                        wait = self._wait_time(tokens, now)
+                        if wait <= 0:
+                            break
+                        if wait > remaining:
+                            # The quota will not free up in time; fail now rather than at the deadline
+                            self._shed(priority, f"LLM quota exhausted for the next {wait:.1f}s", retry_after=wait)
+                        self.condition.wait(wait)
+                    else:
+                        if remaining <= 0:
+                            self._shed(priority, f"waited {max_wait:.0f}s behind {len(self.queue) - 1} LLM calls",
+                                       retry_after=max_wait)
+                        self.condition.wait(remaining)
+                return self._admit(tokens, priority, time.monotonic() - start)
+            finally:
+                self.queue.remove(entry)
+                heapq.heapify(self.queue)
+                self.condition.notify_all()
+
+    def settle(self, extra_tokens):
+        if self.tokens and extra_tokens:
+            with self.condition:
+                self.tokens.adjust(extra_tokens)
+                self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            waits = sorted(self.waits)
+            return {
+                "queue_depth": len(self.queue),
+                "max_queue_depth": self.max_queue_depth,
+                "admitted": sum(self.admitted.values()),
+                "shed": sum(self.shed.values()),
+                "shed_by_priority": dict(self.shed),
+                "wait_avg_s": sum(waits) / len(waits) if waits else 0.0,
+                "wait_p95_s": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+                "wait_max_s": waits[-1] if waits else 0.0,
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """The process-wide scheduler, created on first use."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = LLMScheduler()
+    return _scheduler
+
+
+def simulate(calls=60, rpm=30, tpm=6000, max_wait=5.0, speedup=20.0):
+    """Fire a burst of mixed-stage calls at a scheduler (time sped up) and print the outcome."""
+    # Shrink a minute so the simulation finishes quickly
+    scheduler = LLMScheduler(rpm=rpm, tpm=tpm, max_wait=max_wait / speedup, time_scale=speedup)
+    stage_tokens = {"STAGE_1": 600, "STAGE_2": 1800, "STAGE_3": 1500, "STAGE_4": 700}
+    outcomes = {stage: [0, 0] for stage in stage_tokens}
+
+    def call(stage):
+        try:
+            ticket = scheduler.admit(stage_tokens[stage] + LLM_EXPECTED_COMPLETION_TOKENS, STAGE_PRIORITIES[stage])
+        except LLMOverloaded:
+            outcomes[stage][1] += 1
+            return
+        time.sleep(0.02)
+        ticket.settle(stage_tokens[stage] + random.randint(50, 400))
+        outcomes[stage][0] += 1
+
+    threads = [threading.Thread(target=call, args=(random.choice(list(stage_tokens)),)) for _ in range(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for stage, (ok, shed) in outcomes.items():
+        print(f"   {stage}: {ok} admitted, {shed} shed")
+    stats = scheduler.stats()
+    print(f"⏱️  Queue wait (simulated seconds): avg {stats['wait_avg_s'] * speedup:.1f}, "
+          f"p95 {stats['wait_p95_s'] * speedup:.1f}, max {stats['wait_max_s'] * speedup:.1f}; "
+          f"max queue depth {stats['max_queue_depth']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate a burst of LLM calls through the admission scheduler.")
+    parser.add_argument("--calls", type=int, default=60)
+    parser.add_argument("--rpm", type=int, default=LLM_RPM_LIMIT or 30)
+    parser.add_argument("--tpm", type=int, default=LLM_TPM_LIMIT or 6000)
+    parser.add_argument("--max-wait", type=float, default=LLM_MAX_QUEUE_WAIT_SECONDS)
+    args = parser.parse_args()
+
+    simulate(args.calls, args.rpm, args.tpm, args.max_wait)
@@ -1,125 +1,226 @@
+import time
+_process_start = time.perf_counter()
+
 from prompt_utils import (
-    build_prompt,
-    ALLOWED_VENDORS,
-    ALLOWED_SERVICES,
-    ALLOWED_CATEGORIES,
+    get_static_prefix,
+    current_kb,
+    pinned_kb,
     ALLOWED_HEALTH_METRICS,
-    CATEGORY_TO_SERVICES  # <-- import the mapping
+    vendors_for_service,
+    service_code
 )
+from entity_matcher import MATCHER, find_unknown_vendors
 from state_manager import SessionManager
-from query_db import get_relevant_chunks
-from groq import Groq
+from selections import Selections
+from token_budget import build_budgeted_prompt, static_prefix_report, count_tokens
+from query_db import get_relevant_chunks, get_chunks_by_key, warm_up, STARTUP_TIMINGS
+from vendor_ranking import rank_vendors, format_ranking_table
+from workflow import (
+    build_workflow,
+    format_workflow_reply,
+    reasoning_prompt,
+    template_reasoning,
+    WorkflowError,
+    WORKFLOW_LLM_REASONING
+)
+from llm_cache import LLMResponseCache, LLM_CACHE_ENABLED, cache_key, compute_fingerprint
+from kb_watcher import KB_WATCH, start_watcher
+from llm_scheduler import (
+    get_scheduler,
+    LLMOverloaded,
+    STAGE_PRIORITIES,
+    DEFAULT_PRIORITY,
+    LLM_EXPECTED_COMPLETION_TOKENS
+)
 from dotenv import load_dotenv
 import os
 import re
+import json
+import threading
 from typing import Tuple, List
 
 # === Config ===
 load_dotenv()
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 MODEL = "llama-3.1-8b-instant"  # Use a Groq-supported model
+SYSTEM_PROMPT = "You are a conversational fintech solutions advisor."
+# Sampling parameters for every completion (part of the response cache key)
+LLM_PARAMS = {"temperature": 0, "max_tokens": 1024}
+# Print the reply token by token as it arrives instead of after the full completion
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() in ("1", "true", "yes")
+# Stored and shown instead of a reply the guardrail rejects
+GUARDRAIL_FALLBACK = ("{stage}\n\nSorry, I could not answer that using only the vendors and services "
+                      "in our knowledge base. Could you rephrase or pick one of the options listed earlier?")
+# Shown (not stored) when the LLM scheduler sheds a turn under load
+OVERLOADED_REPLY = ("{stage}\n\nWe are handling a lot of requests right now. "
+                    "Please send your message again in a few seconds.")
+
+# === LLM Client Setup ===
+# Created on first use so importing this module does not pay for the HTTP client stack
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the shared LLM client (pooled connections, retries, concurrency cap), creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from llm_client import LLMClient
+                _client = LLMClient(api_key=GROQ_API_KEY)
+    return _client
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """Return the shared LLM response cache, or None if LLM_CACHE_ENABLED is off."""
+    global _llm_cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _llm_cache is None:
+        with _llm_cache_lock:
+            if _llm_cache is None:
+                _llm_cache = LLMResponseCache()
+    return _llm_cache
+
+
+# Cache fingerprint of one knowledge base version, so a hot reload moves to new keys: (version, fingerprint)
+_llm_fingerprint = (None, None)
+
+
+def llm_cache_key(prompt: str, system_message: str) -> str:
+    """Response cache key of a call under the current knowledge base state."""
+    global _llm_fingerprint
+    version, fingerprint = _llm_fingerprint
+    kb_version = current_kb().version
+    if version != kb_version:
+        fingerprint = compute_fingerprint(kb_version)
+        _llm_fingerprint = (kb_version, fingerprint)
+    return cache_key(MODEL, system_message, prompt, LLM_PARAMS, fingerprint)
+
+
+def remember_reply(key: str, reply: str):
+    """Cache a reply under `key` (see llm_cache_key); only called once the reply passed the guardrail."""
+    cache = get_llm_cache()
+    if cache and key and reply:
+        cache.put(key, reply)
+
+
+# Per-stage system messages (role + static prompt prefix) of one knowledge base version,
+# built once so every call for a stage starts with the same bytes and provider-side
+# prompt caching can apply: (version, stage -> message)
+_system_messages = (None, {})
+
+
+def get_system_message(stage: str) -> str:
+    """System message for a stage: the role line plus the stage's static prompt prefix."""
+    global _system_messages
+    kb = current_kb()
+    version, messages = _system_messages
+    if version != kb.version:
+        messages = {name: f"{SYSTEM_PROMPT}\n\n{prefix}" for name, prefix in kb.static_prefixes.items()}
+        _system_messages = (kb.version, messages)
+    message = messages.get(stage)
+    return message if message is not None else f"{SYSTEM_PROMPT}\n\n{get_static_prefix(stage)}"
+
+# === Call the LLM (Groq Cloud or any OpenAI-compatible endpoint) ===
+def admit_llm_call(prompt: str, system_message: str, stage: str = None):
+    """
+    Wait for the scheduler to admit a call of this size (see llm_scheduler).
+    Returns (ticket, prompt_tokens); raises LLMOverloaded if the call is shed.
+    """
+    prompt_tokens = count_tokens(system_message) + count_tokens(prompt)
+    ticket = get_scheduler().admit(
+        prompt_tokens + LLM_EXPECTED_COMPLETION_TOKENS,
+        priority=STAGE_PRIORITIES.get(stage, DEFAULT_PRIORITY)
+    )
+    return ticket, prompt_tokens
 
-# === Groq Client Setup ===
-client = Groq(api_key=GROQ_API_KEY)
+def call_llm(prompt: str, system_message: str = SYSTEM_PROMPT, stage: str = None) -> str:
+    """
+    Sends the prompt to the LLM and returns the assistant's reply (served from the
+    response cache when possible). New replies are not cached here: the caller
+    stores them with remember_reply once they are validated.
+    """
+    cache = get_llm_cache()
+    if cache:
+        cached = cache.get(llm_cache_key(prompt, system_message))
+        if cached is not None:
+            return cached
+
+    ticket, prompt_tokens = admit_llm_call(prompt, system_message, stage)
+    reply = get_client().complete(
+        MODEL,
+        [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": prompt}
+        ],
+        **LLM_PARAMS,
+    )
+    ticket.settle(prompt_tokens + count_tokens(reply))
+    return reply
 
-# === Call Groq Cloud LLM ===
-def call_llm(prompt: str) -> str:
-    """Sends the prompt to Groq and returns the assistant's reply."""
-    response = client.chat.completions.create(
-        model=MODEL,
-        messages=[
-            {"role": "system", "content": "You are a conversational fintech solutions advisor."},
+def call_llm_stream(prompt: str, on_token=None, system_message: str = SYSTEM_PROMPT,
+                    stage: str = None) -> Tuple[str, dict]:
+    """
+    Streams the reply from the LLM, calling on_token(text) for each piece as it arrives.
+
+    Returns the full reply plus timing metrics: "ttft_s" (time to first token),
+    "total_s" (total generation time), both in seconds, "queue_s" (time waiting
+    for the scheduler, included in the other two), "cached" (served from the
+    response cache without calling the LLM) and "cache_entry" ((key, reply) for
+    remember_reply once the reply is validated, None if there is nothing to cache).
+    `stage` sets the call's scheduling priority.
+    """
+    start = time.perf_counter()
+    cache = get_llm_cache()
+    key = llm_cache_key(prompt, system_message) if cache else None
+    if cache:
+        cached = cache.get(key)
+        if cached is not None:
+            if on_token:
+                on_token(cached)
+            elapsed = time.perf_counter() - start
+            return cached, {"ttft_s": elapsed, "total_s": elapsed, "queue_s": 0.0, "cached": True, "cache_entry": None}
+
+    ticket, prompt_tokens = admit_llm_call(prompt, system_message, stage)
+    reply, metrics = get_client().stream(
+        MODEL,
+        [
+            {"role": "system", "content": system_message},
             {"role": "user", "content": prompt}
         ],
-        temperature=0,
-        max_tokens=1024,
+        on_token=on_token,
+        **LLM_PARAMS,
     )
-    return response.choices[0].message.content
+    ticket.settle(prompt_tokens + count_tokens(reply))
+    return reply, {
+        "ttft_s": metrics["ttft_s"] + ticket.waited,
+        "total_s": metrics["total_s"] + ticket.waited,
+        "queue_s": ticket.waited,
+        "cached": False,
+        "cache_entry": (key, reply) if key else None,
+    }
 
 # === Retrieve Context from Vector DB ===
-def retrieve_context_chunks(user_query: str, current_stage: str, session_context: str = "") -> str:
-    """Retrieves relevant context from the existing vector DB, with explicit vendor health retrieval for STAGE_3 and service filtering for STAGE_2."""
-    from prompt_utils import ALLOWED_VENDORS, ALLOWED_SERVICES, CATEGORY_TO_SERVICES
-    import re
-
-    # Helper to extract selected category from session context
-    def extract_selected_category(context):
-        # First try to find explicit category mentions in JSON format
-        match = re.search(r'"category"\s*:\s*"([A-Za-z/ ]+)"', context)
-        if match:
-            category_from_json = match.group(1)
-            # Normalize to match the stored category format (all caps)
-            for stored_category in CATEGORY_TO_SERVICES.keys():
-                if stored_category.lower() == category_from_json.lower():
-                    return stored_category
-            return category_from_json
-        
-        # Look for category mentions in conversation history
-        # Check if any of the known categories are mentioned in the context
-        for category in CATEGORY_TO_SERVICES.keys():
-            # Look for patterns like "Asset Verification category" or "selected Asset Verification"
-            category_patterns = [
-                rf'\b{re.escape(category)}\s+category\b',
-                rf'selected\s+{re.escape(category)}\b',
-                rf'interested\s+in\s+(?:the\s+)?{re.escape(category)}\b',
-                rf'want\s+{re.escape(category)}\b',
-                rf'chosen\s+{re.escape(category)}\b',
-                rf'category\s+of\s+["\']?{re.escape(category)}["\']?',
-                rf'using\s+our\s+platform\s+for\s+["\']?{re.escape(category)}["\']?'
-            ]
-            
-            for pattern in category_patterns:
-                if re.search(pattern, context, re.IGNORECASE):
-                    return category
-        
-        # Also try exact substring matching as fallback
-        for category in CATEGORY_TO_SERVICES.keys():
-            if category.lower() in context.lower():
-                return category
-                
-        return None
+def retrieve_context_chunks(user_query: str, current_stage: str, session_context: str = "",
+                            selections: Selections = None) -> str:
+    """Retrieves relevant context from the existing vector DB, with service filtering for STAGE_2 and a ranked vendor health table for STAGE_3.
 
-    # Helper to extract selected service from session context
-    def extract_selected_service(context):
-        match = re.search(r'"service"\s*:\s*"([A-Z_]+)"', context)
-        if match:
-            return match.group(1)
-        return None
+    `selections` are the session's structured selections; when omitted they are
+    extracted from `session_context`.
+    """
+    kb = current_kb()
 
-    # Helper to extract selected vendors from session context
-    def extract_selected_vendors(context):
-        # Try to find a list of vendors in JSON_OUTPUT
-        match = re.search(r'"vendors"\s*:\s*\[(.*?)\]', context, re.DOTALL)
-        if match:
-            vendors_str = match.group(1)
-            vendors = re.findall(r'"([A-Za-z]+)"', vendors_str)
-            return vendors
-        return []
-
-    # Helper to extract explicitly selected vendor from session context
-    def extract_selected_vendor(context):
-        # Look for explicit vendor selection patterns
-        from prompt_utils import ALLOWED_VENDORS
-        
-        # Check for explicit vendor mentions in conversation
-        for vendor in ALLOWED_VENDORS:
-            vendor_patterns = [
-                rf'proceed\s+with\s+{re.escape(vendor)}\b',
-                rf'select\s+{re.escape(vendor)}\b',
-                rf'choose\s+{re.escape(vendor)}\b',
-                rf'want\s+{re.escape(vendor)}\b',
-                rf'go\s+with\s+{re.escape(vendor)}\b',
-                rf'pick\s+{re.escape(vendor)}\b'
-            ]
-            
-            for pattern in vendor_patterns:
-                if re.search(pattern, context, re.IGNORECASE):
-                    return vendor
-        
-        return None
+    if selections is None:
+        selections = Selections.from_context(session_context)
 
     # Try to detect category from user query or session context
-    selected_category = extract_selected_category(session_context)
+    selected_category = selections.category
     
     if selected_category:
         print(f"DEBUG: Found category in session context: {selected_category}")
@@ -164,7 +265,7 @@ def retrieve_context_chunks(user_query: str, current_stage: str, session_context
         else:
             print(f"DEBUG: No good keyword match found, falling back to original logic")
             # Fallback to original logic
-            for category in CATEGORY_TO_SERVICES.keys():
+            for category in kb.category_to_services.keys():
                 if category.lower().replace(' ', '') in user_query_lower.replace(' ', ''):
                     selected_category = category
                     print(f"DEBUG: FALLBACK MATCH: {user_query} -> {category}")
@@ -172,6 +273,17 @@ def retrieve_context_chunks(user_query: str, current_stage: str, session_context
     
     print(f"DEBUG: Final selected category: {selected_category}")
 
+    # For STAGE_3, send vendors ranked by the user's priorities as one compact table
+    if current_stage == "STAGE_3":
+        # Only vendors that serve the selected service (all vendors until one is chosen)
+        service_vendors = vendors_for_service(selections.selected_service) or kb.vendors
+        # Narrow further to the vendors already presented, if any
+        relevant_vendors = [vendor for vendor in selections.vendors if vendor in service_vendors] or service_vendors
+        ranking = rank_vendors(selections.priorities, candidates=relevant_vendors)
+        if not ranking:
+            return "No relevant vendor health data could be retrieved."
+        return format_ranking_table(ranking, selections.priorities)
+
     # Use category filtering in vector search if available
     chunks_result = get_relevant_chunks(user_query, top_k=10, category_filter=selected_category)
     print(f"DEBUG: ChromaDB query returned {len(chunks_result.get('documents', []))} chunks")
@@ -195,34 +307,22 @@ def retrieve_context_chunks(user_query: str, current_stage: str, session_context
     relevant_chunks = []
 
     # Filter services by selected category (applies to STAGE_1 and STAGE_2)
-    if selected_category and selected_category in CATEGORY_TO_SERVICES and current_stage in ["STAGE_1", "STAGE_2"]:
-        allowed_services = CATEGORY_TO_SERVICES[selected_category]
+    if selected_category and selected_category in kb.category_to_services and current_stage in ["STAGE_1", "STAGE_2"]:
+        allowed_services = kb.category_to_services[selected_category]
         print(f"DEBUG: Selected category: {selected_category}")
         print(f"DEBUG: Allowed services: {allowed_services}")
         
         # For STAGE_2, ensure we get ALL services for the category, not just those in search results
         if current_stage == "STAGE_2":
-            # Get detailed information for each service in the category
-            for service_name in allowed_services:
-                print(f"DEBUG: Retrieving data for service: {service_name}")
-                # Search specifically for this service
-                service_query = f"{service_name} service details"
-                service_chunks = get_relevant_chunks(service_query, top_k=3)
-                service_docs = service_chunks.get("documents", [])
-                service_metadatas = service_chunks.get("metadatas", [])
-                
-                # Add chunks that match this service
-                for i, doc in enumerate(service_docs):
-                    metadata = service_metadatas[i] if i < len(service_metadatas) else {}
-                    service_meta_name = metadata.get("service_name", "")
-                    category_meta = metadata.get("category", "")
-                    
-                    if (service_meta_name == service_name or 
-                        category_meta == selected_category or 
-                        service_name.lower() in doc.lower()):
-                        relevant_chunks.append(doc)
-                        print(f"DEBUG: Added chunk for {service_name}")
-                        break  # Only take the best match for each service
+            # Get the overview chunk of each service in the category by exact key (no embedding call)
+            print(f"DEBUG: Retrieving data for services: {allowed_services}")
+            for service_name in dict.fromkeys(allowed_services):
+                service_docs = get_chunks_by_key(service_name=service_name, chunk_type="overview")["documents"]
+                if not service_docs:
+                    service_docs = get_chunks_by_key(service_name=service_name)["documents"]
+                if service_docs and service_docs[0] not in relevant_chunks:
+                    relevant_chunks.append(service_docs[0])
+                    print(f"DEBUG: Added chunk for {service_name}")
             
             # Also include any general category chunks from original search
             for i, doc in enumerate(documents):
@@ -260,7 +360,7 @@ def retrieve_context_chunks(user_query: str, current_stage: str, session_context
     elif current_stage == "STAGE_2":
         for i, doc in enumerate(documents):
             metadata = metadatas[i] if i < len(metadatas) else {}
-            for service in ALLOWED_SERVICES:
+            for service in kb.services:
                 if service.lower() in doc.lower():
                     relevant_chunks.append(doc)
                     break
@@ -268,33 +368,6 @@ def retrieve_context_chunks(user_query: str, current_stage: str, session_context
             return "No relevant service data could be retrieved."
         return "\n\n".join(relevant_chunks)
 
-    # For STAGE_3, explicitly retrieve vendor health for all relevant vendors
-    if current_stage == "STAGE_3":
-        # Try to get the selected service from the session context
-        selected_service = extract_selected_service(session_context)
-        # For now, assume all vendors are available for all services (can be improved)
-        relevant_vendors = ALLOWED_VENDORS
-        # Try to get a more specific vendor list if present
-        selected_vendors = extract_selected_vendors(session_context)
-        if selected_vendors:
-            relevant_vendors = selected_vendors
-        
-        # For each vendor, retrieve their health chunk
-        for vendor in relevant_vendors:
-            vendor_query = f"{vendor} health metrics"
-            vendor_chunks = get_relevant_chunks(vendor_query, top_k=1)
-            vendor_docs = vendor_chunks.get("documents", [])
-            if vendor_docs and vendor_docs[0]:
-                relevant_chunks.append(vendor_docs[0])
-        # Also add any other relevant chunks from the original retrieval
-        for i, doc in enumerate(documents):
-            metadata = metadatas[i] if i < len(metadatas) else {}
-            if "vendor" in doc.lower() or "health" in doc.lower() or "metric" in doc.lower():
-                relevant_chunks.append(doc)
-        if not relevant_chunks:
-            return "No relevant vendor health data could be retrieved."
-        return "\n\n".join(relevant_chunks)
-
     # For other stages, keep the old logic
     for i, doc in enumerate(documents):
         metadata = metadatas[i] if i < len(metadatas) else {}
@@ -315,13 +388,23 @@ def find_mentions(text: str, whitelist: List[str]) -> List[str]:
     """
     Returns a list of whitelist items found in the text (case-insensitive, exact word match).
     """
-    found = []
-    text_lower = text.lower()
-    for item in whitelist:
-        pattern = r'\b' + re.escape(item.lower()) + r'\b'
-        if re.search(pattern, text_lower):
-            found.append(item)
-    return found
+    mentioned = {mention.name for mention in MATCHER.find(text)}
+    return [item for item in whitelist if item in mentioned]
+
+# JSON_OUTPUT fields that must name knowledge-base entities
+JSON_VENDOR_FIELDS = ["selected_vendor", "backup_vendor", "vendor", "ranked_vendors", "vendors"]
+JSON_SERVICE_FIELDS = ["selected_service", "service"]
+
+def extract_json_output(text: str):
+    """The object after "JSON_OUTPUT:" (fenced or bare), or None if missing or not valid JSON."""
+    match = re.search(r'JSON_OUTPUT:\s*(?:```(?:json)?\s*)?(\{.*?\})\s*(?:```|$|\n\s*\n)', text, re.DOTALL)
+    if not match:
+        return None
+    try:
+        payload = json.loads(match.group(1))
+    except ValueError:
+        return None
+    return payload if isinstance(payload, dict) else None
 
 def validate_response(llm_response: str,
                       allowed_vendors: List[str],
@@ -331,69 +414,259 @@ def validate_response(llm_response: str,
     """
     Checks if LLM response mentions ONLY known whitelisted vendors, services, categories, and health metrics.
     Returns (True, response) if safe, otherwise (False, error message).
-    """
-
-    # Find mentions of allowed entities in response
-    vendors_found = find_mentions(llm_response, allowed_vendors)
-    services_found = find_mentions(llm_response, allowed_services)
-    categories_found = find_mentions(llm_response, allowed_categories)
-    metrics_found = find_mentions(llm_response, allowed_health_metrics)
-
-    # Since we explicitly whitelist only what should be mentioned,
-    # we allow normal words outside these lists but check for any suspicious unknown entity?
-
-    # Given complexity of false positive detection, we trust prompt instructions heavily.
-    # You can extend this function to detect unknown named entities if needed.
-
-    # For now, accept all responses.
 
+    Free text may use any words, but vendor-like names (CamelCase, like the real
+    vendors) offered as vendors must be known (see find_unknown_vendors);
+    JSON_OUTPUT values must all come from the allowlists.
+    """
+    problems = []
+    unknown_vendors = [name for name in find_unknown_vendors(llm_response) if name not in allowed_vendors]
+    if unknown_vendors:
+        problems.append(f"unknown vendors {unknown_vendors}")
+
+    payload = extract_json_output(llm_response)
+    if payload:
+        for field in JSON_VENDOR_FIELDS:
+            values = payload.get(field)
+            for value in values if isinstance(values, list) else [values]:
+                if value is not None and value not in allowed_vendors:
+                    problems.append(f"{field}: unknown vendor {value!r}")
+        service_codes = {service_code(name) for name in allowed_services}
+        for field in JSON_SERVICE_FIELDS:
+            value = payload.get(field)
+            if isinstance(value, str) and service_code(value) not in service_codes:
+                problems.append(f"{field}: unknown service {value!r}")
+        category = payload.get("category")
+        if isinstance(category, str) and category.upper() not in {c.upper() for c in allowed_categories}:
+            problems.append(f"category: unknown category {category!r}")
+
+    if problems:
+        return False, "; ".join(problems)
     return True, llm_response
 
 
-# === Chat Session Setup ===
-sm = SessionManager()
-session_id = "user_001"
-
-print("\n💬 Fintech Chatbot Ready! Type 'exit' to end chat.\n")
-
-# === Chatbot Conversation Loop ===
-while True:
-    user_input = input("🧑 You: ")
-
-    if user_input.strip().lower() in ["exit", "quit", "bye"]:
-        print("👋 Goodbye!")
-        break
-
-    # STEP 1: Get current stage and conversation context
-    current_stage = sm.get_stage(session_id)
-    session_context = sm.get_context(session_id)
-
-    # STEP 2: Retrieve relevant context chunks from vector DB for stages 2+
-    knowledge_chunks = retrieve_context_chunks(user_input, current_stage, session_context)
+def build_workflow_payload(selections: Selections):
+    """The validated STAGE_4 workflow payload, or None when the LLM has to handle the turn."""
+    try:
+        payload, _ = build_workflow(selections)
+    except WorkflowError as e:
+        print(f"⚠️  Could not build the workflow from the session ({e}); asking the LLM instead.")
+        return None
+    return payload
 
-    # STEP 3: Build the LLM prompt with strict staging and whitelist instructions
-    prompt = build_prompt(
-        user_query=user_input,
-        stage=current_stage,
-        session_context=session_context,
-        knowledge_chunks=knowledge_chunks
-    )
 
-    # STEP 4: Call the LLM API
-    print("\n🤖 Thinking...\n")
-    assistant_reply_raw = call_llm(prompt)
+def generate_workflow_reply(payload: dict, on_token=None) -> Tuple[str, dict]:
+    """
+    STAGE_4 reply (workflow JSON plus REASONING) without an LLM round-trip.
 
-    # STEP 5a: Apply the improved guardrail (here we accept all outputs; extend if needed)
+    The REASONING comes from the vendor health metrics, or from the LLM when
+    WORKFLOW_LLM_REASONING is set and the scheduler admits the call. Returns (reply, metrics) like call_llm_stream.
+    """
+    start = time.perf_counter()
+    head = format_workflow_reply(payload, "")
+    ttft = time.perf_counter() - start
+    if on_token:
+        on_token(head)
+    reasoning = None
+    cache_entry = None
+    if WORKFLOW_LLM_REASONING:
+        try:
+            reasoning, reasoning_metrics = call_llm_stream(reasoning_prompt(payload), on_token=on_token, stage="STAGE_4")
+            cache_entry = reasoning_metrics["cache_entry"]
+        except LLMOverloaded as e:
+            print(f"⚠️  LLM busy ({e}); using the templated REASONING.")
+    if reasoning is None:
+        reasoning = template_reasoning(payload)
+        if on_token:
+            on_token(reasoning)
+    return head + reasoning, {"ttft_s": ttft, "total_s": time.perf_counter() - start, "cached": None,
+                              "cache_entry": cache_entry}
+
+
+def report_startup_timings():
+    """Print how long each cold-start step took."""
+    parts = [f"{name.replace('_', ' ')} {seconds:.2f}s" for name, seconds in STARTUP_TIMINGS.items()]
+    print(f"⏱️  Startup timings: {', '.join(parts) if parts else 'none recorded'}")
+
+
+def run_turn(sm: SessionManager, session_id: str, user_input: str, on_token=None, stream: bool = None) -> dict:
+    """
+    Run one conversation turn for a session: retrieve → build prompt → call LLM →
+    validate → update session memory.
+
+    When streaming (STREAM_RESPONSES by default), on_token(text) receives the reply
+    as it is generated. Returns a dict with "stage" (the stage the turn ran in),
+    "reply" (as stored in the session), "valid" (False if the guardrail replaced
+    the reply), "shed" (True if the LLM scheduler refused the call; the turn is
+    then not stored and "retry_after" suggests when to resend), "llm_metrics"
+    and "prompt_metrics" (None for built workflows).
+    Blocking; callers serving several sessions must not run two turns of the same
+    session at once. The whole turn uses one knowledge base state (see pinned_kb),
+    even if a hot reload swaps in a new one meanwhile.
+    """
+    stream = STREAM_RESPONSES if stream is None else stream
+    with pinned_kb():
+        return _run_turn(sm, session_id, user_input, on_token, stream)
+
+
+def _run_turn(sm: SessionManager, session_id: str, user_input: str, on_token, stream: bool) -> dict:
+    kb = current_kb()
+
+    # STEP 1: Get current stage and conversation (one store read; None for a new session)
+    conversation = sm.get_conversation(session_id)
+    current_stage = conversation.stage if conversation else "STAGE_1"
+    selections = conversation.selections if conversation else Selections()
+    prompt_metrics = None
+
+    # STAGE_4: the workflow JSON is built straight from the session's selections
+    workflow_payload = build_workflow_payload(selections) if current_stage == "STAGE_4" else None
+    if workflow_payload is not None:
+        assistant_reply_raw, llm_metrics = generate_workflow_reply(
+            workflow_payload, on_token=on_token if stream else None
+        )
+    else:
+        # STEP 2: Retrieve relevant context chunks from vector DB for stages 2+
+        knowledge_chunks = retrieve_context_chunks(user_input, current_stage, selections=selections)
+
+        # STEP 3: Build the LLM prompt with strict staging and whitelist instructions,
+        # keeping recent turns verbatim and summarising older ones to stay within budget
+        prompt, prompt_metrics = build_budgeted_prompt(
+            user_query=user_input,
+            stage=current_stage,
+            conversation=conversation,
+            knowledge_chunks=knowledge_chunks,
+            selected_vendor=selections.vendor
+        )
+        sections = prompt_metrics["sections"]
+        print(f"📏 Prompt tokens (est.): {prompt_metrics['tokens_before']} → {prompt_metrics['tokens_after']} "
+              f"(budget {prompt_metrics['budget']}) [system/static {sections['static']}, "
+              f"user/dynamic {sections['dynamic']}: conversation {sections['conversation']}, "
+              f"knowledge {sections['knowledge']}, query {sections['user_query']}]")
+        system_message = get_system_message(current_stage)
+
+        # STEP 4: Call the LLM API (streamed to on_token as it is generated)
+        llm_start = time.perf_counter()
+        try:
+            if stream:
+                assistant_reply_raw, llm_metrics = call_llm_stream(
+                    prompt, on_token=on_token,
+                    system_message=system_message,
+                    stage=current_stage
+                )
+            else:
+                assistant_reply_raw = call_llm(prompt, system_message=system_message, stage=current_stage)
+                llm_seconds = time.perf_counter() - llm_start
+                # Storing a cache hit again is harmless: it keeps its age
+                cache_entry = (llm_cache_key(prompt, system_message), assistant_reply_raw) if get_llm_cache() else None
+                llm_metrics = {"ttft_s": llm_seconds, "total_s": llm_seconds, "cached": None, "cache_entry": cache_entry}
+        except LLMOverloaded as e:
+            # Shed by the scheduler: nothing is stored, so the user can simply send the message again
+            print(f"⚠️  LLM call shed ({e})")
+            llm_seconds = time.perf_counter() - llm_start
+            return {
+                "stage": current_stage,
+                "reply": OVERLOADED_REPLY.format(stage=current_stage),
+                "valid": True,
+                "shed": True,
+                "retry_after": e.retry_after,
+                "llm_metrics": {"ttft_s": llm_seconds, "total_s": llm_seconds, "cached": None},
+                "prompt_metrics": prompt_metrics,
+            }
+
+    # STEP 5a: Guardrail: replies naming vendors/services outside the knowledge base are not kept
+    # (services name vendors without health data too, e.g. JadeToucan; those are real)
     valid, assistant_reply = validate_response(
         assistant_reply_raw,
-        allowed_vendors=ALLOWED_VENDORS,
-        allowed_services=ALLOWED_SERVICES,
-        allowed_categories=ALLOWED_CATEGORIES,
+        allowed_vendors=kb.all_vendors,
+        allowed_services=kb.services,
+        allowed_categories=kb.categories,
         allowed_health_metrics=ALLOWED_HEALTH_METRICS
     )
+    cache_entry = llm_metrics.pop("cache_entry", None)
+    if not valid:
+        print(f"⚠️  Guardrail rejected the reply: {assistant_reply}")
+        assistant_reply = GUARDRAIL_FALLBACK.format(stage=current_stage)
+    elif cache_entry:
+        # Only replies that passed the guardrail are cached; a rejected one is asked for again next time
+        remember_reply(*cache_entry)
 
     # STEP 5b: Update session memory with filtered or accepted response
     sm.update(session_id, user_input, assistant_reply)
 
-    # STEP 6: Display assistant response to user
-    print(f"\n🤖 Assistant ({current_stage}):\n{assistant_reply}\n")
+    return {
+        "stage": current_stage,
+        "reply": assistant_reply,
+        "valid": valid,
+        "shed": False,
+        "llm_metrics": llm_metrics,
+        "prompt_metrics": prompt_metrics,
+    }
+
+
+def main():
+    # Load the embedding model and open the vector DB while the user types
+    warm_up()
+    if KB_WATCH:
+        # Knowledge base edits go live between turns, without restarting the chat
+        start_watcher()
+
+    # === Chat Session Setup ===
+    sm = SessionManager()
+    session_id = "user_001"
+
+    prefix_tokens = ", ".join(f"{stage} {tokens}" for stage, tokens in static_prefix_report().items())
+    print(f"📏 Static prompt prefix tokens (est., sent as system message): {prefix_tokens}")
+
+    STARTUP_TIMINGS["time_to_prompt"] = time.perf_counter() - _process_start
+    print(f"\n💬 Fintech Chatbot Ready in {STARTUP_TIMINGS['time_to_prompt']:.2f}s! Type 'exit' to end chat.\n")
+
+    # === Chatbot Conversation Loop ===
+    first_turn = True
+    print_token = lambda token: print(token, end="", flush=True)
+    while True:
+        user_input = input("🧑 You: ")
+
+        if user_input.strip().lower() in ["exit", "quit", "bye"]:
+            print("👋 Goodbye!")
+            break
+
+        turn_start = time.perf_counter()
+        current_stage = sm.get_stage(session_id)
+
+        # STEPS 1-5: retrieve, prompt, LLM (streamed to the terminal as it is generated), guardrail, memory
+        streamed = []
+        def on_token(token):
+            # Header goes out with the first token so retrieval logs do not split the reply
+            if not streamed:
+                print(f"\n🤖 Assistant ({current_stage}):")
+            streamed.append(token)
+            print_token(token)
+        if not STREAM_RESPONSES:
+            print("\n🤖 Thinking...\n")
+        result = run_turn(sm, session_id, user_input, on_token=on_token)
+        assistant_reply, llm_metrics = result["reply"], result["llm_metrics"]
+        if streamed:
+            print()
+
+        # STEP 6: Display assistant response to user (already shown token by token when streaming)
+        if not STREAM_RESPONSES or not result["valid"] or result["shed"]:
+            print(f"\n🤖 Assistant ({current_stage}):\n{assistant_reply}\n")
+        print(f"⏱️  Time to first token: {llm_metrics['ttft_s']:.2f}s | "
+              f"generation: {llm_metrics['total_s']:.2f}s | "
+              f"turn: {time.perf_counter() - turn_start:.2f}s\n")
+        if get_llm_cache():
+            stats = get_llm_cache().stats()
+            print(f"📦 LLM cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries\n")
+        scheduler_stats = get_scheduler().stats()
+        if scheduler_stats["wait_max_s"] > 0 or scheduler_stats["shed"]:
+            print(f"🚦 LLM scheduler: {scheduler_stats['admitted']} admitted, {scheduler_stats['shed']} shed, "
+                  f"queue wait p95 {scheduler_stats['wait_p95_s']:.2f}s (max {scheduler_stats['wait_max_s']:.2f}s)\n")
+
+        if first_turn:
+            STARTUP_TIMINGS["first_turn"] = time.perf_counter() - turn_start
+            report_startup_timings()
+            first_turn = False
+
+
+if __name__ == "__main__":
+    main()
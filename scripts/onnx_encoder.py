@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import numpy as np
+
+
+# Get the project root directory (parent of scripts)
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+DEFAULT_ONNX_DIR = os.path.join(project_root, 'vector_db', 'onnx_encoder')
+
+EMBEDDING_MODEL_NAME = "BAAI/bge-base-en-v1.5"
+MODEL_FILENAME = "model.onnx"
+QUANTIZED_MODEL_FILENAME = "model.int8.onnx"
+TOKENIZER_FILENAME = "tokenizer.json"
+# bge-base-en-v1.5 was trained with 512-token inputs
+MAX_SEQ_LENGTH = 512
+# Cosine similarity against the torch embeddings below which verification fails
+MIN_COSINE = {"fp32": 0.999, "int8": 0.98}
+
+
+def export_onnx(model_name=EMBEDDING_MODEL_NAME, out_dir=DEFAULT_ONNX_DIR, quantize=False):
+    """
+    Export the encoder to ONNX with CLS pooling and L2 normalisation baked into the graph,
+    matching SentenceTransformer's output for bge models. Optionally also writes an int8
+    dynamically quantised copy. Needs torch/transformers; running the result does not.
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    class PooledEncoder(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            output = self.model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)
+            cls = output.last_hidden_state[:, 0]
+            return torch.nn.functional.normalize(cls, p=2, dim=1)
+
+    os.makedirs(out_dir, exist_ok=True)
+    print(f"🔄 Exporting {model_name} to ONNX in '{out_dir}'...")
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    tokenizer.save_pretrained(out_dir)
+    model = PooledEncoder(AutoModel.from_pretrained(model_name)).eval()
+
+    dummy = tokenizer(["warm-up text", "a second, longer warm-up sentence"], padding=True, return_tensors="pt")
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+    model_path = os.path.join(out_dir, MODEL_FILENAME)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(dummy[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=["sentence_embedding"],
+            dynamic_axes={
+                **{name: {0: "batch", 1: "sequence"} for name in input_names},
+                "sentence_embedding": {0: "batch"},
+            },
+            opset_version=17,
+        )
+    print(f"✅ Exported ONNX model to '{model_path}'.")
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantized_path = os.path.join(out_dir, QUANTIZED_MODEL_FILENAME)
+        quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+        print(f"✅ Wrote int8 dynamically quantised model to '{quantized_path}'.")
+
+
+class OnnxEncoder:
+    """
+    Drop-in replacement for SentenceTransformer.encode backed by ONNX Runtime.
+
+    Only onnxruntime, tokenizers and numpy are imported, so serving processes using
+    this encoder never load torch.
+    """
+
+    def __init__(self, model_dir=DEFAULT_ONNX_DIR, quantized=False, num_threads=None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_path = os.path.join(model_dir, QUANTIZED_MODEL_FILENAME if quantized else MODEL_FILENAME)
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILENAME))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        """Encode a string or list of strings into normalised float32 embeddings."""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            encodings = self.tokenizer.encode_batch(sentences[start:start + batch_size])
+            feeds = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            feeds = {name: value for name, value in feeds.items() if name in self.input_names}
+            batches.append(self.session.run(None, feeds)[0])
+
+        embeddings = np.concatenate(batches) if batches else np.zeros((0, 0), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+
+def load_encoder(backend, model_dir=DEFAULT_ONNX_DIR):
+    """Load the "torch", "onnx" or "onnx-int8" encoder, exporting the ONNX model if missing."""
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        # BGE models are better for structured data and RAG applications
+        return SentenceTransformer(EMBEDDING_MODEL_NAME)
+        # Alternative: SentenceTransformer("BAAI/bge-large-en-v1.5") for better performance
+    if backend not in ("onnx", "onnx-int8"):
+        raise ValueError(f"Unknown encoder backend: {backend}")
+
+    quantized = backend == "onnx-int8"
+    filename = QUANTIZED_MODEL_FILENAME if quantized else MODEL_FILENAME
+    if not os.path.exists(os.path.join(model_dir, filename)):
+        export_onnx(out_dir=model_dir, quantize=quantized)
+    return OnnxEncoder(model_dir, quantized=quantized)
+
+
+def sample_texts():
+    """Realistic query and chunk texts from the knowledge base for verification/benchmarks."""
+    sys.path.append(script_dir)
+    from prompt_utils import ALLOWED_CATEGORIES, ALLOWED_SERVICES, ALLOWED_VENDORS
+    texts = ["I want KYC", "show me banking services", "low latency and high success rate please"]
+    texts += [f"{service} service details" for service in ALLOWED_SERVICES]
+    texts += [f"{vendor} health metrics" for vendor in ALLOWED_VENDORS]
+    texts += list(ALLOWED_CATEGORIES)
+    return texts
+
+
+def verify(backends=("onnx", "onnx-int8")):
+    """Check cosine similarity between torch and ONNX embeddings on sample texts."""
+    texts = sample_texts()
+    reference = np.asarray(load_encoder("torch").encode(texts), dtype=np.float32)
+    reference /= np.linalg.norm(reference, axis=1, keepdims=True)
+
+    ok = True
+    for backend in backends:
+        embeddings = np.asarray(load_encoder(backend).encode(texts), dtype=np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        cosines = (reference * embeddings).sum(axis=1)
+        threshold = MIN_COSINE["int8" if backend == "onnx-int8" else "fp32"]
+        passed = bool(cosines.min() >= threshold)
+        ok = ok and passed
+        print(f"{'✅' if passed else '⚠️ '} {backend}: cosine vs torch min {cosines.min():.5f}, "
+              f"mean {cosines.mean():.5f} over {len(texts)} texts (threshold {threshold})")
+    return ok
+
+
+def resident_memory_mb():
+    """Current resident set size of this process in MB (Linux)."""
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def bench_one(backend, repeats=50):
+    """Measure load time, single-query latency and RSS of one backend in this process."""
+    texts = sample_texts()
+    start = time.perf_counter()
+    encoder = load_encoder(backend)
+    load_seconds = time.perf_counter() - start
+    encoder.encode(texts[:4])
+
+    latencies = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        encoder.encode([texts[i % len(texts)]])
+        latencies.append(time.perf_counter() - start)
+    return {
+        "backend": backend,
+        "load_s": load_seconds,
+        "p50_ms": 1000 * float(np.percentile(latencies, 50)),
+        "p95_ms": 1000 * float(np.percentile(latencies, 95)),
+        "rss_mb": resident_memory_mb(),
+    }
+
+
+def benchmark(backends=("torch", "onnx", "onnx-int8")):
+    """Benchmark each backend in a fresh process so resident memory is comparable."""
+    for backend in backends:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--bench-one", backend],
+            check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"⏱️  {result['backend']:>9}: load {result['load_s']:.2f}s, per-query p50 {result['p50_ms']:.1f} ms, "
+              f"p95 {result['p95_ms']:.1f} ms, RSS {result['rss_mb']:.0f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export, verify and benchmark the ONNX Runtime query encoder.")
+    parser.add_argument("--export", action="store_true", help="Export the encoder to ONNX.")
+    parser.add_argument("--quantize", action="store_true", help="Also write an int8 dynamically quantised model.")
+    parser.add_argument("--verify", action="store_true", help="Compare ONNX embeddings against torch.")
+    parser.add_argument("--bench", action="store_true", help="Compare per-query latency and memory of all backends.")
+    parser.add_argument("--bench-one", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.bench_one:
+        print(json.dumps(bench_one(args.bench_one)))
+        sys.exit(0)
+    if args.export:
+        export_onnx(quantize=args.quantize)
+    ok = True
+    if args.verify:
+        ok = verify()
+    if args.bench:
+        benchmark()
+    sys.exit(0 if ok else 1)
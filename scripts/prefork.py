@@ -0,0 +1,393 @@
+import os
+import gc
+import sys
+import time
+import random
+import signal
+import socket
+import argparse
+
+
+# Worker processes forked from the preloaded parent
+PREFORK_WORKERS = int(os.getenv("PREFORK_WORKERS", "2"))
+# Seconds a worker may take to finish in-flight turns after SIGTERM before it is killed
+PREFORK_GRACEFUL_TIMEOUT = float(os.getenv("PREFORK_GRACEFUL_TIMEOUT", "30"))
+# A worker that dies sooner than this after starting is restarted with a growing delay
+PREFORK_MIN_UPTIME_SECONDS = float(os.getenv("PREFORK_MIN_UPTIME_SECONDS", "5"))
+PREFORK_MAX_RESTART_DELAY = float(os.getenv("PREFORK_MAX_RESTART_DELAY", "30"))
+# Seconds to wait for a (re)started worker to finish its lifespan startup
+PREFORK_READY_TIMEOUT = float(os.getenv("PREFORK_READY_TIMEOUT", "120"))
+
+
+def process_memory(pid):
+    """{"rss", "pss", "private"} in kB for a process from /proc/<pid>/smaps_rollup, or None where unavailable."""
+    values = {"rss": 0, "pss": 0, "private": 0}
+    fields = {"Rss": "rss", "Pss": "pss", "Private_Clean": "private", "Private_Dirty": "private"}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                if name in fields:
+                    values[fields[name]] += int(rest.split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return values if values["rss"] else None
+
+
+def preload():
+    """
+    Load everything read-only the workers share: the knowledge base, matcher and
+    prompt prefixes, the embedding model and, for the NumPy backend, the vector
+    index and chunk index.
+
+    Nothing here may start threads or open connections that a forked child
+    would inherit in a broken state: no encode (torch starts its thread pool on
+    the first forward pass), no Chroma client (SQLite handles and background
+    threads), no ONNX Runtime session (its thread pool is created with it).
+    Those are created per worker during the server's lifespan startup.
+    """
+    import server  # noqa: F401  (imports main, prompt_utils and the matcher)
+    import query_db
+    from prompt_utils import current_kb
+    from token_budget import static_prefix_report
+
+    static_prefix_report()
+    current_kb().warm()
+    if query_db.EMBEDDING_SERVICE_SOCKET or query_db.ENCODER_BACKEND == "torch":
+        query_db.get_model()
+    else:
+        print(f"⚠️  {query_db.ENCODER_BACKEND} encoder sessions own a thread pool; each worker loads its own.")
+    if query_db.RETRIEVAL_BACKEND == "numpy":
+        query_db.get_backend()
+        query_db.get_chunk_index()
+    else:
+        print("⚠️  Chroma clients cannot cross fork(); each worker opens its own collection "
+              "(RETRIEVAL_BACKEND=numpy shares the index).")
+
+
+def reset_reloadable():
+    """Forget the preloaded index and pick up knowledge base edits, so the next preload() reads them from disk again."""
+    import query_db
+    from kb_watcher import reload_knowledge_base
+    with query_db._init_lock:
+        query_db._backend = None
+        query_db._chunk_index = None
+    # Re-indexing is left to embedding.py (or the KB_WATCH watcher); this only swaps in the new allowlists
+    reload_knowledge_base(reindex=None)
+
+
+class PreforkServer:
+    """
+    Pre-forking supervisor for server.py.
+
+    The parent loads the model, knowledge base and vector index once, binds the
+    listening socket and forks `workers` processes that serve server.app on it.
+    The workers inherit the loaded state copy-on-write, so its pages are shared
+    until written; gc.freeze() keeps the collector from dirtying them.
+
+    Signals to the parent:
+      SIGTERM / SIGINT  stop the workers gracefully, then exit
+      SIGHUP            reload the vector index and knowledge base, then replace the
+                        workers one at a time (each new worker is ready before an
+                        old one is stopped, so the socket is always served)
+      SIGUSR1           print the startup and memory report
+
+    Workers that die are restarted, with a growing delay while they keep dying
+    right after start. Sessions are shared through the SQLite session store
+    (SESSION_STORE=sqlite by default here); each worker has its own LLM
+    scheduler, with the RPM/TPM limits split evenly between workers.
+
+    With `watch_kb` (KB_WATCH) the parent watches knowledge_base/, re-indexes
+    changes with embedding.py in a child process and then reloads as on SIGHUP;
+    the workers do not watch themselves.
+    """
+
+    def __init__(self, host, port, workers=PREFORK_WORKERS, preload_app=True, watch_kb=False):
+        self.host = host
+        self.port = port
+        self.num_workers = workers
+        self.preload_app = preload_app
+        self.watch_kb = watch_kb
+        self.workers = {}           # pid -> slot
+        self.started_at = {}        # pid -> monotonic start time
+        self.ready = set()
+        self.restart_delay = {}     # slot -> seconds
+        self.restart_at = {}        # slot -> monotonic time of the pending restart
+        self.retiring = set()
+        self.stopping = False
+        self.reload_requested = False
+        self.report_requested = False
+        self.sock = None
+        self.ready_read = self.ready_write = None
+        self.timings = {}
+        self.baseline = None
+
+    # --- parent ---
+
+    def bind(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        self.sock = sock
+
+    def run(self):
+        start = time.perf_counter()
+        self.bind()
+        self.ready_read, self.ready_write = os.pipe()
+        os.set_blocking(self.ready_read, False)
+        if self.preload_app:
+            print("🔄 Preloading model, knowledge base and indexes in the parent...")
+            preload()
+            # Move everything loaded so far out of the collector's reach; otherwise the
+            # first collection in each worker writes to (and copies) every shared page
+            gc.freeze()
+        self.timings["preload"] = time.perf_counter() - start
+        self.baseline = process_memory(os.getpid())
+
+        for signum, handler in ((signal.SIGTERM, self.on_stop), (signal.SIGINT, self.on_stop),
+                                (signal.SIGHUP, self.on_reload), (signal.SIGUSR1, self.on_report)):
+            signal.signal(signum, handler)
+
+        fork_start = time.perf_counter()
+        for slot in range(self.num_workers):
+            self.spawn(slot)
+        self.wait_ready(set(self.workers), PREFORK_READY_TIMEOUT)
+        self.timings["workers_ready"] = time.perf_counter() - fork_start
+        print(f"💬 Prefork server on http://{self.host}:{self.port} with {len(self.ready)} workers.")
+        self.report()
+        if self.watch_kb:
+            # Started after the first fork; the thread only blocks on the file watcher between reloads
+            from kb_watcher import start_watcher
+            start_watcher(on_change=self.on_kb_change)
+
+        while not self.stopping:
+            self.reap()
+            self.restart_due()
+            self.read_ready()
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+            if self.report_requested:
+                self.report_requested = False
+                self.report()
+            time.sleep(0.2)
+        self.shutdown()
+
+    def on_stop(self, signum, frame):
+        self.stopping = True
+
+    def on_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def on_report(self, signum, frame):
+        self.report_requested = True
+
+    def on_kb_change(self):
+        """Watcher callback: re-index in a child process, then let the main loop roll the workers over."""
+        from kb_watcher import reindex_in_subprocess
+        reindex_in_subprocess()
+        self.reload_requested = True
+
+    def spawn(self, slot):
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            self.run_worker(slot)
+            os._exit(0)
+        self.workers[pid] = slot
+        self.started_at[pid] = time.monotonic()
+        return pid
+
+    def read_ready(self):
+        try:
+            data = os.read(self.ready_read, 4096)
+        except BlockingIOError:
+            return
+        for line in data.decode().split():
+            self.ready.add(int(line))
+
+    def wait_ready(self, pids, timeout):
+        """Wait until every pid in `pids` reported ready (or died); False on timeout."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and not self.stopping:
+            self.read_ready()
+            self.reap()
+            if all(pid in self.ready or pid not in self.workers for pid in pids):
+                return True
+            time.sleep(0.05)
+        print(f"⚠️  Workers not ready after {timeout:.0f}s: {sorted(pids - self.ready)}")
+        return False
+
+    def reap(self):
+        """Collect exited workers and schedule restarts for those that were not retired."""
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            slot = self.workers.pop(pid, None)
+            uptime = time.monotonic() - self.started_at.pop(pid, time.monotonic())
+            self.ready.discard(pid)
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                continue
+            if slot is None or self.stopping:
+                continue
+            if uptime < PREFORK_MIN_UPTIME_SECONDS:
+                delay = min(max(2 * self.restart_delay.get(slot, 0.5), 1.0), PREFORK_MAX_RESTART_DELAY)
+            else:
+                delay = 0.0
+            self.restart_delay[slot] = delay
+            self.restart_at[slot] = time.monotonic() + delay
+            print(f"⚠️  Worker {pid} (slot {slot}) exited with status {os.waitstatus_to_exitcode(status)} "
+                  f"after {uptime:.1f}s; restarting in {delay:.1f}s")
+
+    def restart_due(self):
+        now = time.monotonic()
+        for slot, at in list(self.restart_at.items()):
+            if at <= now:
+                del self.restart_at[slot]
+                pid = self.spawn(slot)
+                print(f"🔄 Restarted worker slot {slot} as {pid}")
+
+    def retire(self, pid, timeout=PREFORK_GRACEFUL_TIMEOUT):
+        """SIGTERM a worker (uvicorn finishes in-flight requests) and SIGKILL it after `timeout`."""
+        self.retiring.add(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        deadline = time.monotonic() + timeout
+        while pid in self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.05)
+        if pid in self.workers:
+            print(f"⚠️  Worker {pid} did not stop within {timeout:.0f}s; killing it")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            os.waitpid(pid, 0)
+            self.workers.pop(pid, None)
+            self.started_at.pop(pid, None)
+            self.ready.discard(pid)
+            self.retiring.discard(pid)
+
+    def reload(self):
+        """Reload the shared index in the parent, then roll the workers over one at a time."""
+        print("🔄 Reloading: re-reading the vector index and knowledge base...")
+        start = time.perf_counter()
+        if self.preload_app:
+            gc.unfreeze()
+            reset_reloadable()
+            try:
+                preload()
+            except Exception as e:
+                # Keep the running workers rather than fork from a half-loaded parent
+                print(f"⚠️  Reload failed, keeping the current workers: {e}")
+                gc.freeze()
+                return
+            gc.freeze()
+        for pid, slot in list(self.workers.items()):
+            if self.stopping:
+                return
+            new_pid = self.spawn(slot)
+            if not self.wait_ready({new_pid}, PREFORK_READY_TIMEOUT):
+                print(f"⚠️  Replacement for worker {pid} did not come up; stopping the reload")
+                self.retire(new_pid, timeout=5)
+                return
+            self.retire(pid)
+        print(f"✅ Reloaded {len(self.workers)} workers in {time.perf_counter() - start:.2f}s")
+
+    def shutdown(self):
+        print(f"🛑 Stopping {len(self.workers)} workers...")
+        for pid in list(self.workers):
+            self.retiring.add(pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + PREFORK_GRACEFUL_TIMEOUT
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.05)
+        for pid in list(self.workers):
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.sock.close()
+
+    def report(self):
+        """Startup time and memory of the parent plus workers, against one fully loaded process per worker."""
+        workers = sorted(self.workers)
+        print(f"⏱️  Startup: preload {self.timings.get('preload', 0):.2f}s in the parent, "
+              f"{len(workers)} workers ready {self.timings.get('workers_ready', 0):.2f}s after fork")
+        usage = {pid: process_memory(pid) for pid in [os.getpid(), *workers]}
+        if any(value is None for value in usage.values()):
+            print("⚠️  Memory report needs /proc/<pid>/smaps_rollup (Linux)")
+            return
+        total = {key: sum(value[key] for value in usage.values()) / 1024 for key in ("rss", "pss")}
+        print(f"📦 Memory (parent + {len(workers)} workers): PSS {total['pss']:.0f} MB "
+              f"(shared pages counted once), RSS sum {total['rss']:.0f} MB")
+        for pid in workers:
+            print(f"   worker {pid}: RSS {usage[pid]['rss'] / 1024:.0f} MB, "
+                  f"private {usage[pid]['private'] / 1024:.0f} MB")
+        loaded = self.baseline
+        if self.preload_app and loaded:
+            # Without preloading every worker is a separate process with its own copy of
+            # what the parent loaded, plus whatever it allocates privately anyway
+            loaded_mb = loaded["rss"] / 1024
+            private_mb = sum(usage[pid]["private"] for pid in workers) / 1024
+            per_process = len(workers) * loaded_mb + private_mb
+            print(f"   Per-process model: ~{len(workers)} × {loaded_mb:.0f} MB loaded + {private_mb:.0f} MB "
+                  f"private ≈ {per_process:.0f} MB, each worker paying the "
+                  f"{self.timings.get('preload', 0):.2f}s load (measure it with --no-preload)")
+
+    # --- worker ---
+
+    def run_worker(self, slot):
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGUSR1):
+            signal.signal(signum, signal.SIG_DFL)
+        os.close(self.ready_read)
+        random.seed()
+        try:
+            import uvicorn
+            import server
+            import llm_scheduler
+
+            # The provider quota is shared by all workers; give each its share
+            llm_scheduler._scheduler = llm_scheduler.LLMScheduler(
+                rpm=llm_scheduler.LLM_RPM_LIMIT / self.num_workers,
+                tpm=llm_scheduler.LLM_TPM_LIMIT / self.num_workers,
+            )
+            ready_write = self.ready_write
+            server.app.on_ready = lambda: os.write(ready_write, f"{os.getpid()}\n".encode())
+            # Only the parent watches the knowledge base (see on_kb_change)
+            server.app.watch_kb = False
+            config = uvicorn.Config(server.app, ws="websockets", log_level="warning",
+                                    timeout_graceful_shutdown=PREFORK_GRACEFUL_TIMEOUT)
+            uvicorn.Server(config).run(sockets=[self.sock])
+        except Exception as e:
+            print(f"⚠️  Worker {os.getpid()} (slot {slot}) failed: {e}")
+            sys.stdout.flush()
+            os._exit(1)
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the chatbot from pre-forked workers sharing one loaded model.")
+    parser.add_argument("--host", default=os.getenv("SERVER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVER_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=PREFORK_WORKERS)
+    parser.add_argument("--no-preload", action="store_true",
+                        help="Let every worker load its own model and index (the per-process baseline).")
+    args = parser.parse_args()
+
+    # Any worker may serve any session's next request, so sessions must live outside the workers
+    os.environ.setdefault("SESSION_STORE", "sqlite")
+    from kb_watcher import KB_WATCH
+    PreforkServer(args.host, args.port, workers=args.workers, preload_app=not args.no_preload,
+                  watch_kb=KB_WATCH).run()
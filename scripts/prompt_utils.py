@@ -1,56 +1,40 @@
-import os
-import json
+import re
+import threading
+from contextlib import contextmanager
+
+from kb_snapshot import get_snapshot
+
+
+def service_code(service_name):
+    """Normalised service identifier as used in workflow JSON: "PAN ADVANCED" -> "PAN_ADVANCED"."""
+    return re.sub(r'[^A-Z0-9]+', '_', service_name.upper()).strip('_')
+
 
 def load_knowledge_base_data():
-    """Dynamically load categories, services, and vendors from the knowledge base."""
-    knowledge_base_path = os.path.join(os.path.dirname(__file__), '..', 'knowledge_base')
-    
-    # Load services
-    services_path = os.path.join(knowledge_base_path, 'services')
-    services = []
-    categories = set()
-    category_to_services = {}
-    
-    if os.path.exists(services_path):
-        for filename in os.listdir(services_path):
-            if filename.endswith('.json'):
-                try:
-                    filepath = os.path.join(services_path, filename)
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        service_data = json.load(f)
-                        service_name = service_data.get('service_name', service_data.get('name', ''))
-                        category = service_data.get('category', 'Other')
-                        
-                        if service_name:
-                            services.append(service_name)
-                            categories.add(category)
-                            
-                            if category not in category_to_services:
-                                category_to_services[category] = []
-                            category_to_services[category].append(service_name)
-                except (json.JSONDecodeError, Exception):
-                    continue
-    
-    # Load vendors from vendor_health.json
-    vendors = []
-    vendor_health_path = os.path.join(knowledge_base_path, 'vendors', 'vendor_health.json')
-    
-    if os.path.exists(vendor_health_path):
-        try:
-            with open(vendor_health_path, 'r', encoding='utf-8') as f:
-                vendor_data = json.load(f)
-                if 'data' in vendor_data and 'rowData' in vendor_data['data']:
-                    for vendor in vendor_data['data']['rowData']:
-                        vendor_name = vendor.get('name', '')
-                        if vendor_name:
-                            vendors.append(vendor_name)
-        except (json.JSONDecodeError, Exception):
-            pass
-    
-    return list(categories), services, dict(category_to_services), vendors
+    """
+    Categories, services and vendors from the compiled knowledge base snapshot
+    (see kb_snapshot.py; rebuilt automatically when a file changed).
 
-# Load dynamic data from knowledge base
-ALLOWED_CATEGORIES, ALLOWED_SERVICES, CATEGORY_TO_SERVICES, ALLOWED_VENDORS = load_knowledge_base_data()
+    Also returns the vendor availability indexes built from each service's
+    `available_vendors`: service name -> vendors and vendor -> service names.
+    Raises KnowledgeBaseError if the knowledge base is missing or malformed.
+    """
+    snapshot = get_snapshot()
+    return (list(snapshot.categories), list(snapshot.services), dict(snapshot.category_to_services),
+            list(snapshot.vendors), snapshot.service_to_vendors, snapshot.vendor_to_services)
+
+
+def vendors_for_service(service):
+    """
+    Vendors with health data that serve `service` (knowledge-base name or code such
+    as "PAN_ADVANCED"), in ALLOWED_VENDORS order. None if the service is unknown.
+    """
+    kb = current_kb()
+    name = service if service in kb.service_to_vendors else kb.service_by_code.get(service_code(service or ""))
+    if name is None:
+        return None
+    available = set(kb.service_to_vendors[name])
+    return [vendor for vendor in kb.vendors if vendor in available]
 
 # Health metrics that can be used (these are standard vendor metrics)
 ALLOWED_HEALTH_METRICS = [
@@ -70,26 +54,24 @@ ALLOWED_HEALTH_METRICS = [
     "p99"
 ]
 
-ALLOWED_CATEGORIES_STR = ", ".join(ALLOWED_CATEGORIES)
-ALLOWED_SERVICES_STR = ", ".join(ALLOWED_SERVICES)
-ALLOWED_VENDORS_STR = ", ".join(ALLOWED_VENDORS)
 ALLOWED_HEALTH_METRICS_STR = ", ".join(ALLOWED_HEALTH_METRICS)
 
-def format_category_services():
-    """Format the category-to-services mapping for prompt inclusion."""
+def format_category_services(category_to_services=None):
+    """Format the category-to-services mapping (the current one by default) for prompt inclusion."""
     formatted = []
-    for category, services in CATEGORY_TO_SERVICES.items():
+    for category, services in (category_to_services or current_kb().category_to_services).items():
         services_list = ', '.join(services)
         formatted.append(f"  • {category}: {services_list}")
     return '\n'.join(formatted)
 
 
-STAGE_INSTRUCTIONS = {
-    "STAGE_1": f"""
+# Prompt blocks naming knowledge-base entities are templates, filled in per KnowledgeBaseState
+STAGE_INSTRUCTION_TEMPLATES = {
+    "STAGE_1": """
 STAGE_1: CATEGORY IDENTIFICATION AND SELECTION
 - GREET THE USER.
 - ASK QUESTIONS TO HELP IDENTIFY THE FINTECH SERVICE CATEGORY THEY ARE INTERESTED IN.
-- ONLY CONSIDER THESE CATEGORIES: {ALLOWED_CATEGORIES_STR}.
+- ONLY CONSIDER THESE CATEGORIES: {categories}.
 - PRESENT THE AVAILABLE CATEGORIES FROM THE PLATFORM.
 - HELP THE USER SELECT ONE CATEGORY.
 - CONFIRM THEIR SELECTION BEFORE PROCEEDING.
@@ -97,11 +79,11 @@ STAGE_1: CATEGORY IDENTIFICATION AND SELECTION
 - DO NOT PROCEED TO SERVICE SELECTION UNTIL THE USER EXPLICITLY CONFIRMS THEIR CATEGORY CHOICE.
 - ONLY PROCEED TO STAGE_2 AFTER USER EXPLICITLY CONFIRMS THEIR CATEGORY CHOICE.
 """,
-    "STAGE_2": f"""
+    "STAGE_2": """
 STAGE_2: SERVICE IDENTIFICATION AND SELECTION
 - BASED ON THE SELECTED CATEGORY, RECOMMEND ONLY THE FINTECH SERVICE(S) THAT BELONG TO THAT SPECIFIC CATEGORY.
 - AVAILABLE CATEGORIES AND THEIR SERVICES:
-{format_category_services()}
+{category_services}
 - EXTRACT THE SELECTED CATEGORY FROM THE CONVERSATION CONTEXT.
 - LIST ALL SERVICES FOR THE SELECTED CATEGORY (AS SHOWN ABOVE) - DO NOT MISS ANY SERVICES.
 - ONLY USE THE SERVICES PROVIDED IN THE KNOWLEDGE BASE CONTEXT BELOW.
@@ -113,13 +95,13 @@ STAGE_2: SERVICE IDENTIFICATION AND SELECTION
 - CONFIRM THEIR CHOICE.
 - ONLY PROCEED TO STAGE_3 AFTER USER EXPLICITLY CONFIRMS THEIR SERVICE CHOICE.
 """,
-    "STAGE_3": f"""
+    "STAGE_3": """
 STAGE_3: VENDOR CHOOSING AND FINALIZATION
 - ASK THE USER ABOUT THEIR PRIORITIES (E.G., HIGH SUCCESS RATE, LOW LATENCY, RELIABILITY).
 - BASED ON USER PRIORITIES, ANALYZE VENDOR HEALTH METRICS FROM THE KNOWLEDGE BASE.
 - PRESENT VENDORS RANKED BY THEIR PERFORMANCE ACCORDING TO USER PRIORITIES.
-- ONLY CONSIDER THESE VENDORS: {ALLOWED_VENDORS_STR}.
-- WHEN PRIORITIZING VENDORS, ONLY USE THE FOLLOWING HEALTH METRICS: {ALLOWED_HEALTH_METRICS_STR}.
+- ONLY CONSIDER THESE VENDORS: {vendors}.
+- WHEN PRIORITIZING VENDORS, ONLY USE THE FOLLOWING HEALTH METRICS: {health_metrics}.
 - USE ONLY THE VENDOR HEALTH DATA PROVIDED IN THE KNOWLEDGE BASE - DO NOT FABRICATE METRICS.
 - PROVIDE SPECIFIC METRICS FROM THE KNOWLEDGE BASE TO SUPPORT YOUR RECOMMENDATIONS.
 - DO NOT DISCUSS VENDOR METRICS LIKE PRICING, INTEGRATION METHODS AND OTHERS NOT MENTIONED TO YOU IN YOUR GIVEN LIST.
@@ -151,7 +133,7 @@ EXAMPLE ASCII FLOW CHART FORMAT:
 └─────────────────────┘
 ```
 """,
-    "STAGE_4": f"""
+    "STAGE_4": """
 STAGE_4: WORKFLOW GENERATION
 - THE USER HAS EXPLICITLY SELECTED THEIR PREFERRED VENDOR - USE THAT AS THE PRIMARY VENDOR.
 - GENERATE A JSON OBJECT THAT REPRESENTS THE FINAL API REQUEST TO YOUR PLATFORM.
@@ -187,31 +169,31 @@ EXAMPLE JSON STRUCTURE:
 """
 }
 
-VENDOR_SCOPE_NOTICE = f"""
+VENDOR_SCOPE_NOTICE_TEMPLATE = """
 VENDOR RULES:
 - YOU MUST ONLY MENTION OR RECOMMEND VENDORS FROM THE FOLLOWING LIST:
-  {ALLOWED_VENDORS_STR}.
+  {vendors}.
 - DO NOT MENTION OR RECOMMEND ANY VENDORS NOT IN THIS LIST.
 """
 
-SERVICE_SCOPE_NOTICE = f"""
+SERVICE_SCOPE_NOTICE_TEMPLATE = """
 SERVICE RULES:
 - YOU MUST ONLY MENTION OR RECOMMEND SERVICES FROM THE FOLLOWING LIST:
-  {ALLOWED_SERVICES_STR}.
+  {services}.
 - DO NOT MENTION OR RECOMMEND ANY SERVICES NOT IN THIS LIST.
 """
 
-CATEGORY_SCOPE_NOTICE = f"""
+CATEGORY_SCOPE_NOTICE_TEMPLATE = """
 CATEGORY RULES:
 - YOU MUST ONLY MENTION OR RECOMMEND CATEGORIES FROM THE FOLLOWING LIST:
-  {ALLOWED_CATEGORIES_STR}.
+  {categories}.
 - DO NOT MENTION OR RECOMMEND ANY CATEGORIES NOT IN THIS LIST.
 """
 
-HEALTH_METRIC_SCOPE_NOTICE = f"""
+HEALTH_METRIC_SCOPE_NOTICE_TEMPLATE = """
 HEALTH METRIC RULES:
 - WHEN EVALUATING OR PRIORITIZING VENDORS, YOU MUST ONLY USE THE FOLLOWING HEALTH METRICS:
-  {ALLOWED_HEALTH_METRICS_STR}.
+  {health_metrics}.
 - DO NOT CONSIDER ANY METRICS OUTSIDE THIS LIST (E.G. PRICING, INTEGRATION METHODS).
 """
 
@@ -226,12 +208,12 @@ IMPORTANT_REMINDER = """
 - DO NOT MIX SERVICES FROM DIFFERENT CATEGORIES - STICK TO THE SELECTED CATEGORY ONLY.
 """
 
-CONSTRAINTS_AND_FORMATTING = f"""
-{CATEGORY_SCOPE_NOTICE}
-{SERVICE_SCOPE_NOTICE}
-{VENDOR_SCOPE_NOTICE}
-{HEALTH_METRIC_SCOPE_NOTICE}
-{IMPORTANT_REMINDER}
+CONSTRAINTS_AND_FORMATTING_TEMPLATE = """
+{category_scope_notice}
+{service_scope_notice}
+{vendor_scope_notice}
+{health_metric_scope_notice}
+{important_reminder}
 
 FORMATTING REQUIREMENTS:
 - EACH STAGE'S OUTPUT MUST START WITH A HEADER: STAGE_1, STAGE_2, STAGE_3, OR STAGE_4.
@@ -250,47 +232,201 @@ CONSTRAINTS:
 - USE ONLY THE VENDOR HEALTH METRICS PROVIDED IN THE KNOWLEDGE BASE.
 """
 
-def build_prompt(user_query, stage, session_context="", knowledge_chunks=""):
-    prompt = (
+def format_prompt_blocks(categories, services, vendors, category_to_services):
+    """Stage instructions and the constraints block with these allowlists filled in: (stage -> text, constraints)."""
+    fields = {
+        "categories": ", ".join(categories),
+        "services": ", ".join(services),
+        "vendors": ", ".join(vendors),
+        "health_metrics": ALLOWED_HEALTH_METRICS_STR,
+        "category_services": format_category_services(category_to_services),
+    }
+    stage_instructions = {stage: template.format(**fields) for stage, template in STAGE_INSTRUCTION_TEMPLATES.items()}
+    constraints = CONSTRAINTS_AND_FORMATTING_TEMPLATE.format(
+        category_scope_notice=CATEGORY_SCOPE_NOTICE_TEMPLATE.format(**fields),
+        service_scope_notice=SERVICE_SCOPE_NOTICE_TEMPLATE.format(**fields),
+        vendor_scope_notice=VENDOR_SCOPE_NOTICE_TEMPLATE.format(**fields),
+        health_metric_scope_notice=HEALTH_METRIC_SCOPE_NOTICE_TEMPLATE.format(**fields),
+        important_reminder=IMPORTANT_REMINDER,
+    )
+    return stage_instructions, constraints
+
+
+def find_selected_vendor(session_context):
+    """Vendor the user asked to proceed with, scanning the whole transcript."""
+    kb = current_kb()
+    selected = set(kb.matcher.selected(session_context or "", "vendor"))
+    for vendor in kb.vendors:
+        if vendor in selected:
+            return vendor
+    return None
+
+def build_static_prefix(stage, kb=None):
+    """The constant part of a stage's prompt: role, stage rules, allowlists and formatting."""
+    kb = kb or current_kb()
+    return (
         f"=== CURRENT STAGE: {stage} ===\n\n"
         f"YOU MUST RESPOND AS IF YOU ARE IN {stage}. DO NOT MENTION ANY OTHER STAGE IN YOUR RESPONSE.\n\n"
         "YOU WILL STRICTLY FOLLOW ALL GUIDELINES, RULES, AND RESTRICTIONS SET OUT IN THIS PROMPT WITHOUT ANY DEVIATION.\n\n"
         "YOU ARE A CONVERSATIONAL FINTECH SOLUTIONS ADVISOR FOR AN ONLINE PLATFORM. "
         "YOUR JOB IS TO HELP USERS SELECT THE BEST FINTECH SERVICE AND VENDOR FOR THEIR APPLICATION'S NEEDS.\n\n"
-        f"{STAGE_INSTRUCTIONS.get(stage, '')}\n"
-        f"{CONSTRAINTS_AND_FORMATTING}\n"
+        f"{kb.stage_instructions.get(stage, '')}\n"
+        f"{kb.constraints_and_formatting}\n"
     )
-    
-    # For STAGE_4, extract and highlight the user's vendor selection
-    if stage == "STAGE_4" and session_context:
-        import re
-        # Look for vendor selection in the conversation
-        vendor_selection_patterns = [
-            r'proceed\s+with\s+(\w+)',
-            r'select\s+(\w+)',
-            r'choose\s+(\w+)',
-            r'want\s+(\w+)',
-            r'go\s+with\s+(\w+)',
-            r'pick\s+(\w+)'
-        ]
-        
-        selected_vendor = None
-        for pattern in vendor_selection_patterns:
-            matches = re.findall(pattern, session_context, re.IGNORECASE)
-            if matches:
-                # Check if the match is a known vendor (case-insensitive)
-                for vendor in ALLOWED_VENDORS:
-                    for match in matches:
-                        if vendor.lower() == match.lower():
-                            selected_vendor = vendor
-                            break
-                    if selected_vendor:
-                        break
-                if selected_vendor:
-                    break
-        
+
+
+class KnowledgeBaseState:
+    """
+    Everything derived from one knowledge base snapshot: the allowlists and indexes,
+    the filled-in prompt blocks, the static prefixes, the entity matcher and the
+    vendor health table.
+
+    Never changed once built. A reload (kb_watcher.py) builds a new state and
+    publishes it with swap_kb(), a single reference assignment, so anyone holding
+    a state sees one version throughout.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.version = snapshot.hash
+        self.categories = list(snapshot.categories)
+        self.services = list(snapshot.services)
+        self.category_to_services = dict(snapshot.category_to_services)
+        self.vendors = list(snapshot.vendors)
+        self.service_to_vendors = snapshot.service_to_vendors
+        self.vendor_to_services = snapshot.vendor_to_services
+        self.service_by_code = {service_code(name): name for name in self.service_to_vendors}
+        # Every vendor the knowledge base knows: health-file vendors first, then those only named by services
+        self.all_vendors = self.vendors + [name for name in self.vendor_to_services if name not in self.vendors]
+        self.known_vendor_names = set(self.all_vendors)
+        self.stage_instructions, self.constraints_and_formatting = format_prompt_blocks(
+            self.categories, self.services, self.vendors, self.category_to_services
+        )
+        # Built once per state; sent as the system message so it is byte-identical on every call
+        self.static_prefixes = {stage: build_static_prefix(stage, self) for stage in self.stage_instructions}
+        self._matcher = None
+        self._vendor_table = None
+        self._known_names = None
+
+    @property
+    def matcher(self):
+        """EntityMatcher over this state's names, built on first use."""
+        if self._matcher is None:
+            # Imported here: entity_matcher imports this module
+            from entity_matcher import EntityMatcher
+            self._matcher = EntityMatcher(self.vendors, self.services, self.categories, ALLOWED_HEALTH_METRICS)
+        return self._matcher
+
+    @property
+    def vendor_table(self):
+        """Vendor health table from this snapshot, parsed on first use."""
+        if self._vendor_table is None:
+            from vendor_ranking import VendorTable
+            self._vendor_table = VendorTable.from_rows(list(self.snapshot.vendor_metrics.values()))
+        return self._vendor_table
+
+    @property
+    def known_names(self):
+        """Vendor-like names the knowledge base uses anywhere (vendors, but also e.g. "WhatsApp"), collected on first use."""
+        if self._known_names is None:
+            from entity_matcher import vendor_like_names
+            self._known_names = vendor_like_names(self.snapshot.documents) | self.known_vendor_names
+        return self._known_names
+
+    def warm(self):
+        """Build the lazy parts now, so the first turn after a swap does not pay for them."""
+        self.matcher
+        self.vendor_table
+        self.known_names
+        return self
+
+
+# The live state (None until first use), and the state each thread pinned for its current turn
+_kb = None
+_kb_lock = threading.Lock()
+_pinned = threading.local()
+
+
+def current_kb():
+    """
+    The knowledge base state for this thread: the one pinned by pinned_kb(), else
+    the live one. The first call loads the snapshot (rebuilding it if stale), so
+    importing this module reads and writes nothing.
+    """
+    state = getattr(_pinned, "state", None)
+    if state is not None:
+        return state
+    if _kb is None:
+        with _kb_lock:
+            if _kb is None:
+                swap_kb(KnowledgeBaseState(get_snapshot()))
+    return _kb
+
+
+@contextmanager
+def pinned_kb():
+    """
+    Keep this thread on the current state until the block ends, so a reload that
+    lands mid-turn cannot mix two knowledge base versions in one reply.
+    """
+    if getattr(_pinned, "state", None) is not None:
+        yield _pinned.state
+        return
+    _pinned.state = current_kb()
+    try:
+        yield _pinned.state
+    finally:
+        _pinned.state = None
+
+
+def swap_kb(state):
+    """Make `state` the live knowledge base state for new turns; returns the previous one."""
+    global _kb
+    previous, _kb = _kb, state
+    return previous
+
+
+# Module-level names for scripts and benchmarks (the chatbot itself reads current_kb()) -> state attribute
+_STATE_ATTRIBUTES = {
+    "ALLOWED_CATEGORIES": "categories",
+    "ALLOWED_SERVICES": "services",
+    "CATEGORY_TO_SERVICES": "category_to_services",
+    "ALLOWED_VENDORS": "vendors",
+    "SERVICE_TO_VENDORS": "service_to_vendors",
+    "VENDOR_TO_SERVICES": "vendor_to_services",
+    "KB_VERSION": "version",
+    "STAGE_INSTRUCTIONS": "stage_instructions",
+    "STATIC_PREFIXES": "static_prefixes",
+}
+
+
+def __getattr__(name):
+    """Resolve the module-level knowledge base names against the current state, loading it on first use."""
+    attribute = _STATE_ATTRIBUTES.get(name)
+    if attribute is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(current_kb(), attribute)
+
+
+def get_static_prefix(stage):
+    prefix = current_kb().static_prefixes.get(stage)
+    return prefix if prefix is not None else build_static_prefix(stage)
+
+
+def build_dynamic_prompt(user_query, stage, session_context="", knowledge_chunks="", selected_vendor=None):
+    """The per-turn part of the prompt: vendor choice, conversation, knowledge and the user's request.
+
+    `selected_vendor` is the session's tracked vendor choice; for STAGE_4 it is only
+    looked up in `session_context` when not supplied.
+    """
+    prompt = ""
+
+    # For STAGE_4, highlight the user's vendor selection
+    if stage == "STAGE_4":
+        if selected_vendor is None and session_context:
+            selected_vendor = find_selected_vendor(session_context)
         if selected_vendor:
-            prompt += f"\n**IMPORTANT: THE USER HAS EXPLICITLY SELECTED '{selected_vendor}' AS THEIR PREFERRED VENDOR. USE THIS AS THE PRIMARY VENDOR IN YOUR JSON OUTPUT.**\n\n"
+            prompt += f"**IMPORTANT: THE USER HAS EXPLICITLY SELECTED '{selected_vendor}' AS THEIR PREFERRED VENDOR. USE THIS AS THE PRIMARY VENDOR IN YOUR JSON OUTPUT.**\n\n"
     
     if session_context:
         prompt += f"CONVERSATION SO FAR:\n{session_context}\n\n"
@@ -308,4 +444,11 @@ def build_prompt(user_query, stage, session_context="", knowledge_chunks=""):
         prompt += "IMPORTANT: USE ONLY THE DATA PROVIDED IN THE KNOWLEDGE BASE ABOVE. DO NOT FABRICATE ANY INFORMATION.\n\n"
     prompt += f"USER'S REQUEST: {user_query}\n"
     prompt += f"RESPOND USING THE SPECIFIED FORMATTING AND OUTPUT REQUIREMENTS ABOVE. REMEMBER YOU ARE IN {stage}.\n"
-    return prompt
\ No newline at end of file
+    return prompt
+
+
+def build_prompt(user_query, stage, session_context="", knowledge_chunks="", selected_vendor=None):
+    """Assemble the full single-message LLM prompt (static prefix followed by the dynamic part)."""
+    return get_static_prefix(stage) + "\n" + build_dynamic_prompt(
+        user_query, stage, session_context, knowledge_chunks, selected_vendor
+    )
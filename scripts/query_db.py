@@ -1,27 +1,261 @@
-import chromadb
 import os
-from sentence_transformers import SentenceTransformer
+import time
+import threading
+from embedding_cache import EmbeddingCache, EMBEDDING_CACHE_ENABLED, encode_with_cache
+from prompt_utils import service_code
 
+EMBEDDING_MODEL_NAME = "BAAI/bge-base-en-v1.5"
+COLLECTION_NAME = "fintech_services"
+# Query encoder: "torch" (SentenceTransformer), "onnx" or "onnx-int8" (ONNX Runtime, no torch import)
+ENCODER_BACKEND = os.getenv("ENCODER_BACKEND", "torch").lower()
+# Retrieval backend behind get_relevant_chunks: "chroma" or "numpy" (in-process exact search)
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "chroma").lower()
+# Storage dtype of the NumPy index when it has to be exported ("float32" or "float16")
+NUMPY_INDEX_DTYPE = os.getenv("NUMPY_INDEX_DTYPE", "float32")
+# Unix socket of a running embedding_service.py; queries are encoded there instead of in-process
+EMBEDDING_SERVICE_SOCKET = os.getenv("EMBEDDING_SERVICE_SOCKET")
+# Load the model and open the collection in a background thread when warm_up() is called
+WARMUP_IN_BACKGROUND = os.getenv("WARMUP_IN_BACKGROUND", "true").lower() in ("1", "true", "yes")
 
-print("🔄 Loading embedding model into memory...")
-# BGE models are better for structured data and RAG applications
-model = SentenceTransformer("BAAI/bge-base-en-v1.5")
-# Alternative: model = SentenceTransformer("BAAI/bge-large-en-v1.5") for better performance
-print("✅ Embedding model loaded!\n")
-
-
-print("🔄 Connecting to Chroma vector database (persistent on disk)...")
 # Get the project root directory (parent of scripts)
 script_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(script_dir)
 db_path = os.path.join(project_root, 'vector_db')
-client = chromadb.PersistentClient(path=db_path)
-print("✅ Chroma vector database loaded into memory!\n")
+
+# Heavy resources are created on first use (torch and Chroma are only imported then),
+# so importing this module is cheap. The lock makes first use safe from any thread.
+_init_lock = threading.RLock()
+_model = None
+_client = None
+_collection = None
+_embedding_cache = None
+_backend = None
+_chunk_index = None
+
+# Seconds spent on each initialisation step, for cold-start reporting
+STARTUP_TIMINGS = {}
+
+
+def get_model():
+    """
+    Return the query encoder (see ENCODER_BACKEND), loading it on first use.
+
+    With EMBEDDING_SERVICE_SOCKET set this is an EmbeddingServiceClient and no
+    model is loaded in this process.
+    """
+    global _model
+    if _model is None:
+        with _init_lock:
+            if _model is None and EMBEDDING_SERVICE_SOCKET:
+                from embedding_service import EmbeddingServiceClient
+                print(f"🔄 Encoding queries through the embedding service at {EMBEDDING_SERVICE_SOCKET}")
+                _model = EmbeddingServiceClient(EMBEDDING_SERVICE_SOCKET)
+            if _model is None:
+                print(f"🔄 Loading embedding model into memory ({ENCODER_BACKEND})...")
+                start = time.perf_counter()
+                from onnx_encoder import load_encoder
+                model = load_encoder(ENCODER_BACKEND)
+                STARTUP_TIMINGS["model_load"] = time.perf_counter() - start
+                print(f"✅ Embedding model loaded in {STARTUP_TIMINGS['model_load']:.2f}s!\n")
+                _model = model
+    return _model
+
+
+def encoder_stats():
+    """Throughput and queueing metrics of the embedding service, or None when encoding in-process."""
+    model = _model
+    if model is None or not hasattr(model, "stats"):
+        return None
+    try:
+        return model.stats()
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def get_collection():
+    """Return the "fintech_services" collection, connecting to Chroma on first use."""
+    global _client, _collection
+    if _collection is None:
+        with _init_lock:
+            if _collection is None:
+                print("🔄 Connecting to Chroma vector database (persistent on disk)...")
+                start = time.perf_counter()
+                import chromadb
+                _client = chromadb.PersistentClient(path=db_path)
+                collection = _client.get_or_create_collection(name=COLLECTION_NAME)
+                STARTUP_TIMINGS["collection_open"] = time.perf_counter() - start
+                print(f'✅ Collection "{COLLECTION_NAME}" ready in {STARTUP_TIMINGS["collection_open"]:.2f}s!\n')
+                _collection = collection
+    return _collection
+
+
+def get_chroma_client():
+    """Return the Chroma client behind get_collection(), connecting on first use."""
+    get_collection()
+    return _client
+
+
+def load_backend():
+    """Load the configured retrieval backend (see RETRIEVAL_BACKEND) from disk or Chroma."""
+    from vector_backends import ChromaBackend, NumpyBackend, export_numpy_index, numpy_index_exists
+    if RETRIEVAL_BACKEND == "numpy":
+        start = time.perf_counter()
+        if not numpy_index_exists():
+            print("🔄 Exporting Chroma collection to the NumPy index...")
+            export_numpy_index(get_collection(), dtype=NUMPY_INDEX_DTYPE)
+        backend = NumpyBackend()
+        STARTUP_TIMINGS["index_load"] = time.perf_counter() - start
+        print(f"✅ NumPy vector index loaded ({len(backend.ids)} chunks)!\n")
+        return backend
+    if RETRIEVAL_BACKEND == "chroma":
+        return ChromaBackend(get_collection())
+    raise ValueError(f"Unknown RETRIEVAL_BACKEND: {RETRIEVAL_BACKEND}")
+
+
+def get_backend():
+    """Return the configured retrieval backend (see RETRIEVAL_BACKEND)."""
+    global _backend
+    if _backend is None:
+        with _init_lock:
+            if _backend is None:
+                _backend = load_backend()
+    return _backend
+
+
+class ChunkIndex:
+    """
+    Exact-key lookup of chunks by metadata (service_name, category, vendor_name, type).
+
+    Built once from the collection's records; lookups are dict hits plus a set
+    intersection, with no embedding or vector search. Service names match by
+    service_code, so "PAN ADVANCED" and "PAN_ADVANCED" are the same key.
+    """
+
+    KEY_FIELDS = ("service_name", "category", "vendor_name", "type")
+
+    def __init__(self, ids, documents, metadatas):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.positions = {field: {} for field in self.KEY_FIELDS}
+        for position, metadata in enumerate(metadatas):
+            for field in self.KEY_FIELDS:
+                value = (metadata or {}).get(field)
+                if value:
+                    self.positions[field].setdefault(self.normalise(field, value), []).append(position)
+
+    @staticmethod
+    def normalise(field, value):
+        return service_code(value) if field == "service_name" else value
+
+    def get(self, **keys):
+        """Chunks whose metadata matches every given key, in index order, as {"ids", "documents", "metadatas"}."""
+        matches = None
+        for field, value in keys.items():
+            if value is None:
+                continue
+            if field not in self.positions:
+                raise ValueError(f"Unknown chunk index field: {field}")
+            found = self.positions[field].get(self.normalise(field, value), [])
+            matches = set(found) if matches is None else matches.intersection(found)
+        positions = sorted(matches) if matches is not None else range(len(self.ids))
+        return {
+            "ids": [self.ids[i] for i in positions],
+            "documents": [self.documents[i] for i in positions],
+            "metadatas": [self.metadatas[i] for i in positions]
+        }
+
+
+def build_chunk_index(backend):
+    """Exact-key chunk index over the records behind `backend`."""
+    if hasattr(backend, "metadatas"):
+        # The NumPy backend already holds every record in memory
+        return ChunkIndex(backend.ids, backend.documents, backend.metadatas)
+    data = get_collection().get(include=["documents", "metadatas"])
+    return ChunkIndex(data["ids"], data["documents"], data["metadatas"])
 
 
-print('🔄 Loading "fintech_services" collection...')
-collection = client.get_or_create_collection(name="fintech_services")
-print('✅ Collection "fintech_services" ready!\n')
+def get_chunk_index():
+    """Return the exact-key chunk index, building it from the loaded records on first use."""
+    global _chunk_index
+    if _chunk_index is None:
+        with _init_lock:
+            if _chunk_index is None:
+                start = time.perf_counter()
+                index = build_chunk_index(get_backend())
+                STARTUP_TIMINGS["chunk_index"] = time.perf_counter() - start
+                _chunk_index = index
+    return _chunk_index
+
+
+def reload_index():
+    """
+    Load the retrieval backend and chunk index again (after a re-index) and swap
+    both in together. Queries already running finish on the objects they hold.
+    """
+    global _backend, _chunk_index
+    backend = load_backend()
+    index = build_chunk_index(backend)
+    with _init_lock:
+        _backend, _chunk_index = backend, index
+    return backend
+
+
+def get_chunks_by_key(service_name: str = None, category: str = None,
+                      vendor_name: str = None, chunk_type: str = None) -> dict:
+    """
+    Fetch chunks by exact metadata keys, without an embedding call.
+
+    Returns a dict shaped like get_relevant_chunks (ids, documents, metadatas),
+    in index order.
+    """
+    return get_chunk_index().get(service_name=service_name, category=category,
+                                 vendor_name=vendor_name, type=chunk_type)
+
+
+def get_embedding_cache():
+    """Return the on-disk query embedding cache, or None if disabled."""
+    global _embedding_cache
+    if _embedding_cache is None and EMBEDDING_CACHE_ENABLED:
+        with _init_lock:
+            if _embedding_cache is None:
+                # Repeated queries (e.g. "<vendor> health metrics") are served from disk.
+                # ONNX embeddings are cached separately so they never mix with torch ones.
+                cache_name = EMBEDDING_MODEL_NAME
+                if ENCODER_BACKEND != "torch":
+                    cache_name = f"{EMBEDDING_MODEL_NAME}@{ENCODER_BACKEND}"
+                _embedding_cache = EmbeddingCache(cache_name)
+    return _embedding_cache
+
+
+def warm_up(background: bool = WARMUP_IN_BACKGROUND):
+    """
+    Load the model, run a dummy encode and open the collection ahead of the first query.
+
+    With background=True this runs in a daemon thread (returned to the caller) so it
+    overlaps with the user typing their first message; otherwise it blocks.
+    """
+    def _warm():
+        start = time.perf_counter()
+        try:
+            model = get_model()
+            encode_start = time.perf_counter()
+            model.encode(["warm-up"])
+            STARTUP_TIMINGS["first_encode"] = time.perf_counter() - encode_start
+            get_backend()
+            get_chunk_index()
+            get_embedding_cache()
+        except Exception as e:
+            print(f"⚠️  Warm-up failed, resources will load on first query: {e}")
+            return
+        STARTUP_TIMINGS["warm_up"] = time.perf_counter() - start
+
+    if not background:
+        _warm()
+        return None
+    thread = threading.Thread(target=_warm, name="query-db-warm-up", daemon=True)
+    thread.start()
+    return thread
 
 
 def get_relevant_chunks(query: str, top_k: int = 5, category_filter: str = None) -> dict:
@@ -38,27 +272,37 @@ def get_relevant_chunks(query: str, top_k: int = 5, category_filter: str = None)
             "documents": list of chunk texts,
             "metadatas": list of corresponding chunk metadata dicts
     """
-    print(f"\n🔍 Retrieving {top_k} chunks for query: {query}")
-    if category_filter:
-        print(f"🔍 Filtering by category: {category_filter}")
+    return get_relevant_chunks_batch([query], top_k=top_k, category_filter=category_filter)[0]
 
-    embedding = model.encode(query).tolist()
 
-    # Build where clause for category filtering
-    where_clause = None
-    if category_filter:
-        where_clause = {"category": category_filter}
+def get_relevant_chunks_batch(queries: list, top_k: int = 5, category_filter: str = None) -> list:
+    """
+    Retrieves the top-k relevant chunks for several queries at once.
 
-    results = collection.query(
-        query_embeddings=[embedding],
-        n_results=top_k,
-        where=where_clause if where_clause else None
-    )
+    All queries are encoded in a single batched forward pass and sent to the
+    retrieval backend as one multi-embedding query, instead of one encode + query
+    round-trip each.
+
+    Args:
+        queries: The search queries
+        top_k: Number of chunks to retrieve per query
+        category_filter: Optional category to filter by (applied to every query)
 
-    documents = results.get("documents", [[]])[0]  # List[str]
-    metadatas = results.get("metadatas", [[]])[0]  # List[dict]
+    Returns:
+        list with one dict per query (same order), each with keys:
+            "ids": list of chunk IDs,
+            "documents": list of chunk texts,
+            "metadatas": list of corresponding chunk metadata dicts
+    """
+    if not queries:
+        return []
+
+    if len(queries) == 1:
+        print(f"\n🔍 Retrieving {top_k} chunks for query: {queries[0]}")
+    else:
+        print(f"\n🔍 Retrieving {top_k} chunks for each of {len(queries)} queries")
+    if category_filter:
+        print(f"🔍 Filtering by category: {category_filter}")
 
-    return {
-        "documents": documents,
-        "metadatas": metadatas
-    }
+    embeddings = encode_with_cache(get_model(), queries, get_embedding_cache(), batch_size=len(queries))
+    return get_backend().query(embeddings, top_k, category_filter)
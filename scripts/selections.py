@@ -0,0 +1,193 @@
+import re
+
+from prompt_utils import current_kb, service_code
+from entity_matcher import MATCHER
+
+
+# Priority key -> (preferred direction, phrases that express it)
+PRIORITY_KEYWORDS = {
+    "success_rate": ("high", ["success rate", "success", "reliab", "accura"]),
+    "latency": ("low", ["latency", "fast", "speed", "quick", "response time"]),
+    "p95_latency": ("low", ["p95"]),
+    "p99_latency": ("low", ["p99", "tail latency"]),
+    "server_errors": ("low", ["5xx", "server error", "downtime", "uptime"]),
+    "user_side_issues": ("low", ["user side", "user-side", "4xx"]),
+}
+
+
+def find_json_category(text):
+    """Category from the first '"category": "..."' in text, normalised to the stored spelling."""
+    match = re.search(r'"category"\s*:\s*"([A-Za-z/ ]+)"', text)
+    if not match:
+        return None
+    category_from_json = match.group(1)
+    # Normalize to match the stored category format (all caps)
+    for stored_category in current_kb().category_to_services.keys():
+        if stored_category.lower() == category_from_json.lower():
+            return stored_category
+    return category_from_json
+
+
+def find_pattern_categories(text, mentions=None):
+    """Categories the text explicitly selects ("selected X", "X category", ...)."""
+    return set(MATCHER.selected(text, "category", mentions))
+
+
+def find_mentioned_categories(text, mentions=None):
+    """Categories that merely appear somewhere in the text."""
+    return set(MATCHER.mentioned(text, "category", mentions))
+
+
+def find_json_service(text):
+    match = re.search(r'"service"\s*:\s*"([A-Z_]+)"', text)
+    return match.group(1) if match else None
+
+
+def find_mentioned_services(text, mentions=None):
+    """Knowledge-base service names in text, in order of appearance."""
+    return MATCHER.mentioned(text, "service", mentions)
+
+
+def find_json_vendors(text):
+    """Vendor list from the first '"vendors": [...]' in text."""
+    match = re.search(r'"vendors"\s*:\s*\[(.*?)\]', text, re.DOTALL)
+    if match:
+        return re.findall(r'"([A-Za-z]+)"', match.group(1))
+    return []
+
+
+def find_selected_vendors(text, mentions=None):
+    """Vendors the text explicitly picks ("go with X", "select X", ...)."""
+    return set(MATCHER.selected(text, "vendor", mentions))
+
+
+def find_priorities(text):
+    """Priority keys expressed in text, in PRIORITY_KEYWORDS order."""
+    text_lower = text.lower()
+    return [
+        key for key, (_, phrases) in PRIORITY_KEYWORDS.items()
+        if any(phrase in text_lower for phrase in phrases)
+    ]
+
+
+class Selections:
+    """
+    Category, service, vendor(s) and priorities chosen so far in a conversation.
+
+    Filled incrementally by observe_turn(), so each turn is scanned exactly once.
+    Resolution rules match a scan of the whole transcript: the earliest JSON value
+    wins, then explicit selection phrases, then plain mentions, with ties broken by
+    knowledge-base order.
+    """
+
+    __slots__ = ("json_category", "pattern_categories", "mentioned_categories",
+                 "service", "user_services", "vendors", "selected_vendors", "priorities")
+
+    def __init__(self):
+        self.json_category = None
+        self.pattern_categories = set()
+        self.mentioned_categories = set()
+        self.service = None
+        # Service names the user typed, oldest first
+        self.user_services = []
+        self.vendors = []
+        self.selected_vendors = set()
+        self.priorities = {}
+
+    @classmethod
+    def from_context(cls, context):
+        """Build selections from a rendered transcript in one pass."""
+        selections = cls()
+        selections.observe(context)
+        for line in context.splitlines():
+            if line.startswith("User:"):
+                selections.observe_user(line[len("User:"):])
+        return selections
+
+    def observe(self, text):
+        """Fold one piece of conversation text into the selections."""
+        if not text:
+            return
+        mentions = MATCHER.find(text)
+        if self.json_category is None:
+            self.json_category = find_json_category(text)
+        self.pattern_categories |= find_pattern_categories(text, mentions)
+        self.mentioned_categories |= find_mentioned_categories(text, mentions)
+        if self.service is None:
+            self.service = find_json_service(text)
+        if not self.vendors:
+            self.vendors = find_json_vendors(text)
+        self.selected_vendors |= find_selected_vendors(text, mentions)
+
+    def observe_user(self, user_input):
+        """Record priorities and services stated by the user."""
+        for key in find_priorities(user_input or ""):
+            self.priorities.setdefault(key, PRIORITY_KEYWORDS[key][0])
+        for service in find_mentioned_services(user_input or ""):
+            if service in self.user_services:
+                self.user_services.remove(service)
+            self.user_services.append(service)
+
+    def observe_turn(self, user_input, assistant_response):
+        self.observe(f"User: {user_input}\nAssistant: {assistant_response}")
+        self.observe_user(user_input)
+
+    @property
+    def category(self):
+        if self.json_category:
+            return self.json_category
+        for candidates in (self.pattern_categories, self.mentioned_categories):
+            for category in current_kb().category_to_services.keys():
+                if category in candidates:
+                    return category
+        return None
+
+    @property
+    def selected_service(self):
+        """Knowledge-base name of the chosen service: the JSON value if any, else the last one the user named."""
+        if self.service:
+            return current_kb().service_by_code.get(service_code(self.service), self.service)
+        return self.user_services[-1] if self.user_services else None
+
+    @property
+    def vendor(self):
+        """The vendor the user explicitly picked, if any."""
+        for vendor in current_kb().vendors:
+            if vendor in self.selected_vendors:
+                return vendor
+        return None
+
+    def as_dict(self):
+        return {
+            "category": self.category,
+            "service": self.selected_service,
+            "vendor": self.vendor,
+            "vendors": list(self.vendors),
+            "priorities": dict(self.priorities),
+        }
+
+    def to_record(self):
+        """All observed state as JSON-serialisable values (for session stores)."""
+        return {
+            "json_category": self.json_category,
+            "pattern_categories": sorted(self.pattern_categories),
+            "mentioned_categories": sorted(self.mentioned_categories),
+            "service": self.service,
+            "user_services": list(self.user_services),
+            "vendors": list(self.vendors),
+            "selected_vendors": sorted(self.selected_vendors),
+            "priorities": dict(self.priorities),
+        }
+
+    @classmethod
+    def from_record(cls, record):
+        selections = cls()
+        selections.json_category = record.get("json_category")
+        selections.pattern_categories = set(record.get("pattern_categories", ()))
+        selections.mentioned_categories = set(record.get("mentioned_categories", ()))
+        selections.service = record.get("service")
+        selections.user_services = list(record.get("user_services", ()))
+        selections.vendors = list(record.get("vendors", ()))
+        selections.selected_vendors = set(record.get("selected_vendors", ()))
+        selections.priorities = dict(record.get("priorities", {}))
+        return selections
@@ -0,0 +1,298 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import functools
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from state_manager import SessionManager
+from query_db import warm_up, encoder_stats, STARTUP_TIMINGS
+from token_budget import static_prefix_report
+from main import run_turn, report_startup_timings
+from prompt_utils import current_kb
+from llm_scheduler import get_scheduler
+from kb_watcher import KB_WATCH, start_watcher
+
+
+SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+# Threads running turns; retrieval (encode, Chroma) and the LLM call all block
+TURN_WORKERS = int(os.getenv("TURN_WORKERS", "8"))
+# Turns running or waiting for a thread before new ones are refused (HTTP 503)
+MAX_PENDING_TURNS = int(os.getenv("MAX_PENDING_TURNS", "64"))
+MAX_MESSAGE_CHARS = int(os.getenv("MAX_MESSAGE_CHARS", "4000"))
+
+
+class ServerBusy(Exception):
+    """MAX_PENDING_TURNS turns are already queued or running."""
+
+
+class ChatServer:
+    """
+    ASGI app serving many conversations from one process.
+
+    Endpoints:
+      GET  /health      status, knowledge base version, session store and turn counts
+      POST /chat        {"message": ..., "session_id": optional} -> the full reply as JSON
+      WS   /ws          ?session_id=...; each text frame (plain text or {"message": ...})
+                        runs a turn, streamed back as {"type": "token"} frames followed
+                        by one {"type": "reply"} frame
+
+    Each turn runs main.run_turn in a bounded thread pool, so the event loop stays
+    free while turns wait on the embedding model, Chroma or the LLM. All sessions
+    share one SessionManager; a per-session asyncio lock runs a session's turns one
+    at a time while different sessions proceed concurrently.
+
+    With `watch_kb` (KB_WATCH) knowledge base edits are re-indexed and swapped in
+    while serving (see kb_watcher.py).
+    """
+
+    def __init__(self, workers=TURN_WORKERS, max_pending=MAX_PENDING_TURNS, watch_kb=KB_WATCH):
+        self.sm = SessionManager()
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="turn")
+        self.max_pending = max_pending
+        # session_id -> [lock, turns holding or waiting for it]; removed when unused
+        self.locks = {}
+        self.pending_turns = 0
+        self.turns_served = 0
+        # Called once startup is complete (prefork.py uses it to track worker readiness)
+        self.on_ready = None
+        self.watch_kb = watch_kb
+        self.kb_watcher_stop = None
+
+    @asynccontextmanager
+    async def session_lock(self, session_id):
+        """Run one session's turns one at a time; the lock only exists while a turn holds or waits for it."""
+        entry = self.locks.get(session_id)
+        if entry is None:
+            entry = self.locks[session_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.locks[session_id]
+
+    async def chat(self, session_id, message, on_token=None):
+        """Run one turn of a session off the event loop; on_token streams the reply (called from the worker thread)."""
+        if self.pending_turns >= self.max_pending:
+            raise ServerBusy(f"{self.pending_turns} turns pending")
+        self.pending_turns += 1
+        try:
+            async with self.session_lock(session_id):
+                start = time.perf_counter()
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self.executor,
+                    functools.partial(run_turn, self.sm, session_id, message,
+                                      on_token=on_token, stream=on_token is not None)
+                )
+        finally:
+            self.pending_turns -= 1
+        self.turns_served += 1
+        return {
+            "session_id": session_id,
+            "stage": self.sm.get_stage(session_id),
+            "turn_stage": result["stage"],
+            "reply": result["reply"],
+            "valid": result["valid"],
+            "shed": result["shed"],
+            "retry_after": result.get("retry_after"),
+            "metrics": {**result["llm_metrics"], "turn_s": time.perf_counter() - start},
+        }
+
+    def health(self):
+        return {
+            "status": "ok",
+            "kb_version": current_kb().version,
+            "sessions": self.sm.stats(),
+            "pending_turns": self.pending_turns,
+            "session_locks": len(self.locks),
+            "turns_served": self.turns_served,
+            "llm_scheduler": get_scheduler().stats(),
+            "embedding_service": encoder_stats(),
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.handle_http(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await self.handle_websocket(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            event = await receive()
+            if event["type"] == "lifespan.startup":
+                # Load the model, vector DB and indexes before accepting traffic
+                await asyncio.get_running_loop().run_in_executor(
+                    self.executor, functools.partial(warm_up, background=False)
+                )
+                prefix_tokens = ", ".join(f"{stage} {tokens}" for stage, tokens in static_prefix_report().items())
+                print(f"📏 Static prompt prefix tokens (est., sent as system message): {prefix_tokens}")
+                report_startup_timings()
+                if self.watch_kb:
+                    _, self.kb_watcher_stop = start_watcher()
+                print(f"💬 Chat server ready ({self.workers} turn workers).")
+                if self.on_ready:
+                    self.on_ready()
+                await send({"type": "lifespan.startup.complete"})
+            elif event["type"] == "lifespan.shutdown":
+                if self.kb_watcher_stop:
+                    self.kb_watcher_stop.set()
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.sm.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def handle_http(self, scope, receive, send):
+        method, path = scope["method"], scope["path"]
+        if path == "/health" and method == "GET":
+            await send_json(send, 200, self.health())
+            return
+        if path != "/chat":
+            await send_json(send, 404, {"error": "not found"})
+            return
+        if method != "POST":
+            await send_json(send, 405, {"error": "use POST"})
+            return
+
+        try:
+            request = json.loads(await read_body(receive) or b"{}")
+            message = parse_message(request)
+        except ValueError as e:
+            await send_json(send, 400, {"error": str(e)})
+            return
+        session_id = str(request.get("session_id") or uuid.uuid4().hex)
+        try:
+            result = await self.chat(session_id, message)
+            if result["shed"]:
+                # The LLM scheduler refused the turn; nothing was stored, the client may resend
+                retry_after = str(max(1, round(result.pop("retry_after") or 1))).encode()
+                await send_json(send, 503, result, headers=[(b"retry-after", retry_after)])
+            else:
+                result.pop("retry_after", None)
+                await send_json(send, 200, result)
+        except ServerBusy as e:
+            await send_json(send, 503, {"error": f"server busy ({e})"})
+        except Exception as e:
+            print(f"⚠️  Turn failed for session {session_id}: {e}")
+            await send_json(send, 500, {"error": "turn failed", "session_id": session_id})
+
+    async def handle_websocket(self, scope, receive, send):
+        if scope["path"] != "/ws":
+            await send({"type": "websocket.close", "code": 4404})
+            return
+        query = parse_qs(scope.get("query_string", b"").decode())
+        session_id = (query.get("session_id") or [uuid.uuid4().hex])[0]
+
+        event = await receive()
+        if event["type"] != "websocket.connect":
+            return
+        await send({"type": "websocket.accept"})
+        if not await try_send_frame(send, {"type": "session", "session_id": session_id}):
+            return
+
+        loop = asyncio.get_running_loop()
+        while True:
+            event = await receive()
+            if event["type"] == "websocket.disconnect":
+                return
+            text = event.get("text")
+            if text is None:
+                text = (event.get("bytes") or b"").decode("utf-8", "replace")
+            try:
+                message = parse_message(json.loads(text) if text.lstrip().startswith("{") else {"message": text})
+            except ValueError as e:
+                if not await try_send_frame(send, {"type": "error", "error": str(e)}):
+                    return
+                continue
+
+            # Tokens arrive on the worker thread; hand them to the loop in order
+            tokens = asyncio.Queue()
+            on_token = lambda token: loop.call_soon_threadsafe(tokens.put_nowait, token)
+            turn = asyncio.ensure_future(self.chat(session_id, message, on_token=on_token))
+            connected = True
+            while not (turn.done() and tokens.empty()):
+                getter = asyncio.ensure_future(tokens.get())
+                await asyncio.wait({getter, turn}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    if connected:
+                        connected = await try_send_frame(send, {"type": "token", "text": getter.result()})
+                else:
+                    getter.cancel()
+            try:
+                frame = {"type": "reply", **await turn}
+            except ServerBusy as e:
+                frame = {"type": "error", "error": f"server busy ({e})"}
+            except Exception as e:
+                print(f"⚠️  Turn failed for session {session_id}: {e}")
+                frame = {"type": "error", "error": "turn failed"}
+            if not connected or not await try_send_frame(send, frame):
+                # Client went away mid-turn; the turn still completed and is stored
+                return
+
+
+def parse_message(request):
+    """The user message from a request body, or ValueError."""
+    if not isinstance(request, dict):
+        raise ValueError("expected a JSON object")
+    message = request.get("message")
+    if not isinstance(message, str) or not message.strip():
+        raise ValueError("'message' must be a non-empty string")
+    if len(message) > MAX_MESSAGE_CHARS:
+        raise ValueError(f"'message' is longer than {MAX_MESSAGE_CHARS} characters")
+    return message.strip()
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        event = await receive()
+        body += event.get("body", b"")
+        if not event.get("more_body"):
+            return body
+
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_frame(send, payload):
+    await send({"type": "websocket.send", "text": json.dumps(payload)})
+
+
+async def try_send_frame(send, payload):
+    """send_frame, returning False instead of raising when the client has disconnected."""
+    try:
+        await send_frame(send, payload)
+    except (OSError, RuntimeError):
+        # uvicorn raises ClientDisconnected (an OSError) or RuntimeError for a send after close
+        return False
+    return True
+
+
+app = ChatServer()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the chatbot over HTTP and WebSocket.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, ws="websockets")
@@ -0,0 +1,462 @@
+import os
+import json
+import time
+import atexit
+import sqlite3
+import weakref
+import argparse
+import threading
+from collections import OrderedDict
+
+from selections import Selections
+from state_manager import SessionState, Turn
+
+
+# Where conversations live: "memory" (this process only) or "sqlite" (shared by worker processes)
+SESSION_STORE = os.getenv("SESSION_STORE", "memory").lower()
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH")
+# Sessions idle longer than this are dropped (0 keeps them forever)
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", str(24 * 3600)))
+# Most sessions kept (least recently active dropped first) and most turns kept per session
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "100000"))
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "200"))
+# Sessions held in memory by the SQLite store (the rest are read from disk on use)
+SESSION_HOT_CAPACITY = int(os.getenv("SESSION_HOT_CAPACITY", "1000"))
+# Delay before queued turn writes reach SQLite; callers flush synchronously beyond the queue limit
+SESSION_FLUSH_INTERVAL_MS = float(os.getenv("SESSION_FLUSH_INTERVAL_MS", "50"))
+SESSION_MAX_PENDING_WRITES = int(os.getenv("SESSION_MAX_PENDING_WRITES", "1000"))
+SESSION_SWEEP_INTERVAL_SECONDS = float(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", "60"))
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+DEFAULT_DB_PATH = os.path.join(project_root, 'vector_db', 'sessions.sqlite3')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    stage TEXT NOT NULL,
+    history_stage TEXT NOT NULL,
+    selections TEXT NOT NULL,
+    dropped_turns INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at);
+CREATE TABLE IF NOT EXISTS turns (
+    session_id TEXT NOT NULL REFERENCES sessions (session_id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    user TEXT NOT NULL,
+    assistant TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    PRIMARY KEY (session_id, idx)
+);
+"""
+
+
+class MemorySessionStore:
+    """
+    Sessions in this process only, as an LRU bounded by `max_sessions` and an idle TTL.
+
+    The least recently used session is at the front, so expiry and eviction only
+    ever look at the oldest entries.
+    """
+
+    def __init__(self, ttl=SESSION_TTL_SECONDS, max_sessions=SESSION_MAX_SESSIONS, max_turns=SESSION_MAX_TURNS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()  # session_id -> [SessionState, last_active]
+        self.counters = {"created": 0, "expired": 0, "evicted": 0}
+
+    def _evict(self, now):
+        while self.sessions:
+            session_id, (_, last_active) = next(iter(self.sessions.items()))
+            if self.ttl and now - last_active > self.ttl:
+                self.counters["expired"] += 1
+            elif len(self.sessions) > self.max_sessions:
+                self.counters["evicted"] += 1
+            else:
+                return
+            del self.sessions[session_id]
+
+    def get(self, session_id):
+        now = time.time()
+        with self.lock:
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                return None
+            if self.ttl and now - entry[1] > self.ttl:
+                del self.sessions[session_id]
+                self.counters["expired"] += 1
+                return None
+            return entry[0]
+
+    def create(self, session_id):
+        state = SessionState()
+        now = time.time()
+        with self.lock:
+            self.sessions[session_id] = [state, now]
+            self.sessions.move_to_end(session_id)
+            self.counters["created"] += 1
+            self._evict(now)
+        return state
+
+    def append(self, session_id, state, turn):
+        state.trim(self.max_turns)
+        now = time.time()
+        with self.lock:
+            self.sessions[session_id] = [state, now]
+            self.sessions.move_to_end(session_id)
+            self._evict(now)
+
+    def reset(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+        return self.create(session_id)
+
+    def stats(self):
+        with self.lock:
+            return {"backend": "memory", "sessions": len(self.sessions), **self.counters}
+
+    def close(self):
+        pass
+
+
+class SQLiteSessionStore:
+    """
+    Sessions in a SQLite database (WAL mode) that several worker processes share,
+    with the recently used ones cached in memory.
+
+    - Hot tier: up to `hot_capacity` SessionState objects in an LRU. Before a
+      cached session is used, its row version is compared with the database; if
+      another process wrote a newer turn, the session is reloaded.
+    - Write-behind: append() only queues the new turn; a background thread
+      writes queued turns in one transaction every `flush_interval_ms`. A
+      session with queued writes is never re-read from disk before they land.
+    - Each write expects the version the session was read at (remembered per
+      SessionState, so it survives the hot tier evicting the session between
+      get() and append()). If another process got there first, the turn is
+      appended after theirs, the conflict is counted and the cached copy is
+      dropped so the next use reads the merged session. Only turns are merged:
+      stage, history_stage and selections are last-writer-wins, so they reflect
+      whichever process wrote last. Route a session's turns to one process at a
+      time (as server.py's per-session lock does within a process) to avoid that.
+    - The writer thread also deletes sessions idle longer than `ttl` and the
+      least recently active ones beyond `max_sessions`; each session keeps at
+      most `max_turns` turns. An expired session read or written before the
+      sweep gets to it is deleted on the spot, so it never comes back.
+
+    Connections and the writer thread are created lazily in the process that
+    uses them, so a store built before fork() (prefork.py) works in each worker.
+    """
+
+    def __init__(self, path=None, ttl=SESSION_TTL_SECONDS, max_sessions=SESSION_MAX_SESSIONS,
+                 max_turns=SESSION_MAX_TURNS, hot_capacity=SESSION_HOT_CAPACITY,
+                 flush_interval_ms=SESSION_FLUSH_INTERVAL_MS, max_pending=SESSION_MAX_PENDING_WRITES,
+                 sweep_interval=SESSION_SWEEP_INTERVAL_SECONDS):
+        self.path = path or SESSION_DB_PATH or DEFAULT_DB_PATH
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.hot_capacity = hot_capacity
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_pending = max_pending
+        self.sweep_interval = sweep_interval
+
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.local = threading.local()
+        self.hot = OrderedDict()   # session_id -> [SessionState, version]
+        self.versions = weakref.WeakKeyDictionary()  # SessionState -> version it was read or last written at
+        self.queue = []            # pending writes, in order
+        self.pending = {}          # session_id -> queued writes not yet in the database
+        self.writer = None
+        self.writer_pid = None
+        self.closed = False
+        self.counters = {"hits": 0, "loads": 0, "reloads": 0, "writes": 0, "flushes": 0,
+                         "conflicts": 0, "expired": 0, "evicted": 0}
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        conn.close()
+        atexit.register(self.close)
+
+    def _connection(self):
+        """This thread's connection (a fresh one after fork)."""
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            # Autocommit; flush() opens its own write transaction
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def _ensure_writer(self):
+        if self.writer_pid != os.getpid():
+            with self.lock:
+                if self.writer_pid != os.getpid():
+                    self.writer = threading.Thread(target=self._write_loop, name="session-writer", daemon=True)
+                    self.writer_pid = os.getpid()
+                    self.writer.start()
+
+    # --- reads ---
+
+    def _expired(self, updated_at):
+        return bool(self.ttl) and time.time() - updated_at > self.ttl
+
+    def _db_version(self, session_id):
+        """The session's row version; 0 if it has no row or the row has expired."""
+        row = self._connection().execute(
+            "SELECT version, updated_at FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None or self._expired(row[1]):
+            return 0
+        return row[0]
+
+    def _delete_expired(self, conn, session_id, updated_at):
+        """Delete a session (its turns go by cascade) unless it was written after `updated_at`."""
+        deleted = conn.execute("DELETE FROM sessions WHERE session_id = ? AND updated_at = ?",
+                               (session_id, updated_at))
+        self.counters["expired"] += deleted.rowcount
+
+    def _load(self, session_id):
+        """(SessionState, version) from the database, or None."""
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT stage, history_stage, selections, dropped_turns, version, updated_at "
+            "FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        stage, history_stage, selections, dropped_turns, version, updated_at = row
+        if self._expired(updated_at):
+            self._delete_expired(conn, session_id, updated_at)
+            return None
+        turns = [Turn.restore(*turn) for turn in conn.execute(
+            "SELECT user, assistant, stage, summary, tokens FROM turns WHERE session_id = ? ORDER BY idx",
+            (session_id,))]
+        state = SessionState.restore(stage, history_stage, Selections.from_record(json.loads(selections)),
+                                     turns, dropped_turns)
+        return state, version
+
+    def _cache(self, session_id, state, version):
+        self.hot[session_id] = [state, version]
+        self.versions[state] = version
+        self.hot.move_to_end(session_id)
+        while len(self.hot) > self.hot_capacity:
+            # Safe even with queued writes: get() flushes before reading such a session
+            self.hot.popitem(last=False)
+
+    def get(self, session_id):
+        with self.lock:
+            entry = self.hot.get(session_id)
+            if entry is not None:
+                self.hot.move_to_end(session_id)
+            pending = session_id in self.pending
+        if entry is not None:
+            if pending:
+                self.counters["hits"] += 1
+                return entry[0]
+            # A session not yet written has no row (version 0)
+            if self._db_version(session_id) == entry[1]:
+                self.counters["hits"] += 1
+                return entry[0]
+            # Written by another process, expired or deleted since it was cached
+            self.counters["reloads"] += 1
+        elif pending:
+            self.flush()
+
+        loaded = self._load(session_id)
+        with self.lock:
+            if loaded is None:
+                self.hot.pop(session_id, None)
+                return None
+            self.counters["loads"] += 1
+            self._cache(session_id, *loaded)
+        return loaded[0]
+
+    # --- writes ---
+
+    def create(self, session_id):
+        state = SessionState()
+        with self.lock:
+            self._cache(session_id, state, 0)
+        return state
+
+    def append(self, session_id, state, turn):
+        """Queue the session's new turn (already added to `state`) for writing."""
+        state.trim(self.max_turns)
+        index = state.dropped_turns + len(state.turns) - 1
+        fields = (state.stage, state.history_stage, json.dumps(state.selections.to_record()), state.dropped_turns)
+        turn_row = (turn.user, turn.assistant, turn.stage, turn.summary, turn.tokens)
+        with self.lock:
+            # A state this store never handed out is a new session (no row yet)
+            base_version = self.versions.get(state, 0)
+            self._cache(session_id, state, base_version + 1)
+            self.queue.append((session_id, base_version, index, fields, turn_row, time.time()))
+            self.pending[session_id] = self.pending.get(session_id, 0) + 1
+            backlog = len(self.queue)
+        self._ensure_writer()
+        if backlog >= self.max_pending:
+            # The writer is falling behind; write on the caller's time instead of growing the queue
+            self.flush()
+        else:
+            self.wake.set()
+
+    def reset(self, session_id):
+        self.flush()
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        return self.create(session_id)
+
+    def flush(self):
+        """Write every queued turn to the database in one transaction."""
+        with self.flush_lock:
+            with self.lock:
+                batch, self.queue = self.queue, []
+            if not batch:
+                return
+            stale = set()
+            conn = self._connection()
+            # Take the write lock before reading any version, so no other process commits in between
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for session_id, base_version, index, fields, turn_row, updated_at in batch:
+                    row = conn.execute("SELECT version, updated_at FROM sessions WHERE session_id = ?",
+                                       (session_id,)).fetchone()
+                    if row is not None and self._expired(row[1]):
+                        # Never merge into an expired session: it starts over
+                        self._delete_expired(conn, session_id, row[1])
+                        row = None
+                    db_version = row[0] if row else 0
+                    version = base_version + 1
+                    if db_version != base_version:
+                        # Another process wrote this session meanwhile: keep both turns, in arrival order
+                        self.counters["conflicts"] += 1
+                        stale.add(session_id)
+                        version = db_version + 1
+                        index = conn.execute("SELECT COALESCE(MAX(idx) + 1, ?) FROM turns WHERE session_id = ?",
+                                             (index, session_id)).fetchone()[0]
+                    conn.execute(
+                        "INSERT INTO sessions (session_id, stage, history_stage, selections, dropped_turns, "
+                        "version, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (session_id) DO UPDATE SET stage = excluded.stage, "
+                        "history_stage = excluded.history_stage, selections = excluded.selections, "
+                        "dropped_turns = excluded.dropped_turns, version = excluded.version, "
+                        "updated_at = excluded.updated_at",
+                        (session_id, *fields, version, updated_at))
+                    # A plain INSERT: an index collision is an error, never a silently replaced turn
+                    conn.execute("INSERT INTO turns VALUES (?, ?, ?, ?, ?, ?, ?)", (session_id, index, *turn_row))
+                    if self.max_turns:
+                        conn.execute("DELETE FROM turns WHERE session_id = ? AND idx <= ?",
+                                     (session_id, index - self.max_turns))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            with self.lock:
+                for session_id, *_ in batch:
+                    self.pending[session_id] -= 1
+                    if not self.pending[session_id]:
+                        del self.pending[session_id]
+                for session_id in stale:
+                    if session_id not in self.pending:
+                        self.hot.pop(session_id, None)
+                self.counters["writes"] += len(batch)
+                self.counters["flushes"] += 1
+
+    def sweep(self):
+        """Delete expired sessions and the least recently active ones beyond max_sessions."""
+        with self._connection() as conn:
+            if self.ttl:
+                expired = conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+                self.counters["expired"] += expired.rowcount
+            if self.max_sessions:
+                evicted = conn.execute(
+                    "DELETE FROM sessions WHERE session_id IN (SELECT session_id FROM sessions "
+                    "ORDER BY updated_at DESC LIMIT -1 OFFSET ?)", (self.max_sessions,))
+                self.counters["evicted"] += evicted.rowcount
+
+    def _write_loop(self):
+        last_sweep = time.monotonic()
+        while not self.closed:
+            self.wake.wait(self.sweep_interval)
+            self.wake.clear()
+            # Let a burst of turns collect into one transaction
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+                if time.monotonic() - last_sweep >= self.sweep_interval:
+                    last_sweep = time.monotonic()
+                    self.sweep()
+            except sqlite3.Error as e:
+                print(f"⚠️  Session store write failed, retrying: {e}")
+
+    def stats(self):
+        with self.lock:
+            stats = {"backend": "sqlite", "hot_sessions": len(self.hot), "pending_writes": len(self.queue),
+                     **self.counters}
+        stats["sessions"] = self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return stats
+
+    def close(self):
+        """Write out queued turns; safe to call more than once."""
+        if self.queue:
+            self.flush()
+        self.closed = True
+        self.wake.set()
+
+
+def create_session_store(backend=SESSION_STORE):
+    """The session store selected by SESSION_STORE."""
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "sqlite":
+        return SQLiteSessionStore()
+    raise ValueError(f"Unknown SESSION_STORE: {backend}")
+
+
+def benchmark(path, sessions=200, turns=10, hot_capacity=SESSION_HOT_CAPACITY):
+    """Write and read back `sessions` × `turns` synthetic turns and report throughput and memory bounds."""
+    if os.path.exists(path):
+        raise SystemExit(f"{path} exists; pass a new --db path for the benchmark")
+    store = SQLiteSessionStore(path, hot_capacity=hot_capacity)
+    start = time.perf_counter()
+    for turn_number in range(turns):
+        for session in range(sessions):
+            session_id = f"bench-{session}"
+            state = store.get(session_id) or store.create(session_id)
+            turn = Turn(f"message {turn_number} about KYC and PAN ADVANCED",
+                        f"STAGE_1\n\nReply {turn_number}. Which category fits best?", state.stage)
+            state.add_turn(turn)
+            store.append(session_id, state, turn)
+    store.flush()
+    elapsed = time.perf_counter() - start
+    print(f"⏱️  {sessions * turns} turns appended in {elapsed:.2f}s "
+          f"({sessions * turns / elapsed:.0f}/s, {store.counters['flushes']} transactions)")
+
+    # A second store sees the same database as another worker process would
+    other = SQLiteSessionStore(path, hot_capacity=hot_capacity)
+    start = time.perf_counter()
+    complete = sum(len(other.get(f"bench-{session}").turns) == turns for session in range(sessions))
+    print(f"⏱️  {sessions} sessions read back cold in {time.perf_counter() - start:.2f}s, "
+          f"{complete} complete; hot tier holds {len(other.hot)} (capacity {hot_capacity})")
+    store.close()
+    other.close()
+    print(f"📦 {store.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the SQLite session store.")
+    parser.add_argument("--db", default="/tmp/session_store_bench.sqlite3")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--hot-capacity", type=int, default=100)
+    args = parser.parse_args()
+
+    benchmark(args.db, args.sessions, args.turns, args.hot_capacity)
@@ -1,36 +1,227 @@
-class SessionManager:
+import re
+
+from selections import Selections
+from prompt_utils import current_kb
+from entity_matcher import MATCHER
+from token_budget import count_tokens
+
+STAGE_ORDER = ["STAGE_1", "STAGE_2", "STAGE_3", "STAGE_4"]
+# Older turns are summarised in at most this many lines (the oldest drop off first)
+SUMMARY_MAX_LINES = 12
+SUMMARY_SNIPPET_CHARS = 120
+# Partial names that also show the bot presented options; replies do not always use the full knowledge-base names
+CATEGORY_KEYWORDS = ["asset verification", "alternate data suite", "employment verification",
+                     "onboarding", "kyc/aml", "banking", "utility bill", "credit risk"]
+SERVICE_KEYWORDS = ["rc verification", "mobile to rc", "pan", "verification", "service"]
+
+
+def presented(response, entity_type, keywords):
+    """True if the response names an entity of this type, in full or by one of the keywords (substring match)."""
+    lowered = response.lower()
+    return bool(MATCHER.mentioned(response, entity_type)) or any(keyword in lowered for keyword in keywords)
+
+
+def _snippet(text):
+    """First sentence of text, shortened to SUMMARY_SNIPPET_CHARS."""
+    text = " ".join(text.split())
+    # Skip the "STAGE_n" header the assistant starts every reply with
+    text = re.sub(r'^(?:#+\s*)?STAGE_\d\b[:\s]*', '', text)
+    sentence = re.split(r'(?<=[.!?])\s', text, maxsplit=1)[0]
+    if len(sentence) > SUMMARY_SNIPPET_CHARS:
+        sentence = sentence[:SUMMARY_SNIPPET_CHARS - 3].rstrip() + "..."
+    return sentence
+
+
+class Turn:
+    """One user/assistant exchange, with its summary line and token count computed once."""
+
+    __slots__ = ("user", "assistant", "stage", "summary", "tokens")
+
+    def __init__(self, user, assistant, stage):
+        self.user = user
+        self.assistant = assistant
+        self.stage = stage
+        self.summary = f"- [{stage}] User: {_snippet(user)} | Assistant: {_snippet(assistant)}"
+        self.tokens = count_tokens(self.render())
+
+    @classmethod
+    def restore(cls, user, assistant, stage, summary, tokens):
+        """Rebuild a stored turn without recomputing its summary and token count."""
+        turn = cls.__new__(cls)
+        turn.user, turn.assistant, turn.stage = user, assistant, stage
+        turn.summary, turn.tokens = summary, tokens
+        return turn
+
+    def render(self):
+        return f"User: {self.user}\nAssistant: {self.assistant}"
+
+
+class SessionState:
+    """
+    Turn records plus structured fields that are updated once per turn.
+
+    The transcript string is only rendered (and cached) when a prompt needs it.
+    """
+
+    __slots__ = ("turns", "stage", "history_stage", "selections", "transcript_tokens",
+                 "dropped_turns", "_rendered", "_rendered_turns", "__weakref__")
+
     def __init__(self):
-        self.sessions = {}
+        self.turns = []
+        self.stage = "STAGE_1"
+        # Highest STAGE_n marker seen anywhere in the conversation so far
+        self.history_stage = "STAGE_1"
+        self.selections = Selections()
+        # Estimated tokens of the full transcript, kept up to date per turn
+        self.transcript_tokens = 0
+        # Oldest turns dropped by trim(); a turn's absolute index is dropped_turns + its position
+        self.dropped_turns = 0
+        self._rendered = ""
+        self._rendered_turns = 0
+
+    @classmethod
+    def restore(cls, stage, history_stage, selections, turns, dropped_turns=0):
+        """Rebuild a stored session from its fields and Turn records."""
+        state = cls()
+        state.stage = stage
+        state.history_stage = history_stage
+        state.selections = selections
+        state.turns = list(turns)
+        state.transcript_tokens = sum(turn.tokens for turn in state.turns)
+        state.dropped_turns = dropped_turns
+        return state
+
+    def add_turn(self, turn):
+        self.turns.append(turn)
+        self.transcript_tokens += turn.tokens
+
+    def trim(self, max_turns):
+        """Keep only the last `max_turns` turns (selections and stage are unaffected)."""
+        if not max_turns or len(self.turns) <= max_turns:
+            return
+        dropped = len(self.turns) - max_turns
+        self.turns = self.turns[dropped:]
+        self.dropped_turns += dropped
+        self.transcript_tokens = sum(turn.tokens for turn in self.turns)
+        self._rendered = ""
+        self._rendered_turns = 0
+
+    def render(self):
+        if self._rendered_turns != len(self.turns):
+            new_turns = "\n".join(turn.render() for turn in self.turns[self._rendered_turns:])
+            self._rendered = f"{self._rendered}\n{new_turns}" if self._rendered else new_turns
+            self._rendered = self._rendered.strip()
+            self._rendered_turns = len(self.turns)
+        return self._rendered
+
+    def render_window(self, recent_turns):
+        """
+        Render the last `recent_turns` turns verbatim, preceded by a summary of older
+        turns and the selections made so far. Cost depends on the window, not on the
+        length of the conversation.
+        """
+        if recent_turns is None or recent_turns >= len(self.turns):
+            return self.render()
+
+        older = self.turns[:len(self.turns) - recent_turns]
+        lines = [turn.summary for turn in older[-SUMMARY_MAX_LINES:]]
+        if len(older) > SUMMARY_MAX_LINES:
+            lines.insert(0, f"- ({len(older) - SUMMARY_MAX_LINES} earlier turns omitted)")
+
+        selections = self.selections
+        chosen = [
+            f"category={selections.category}" if selections.category else "",
+            f"service={selections.selected_service}" if selections.selected_service else "",
+            f"vendor={selections.vendor}" if selections.vendor else "",
+            f"vendors={', '.join(selections.vendors)}" if selections.vendors else "",
+            "priorities=" + ", ".join(f"{k}: {v}" for k, v in selections.priorities.items())
+            if selections.priorities else "",
+        ]
+        chosen = [item for item in chosen if item]
+
+        parts = ["EARLIER CONVERSATION (SUMMARY):", *lines]
+        if chosen:
+            parts.append(f"SELECTIONS SO FAR: {'; '.join(chosen)}")
+        if recent_turns > 0:
+            parts.append("RECENT TURNS:")
+            parts.extend(turn.render() for turn in self.turns[-recent_turns:])
+        return "\n".join(parts)
+
+
+class SessionManager:
+    """
+    Conversation state per session ID, kept in a session store.
+
+    The store (see session_store.py and SESSION_STORE) decides where sessions
+    live and for how long: an in-process LRU by default, or SQLite shared by
+    several worker processes.
+    """
+
+    def __init__(self, store=None):
+        if store is None:
+            from session_store import create_session_store
+            store = create_session_store()
+        self.store = store
+
+    def _state(self, session_id):
+        state = self.store.get(session_id)
+        if state is None:
+            state = self.store.create(session_id)
+        return state
     
     def get_context(self, session_id):
         """Get entire session history (chat log)."""
-        return self.sessions.get(session_id, {}).get("context", "")
+        state = self.store.get(session_id)
+        return state.render() if state else ""
     
     def get_stage(self, session_id):
         """Fetch the current stage of the user conversation."""
-        return self.sessions.get(session_id, {}).get("stage", "STAGE_1")
+        state = self.store.get(session_id)
+        return state.stage if state else "STAGE_1"
+
+    def get_selections(self, session_id):
+        """Category, service, vendor(s) and priorities selected so far."""
+        state = self.store.get(session_id)
+        return state.selections if state else Selections()
+
+    def get_conversation(self, session_id):
+        """The session's SessionState (turns, summary, selections), or None if new."""
+        return self.store.get(session_id)
+
+    def get_turns(self, session_id):
+        state = self.store.get(session_id)
+        return list(state.turns) if state else []
     
     def update(self, session_id, user_input, assistant_response):
         """Append new turn to session chat history."""
-        history = self.get_context(session_id)
-        updated = (
-            history
-            + f"\nUser: {user_input}\nAssistant: {assistant_response.strip()}"
-        )
-        new_stage = self.detect_stage(assistant_response, user_input, history)
-        prev_stage = self.get_stage(session_id)
+        state = self._state(session_id)
+        assistant_response = assistant_response.strip()
+        new_stage = self.detect_stage(assistant_response, user_input, state.history_stage)
+        prev_stage = state.stage
         # Only allow forward progression
-        stage_order = ["STAGE_1", "STAGE_2", "STAGE_3", "STAGE_4"]
-        if stage_order.index(new_stage) < stage_order.index(prev_stage):
+        if STAGE_ORDER.index(new_stage) < STAGE_ORDER.index(prev_stage):
             new_stage = prev_stage
-        self.sessions[session_id] = {
-            "context": updated.strip(),
-            "stage": new_stage,
-        }
-
-    def detect_stage(self, response, user_input, history):
-        """Intelligent stage detection based on conversation content."""
-        current_stage = self.get_stage_from_history(history)
+
+        turn = Turn(user_input, assistant_response, prev_stage)
+        state.add_turn(turn)
+        state.selections.observe_turn(user_input, assistant_response)
+        state.history_stage = self.get_stage_from_history(turn.render(), state.history_stage)
+        state.stage = new_stage
+        self.store.append(session_id, state, turn)
+
+    def stats(self):
+        return self.store.stats()
+
+    def close(self):
+        """Write out pending session updates."""
+        self.store.close()
+
+    def detect_stage(self, response, user_input, history_stage):
+        """Intelligent stage detection based on conversation content.
+
+        `history_stage` is the highest stage marker seen in earlier turns.
+        """
+        current_stage = history_stage
         
         # Stage progression logic
         if current_stage == "STAGE_1":
@@ -39,10 +230,7 @@ class SessionManager:
             confirmation_words = ["yes", "correct", "right", "okay", "confirm", "proceed", "that's right", "exactly"]
             
             # Check if the bot has presented categories in its previous response
-            bot_presented_categories = any(cat.lower() in response.lower() for cat in [
-                "asset verification", "alternate data suite", "employment verification", 
-                "onboarding", "kyc/aml", "banking", "utility bill", "credit risk"
-            ])
+            bot_presented_categories = presented(response, "category", CATEGORY_KEYWORDS)
             
             # Check if user is confirming a category choice
             user_confirming = any(word in user_input.lower() for word in confirmation_words)
@@ -60,9 +248,7 @@ class SessionManager:
             confirmation_words = ["yes", "correct", "right", "okay", "confirm", "proceed", "that's right", "exactly"]
             
             # Check if the bot has presented services in its previous response
-            bot_presented_services = any(service.lower() in response.lower() for service in [
-                "rc verification", "mobile to rc", "pan", "verification", "service"
-            ])
+            bot_presented_services = presented(response, "service", SERVICE_KEYWORDS)
             
             # Check if user is confirming a service choice or selecting by number
             user_confirming = any(word in user_input.lower() for word in confirmation_words)
@@ -81,10 +267,7 @@ class SessionManager:
             confirmation_words = ["yes", "correct", "right", "okay", "confirm", "proceed", "that's right", "exactly"]
             
             # Check if the bot has presented vendors in its previous response
-            bot_presented_vendors = any(vendor.lower() in response.lower() for vendor in [
-                "azureraven", "emeraldwhale", "scarletpanther", "goldenotter", "crimsonfalcon", 
-                "sapphireswan", "onyxwolf", "cobalteagle", "silvertiger"
-            ])
+            bot_presented_vendors = presented(response, "vendor", [vendor.lower() for vendor in current_kb().vendors])
             
             # Check if user is confirming a vendor choice or selecting by number
             user_confirming = any(word in user_input.lower() for word in confirmation_words)
@@ -104,19 +287,20 @@ class SessionManager:
         
         return current_stage
     
-    def get_stage_from_history(self, history):
-        """Extract current stage from conversation history."""
+    def get_stage_from_history(self, history, floor="STAGE_1"):
+        """Extract current stage from conversation history (never lower than `floor`)."""
         if not history:
-            return "STAGE_1"
+            return floor
         
         # Look for the most recent stage mention in the history
-        stages = ["STAGE_4", "STAGE_3", "STAGE_2", "STAGE_1"]
-        for stage in stages:
+        for stage in reversed(STAGE_ORDER):
+            if stage == floor:
+                break
             if stage in history:
                 return stage
         
-        return "STAGE_1"
+        return floor
     
     def reset(self, session_id):
         """Clear session state, useful for restarts/testing."""
-        self.sessions[session_id] = {"context": "", "stage": "STAGE_1"}
+        self.store.reset(session_id)
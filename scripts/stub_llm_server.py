@@ -0,0 +1,188 @@
+import os
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+
+from llm_client import recording_key
+
+
+STUB_LLM_HOST = os.getenv("STUB_LLM_HOST", "127.0.0.1")
+STUB_LLM_PORT = int(os.getenv("STUB_LLM_PORT", "8088"))
+# Delay before the first token, and streaming speed (0 = whole reply at once)
+STUB_LLM_LATENCY_MS = float(os.getenv("STUB_LLM_LATENCY_MS", "300"))
+STUB_LLM_TOKENS_PER_SECOND = float(os.getenv("STUB_LLM_TOKENS_PER_SECOND", "200"))
+# Random +/- fraction applied to the latency
+STUB_LLM_JITTER = float(os.getenv("STUB_LLM_JITTER", "0.2"))
+# Fraction of requests answered with 429/503, to exercise client retries
+STUB_LLM_ERROR_RATE = float(os.getenv("STUB_LLM_ERROR_RATE", "0"))
+# JSONL file written by llm_client (LLM_RECORD_PATH); matching requests replay the recorded reply
+STUB_LLM_RECORDINGS = os.getenv("STUB_LLM_RECORDINGS")
+
+# Replies for requests with no recording, by the stage named in the system message
+CANNED_REPLIES = {
+    "STAGE_1": "STAGE_1\n\nThanks for the details! Which category fits your use case best, "
+               "for example ONBOARDING KYC/AML or BANKING AND PAYMENTS?",
+    "STAGE_2": "STAGE_2\n\nThese are the services available in this category. "
+               "Which one would you like to use?",
+    "STAGE_3": "STAGE_3\n\nThe vendors above are ranked by your priorities. "
+               "Which vendor would you like to proceed with?",
+    "STAGE_4": "STAGE_4\n\nREASONING:\nThe ranked vendors have the best success rate and latency "
+               "among the vendors serving this service.",
+}
+DEFAULT_REPLY = "This is a canned reply from the stub LLM server."
+
+_STAGE_PATTERN = re.compile(r'CURRENT STAGE: (STAGE_\d)')
+
+
+def load_recordings(path):
+    """recording_key -> reply from a JSONL recordings file (later lines win)."""
+    recordings = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                recordings[entry["key"]] = entry["reply"]
+    return recordings
+
+
+def split_tokens(text):
+    """Roughly token-sized pieces (words with their following whitespace)."""
+    return re.findall(r'\S+\s*|\s+', text)
+
+
+class StubLLMServer:
+    """
+    ASGI app imitating an OpenAI-compatible /chat/completions endpoint (streaming
+    and non-streaming) with canned or recorded replies and configurable latency
+    and error rate, for offline load and throughput tests.
+    """
+
+    def __init__(self, latency_ms=STUB_LLM_LATENCY_MS, tokens_per_second=STUB_LLM_TOKENS_PER_SECOND,
+                 jitter=STUB_LLM_JITTER, error_rate=STUB_LLM_ERROR_RATE, recordings_path=STUB_LLM_RECORDINGS):
+        self.latency_ms = latency_ms
+        self.tokens_per_second = tokens_per_second
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.recordings = load_recordings(recordings_path) if recordings_path else {}
+        self.stats = {"requests": 0, "recorded": 0, "canned": 0, "errors": 0}
+
+    def reply_for(self, model, messages):
+        reply = self.recordings.get(recording_key(model, messages))
+        if reply is not None:
+            self.stats["recorded"] += 1
+            return reply
+        self.stats["canned"] += 1
+        system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+        match = _STAGE_PATTERN.search(system)
+        return CANNED_REPLIES.get(match.group(1), DEFAULT_REPLY) if match else DEFAULT_REPLY
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                event = await receive()
+                await send({"type": event["type"] + ".complete"})
+                if event["type"] == "lifespan.shutdown":
+                    return
+        if scope["type"] != "http":
+            return
+        if scope["path"] in ("/health", "/v1/health"):
+            await send_json(send, 200, {"status": "ok", **self.stats})
+            return
+        if not scope["path"].endswith("/chat/completions") or scope["method"] != "POST":
+            await send_json(send, 404, {"error": {"message": "not found"}})
+            return
+
+        try:
+            request = json.loads(await read_body(receive))
+            model, messages = request["model"], request["messages"]
+        except (ValueError, KeyError, TypeError):
+            await send_json(send, 400, {"error": {"message": "expected model and messages"}})
+            return
+        self.stats["requests"] += 1
+
+        if self.error_rate and random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            status = random.choice([429, 503])
+            await send_json(send, status, {"error": {"message": f"stub error {status}"}},
+                            headers=[(b"retry-after", b"1")] if status == 429 else [])
+            return
+
+        reply = self.reply_for(model, messages)
+        latency = self.latency_ms / 1000 * (1 + random.uniform(-self.jitter, self.jitter))
+        await asyncio.sleep(max(latency, 0.0))
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+        if not request.get("stream"):
+            tokens = split_tokens(reply)
+            if self.tokens_per_second:
+                await asyncio.sleep(len(tokens) / self.tokens_per_second)
+            await send_json(send, 200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                          "total_tokens": prompt_tokens + len(tokens)},
+            })
+            return
+
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")],
+        })
+
+        def chunk(delta, finish_reason=None):
+            payload = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                       "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            return f"data: {json.dumps(payload)}\n\n".encode("utf-8")
+
+        await send({"type": "http.response.body", "body": chunk({"role": "assistant"}), "more_body": True})
+        for token in split_tokens(reply):
+            if self.tokens_per_second:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            await send({"type": "http.response.body", "body": chunk({"content": token}), "more_body": True})
+        await send({"type": "http.response.body", "body": chunk({}, "stop") + b"data: [DONE]\n\n"})
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        event = await receive()
+        body += event.get("body", b"")
+        if not event.get("more_body"):
+            return body
+
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve canned or recorded LLM completions (OpenAI-compatible).")
+    parser.add_argument("--host", default=STUB_LLM_HOST)
+    parser.add_argument("--port", type=int, default=STUB_LLM_PORT)
+    parser.add_argument("--latency-ms", type=float, default=STUB_LLM_LATENCY_MS)
+    parser.add_argument("--tokens-per-second", type=float, default=STUB_LLM_TOKENS_PER_SECOND)
+    parser.add_argument("--error-rate", type=float, default=STUB_LLM_ERROR_RATE)
+    parser.add_argument("--recordings", default=STUB_LLM_RECORDINGS, help="JSONL file written via LLM_RECORD_PATH.")
+    args = parser.parse_args()
+
+    import uvicorn
+    app = StubLLMServer(latency_ms=args.latency_ms, tokens_per_second=args.tokens_per_second,
+                        error_rate=args.error_rate, recordings_path=args.recordings)
+    print(f"🤖 Stub LLM server at http://{args.host}:{args.port}/v1 "
+          f"({len(app.recordings)} recorded replies, {args.latency_ms:.0f} ms latency)")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
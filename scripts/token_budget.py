@@ -0,0 +1,154 @@
+import os
+import re
+
+from prompt_utils import build_dynamic_prompt, get_static_prefix, current_kb
+
+
+# Total prompt budget (estimated tokens) per stage; PROMPT_TOKEN_BUDGET overrides all stages
+PROMPT_TOKEN_BUDGETS = {
+    "STAGE_1": 4000,
+    "STAGE_2": 6000,
+    "STAGE_3": 6000,
+    "STAGE_4": 4000,
+}
+if os.getenv("PROMPT_TOKEN_BUDGET"):
+    PROMPT_TOKEN_BUDGETS = {stage: int(os.getenv("PROMPT_TOKEN_BUDGET")) for stage in PROMPT_TOKEN_BUDGETS}
+# Most recent turns kept verbatim; older turns are replaced by the running summary
+RECENT_TURNS_VERBATIM = int(os.getenv("RECENT_TURNS_VERBATIM", "4"))
+
+# Section headers build_dynamic_prompt adds around the conversation and knowledge blocks
+CONVERSATION_HEADER_TOKENS = 8
+KNOWLEDGE_HEADER_TOKENS = 30
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text):
+    """
+    Estimate the number of LLM tokens in text.
+
+    Counts words and punctuation marks, with a floor of one token per four characters
+    for long identifiers and JSON. Close enough to the Llama tokenizer for budgeting,
+    without downloading it.
+    """
+    if not text:
+        return 0
+    return max(len(_TOKEN_PATTERN.findall(text)), len(text) // 4)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text at a chunk (blank line) boundary so it fits in max_tokens."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    kept = []
+    used = 0
+    for chunk in text.split("\n\n"):
+        # Estimates are not additive; charge each chunk for its separator so the result fits
+        chunk_tokens = count_tokens(chunk) + 2
+        if used + chunk_tokens > max_tokens:
+            break
+        kept.append(chunk)
+        used += chunk_tokens
+    return "\n\n".join(kept)
+
+
+# (knowledge base version, stage) -> tokens
+_static_tokens = {}
+
+
+def static_tokens(stage):
+    """Tokens in a stage's static prompt prefix (computed once per knowledge base version)."""
+    key = (current_kb().version, stage)
+    if key not in _static_tokens:
+        _static_tokens[key] = count_tokens(get_static_prefix(stage))
+    return _static_tokens[key]
+
+
+def static_prefix_report():
+    """Static prefix tokens per stage, e.g. for printing at startup."""
+    return {stage: static_tokens(stage) for stage in current_kb().static_prefixes}
+
+
+def knowledge_sent_tokens(knowledge_chunks, stage):
+    """Tokens of the knowledge text build_dynamic_prompt actually sends (STAGE_4 keeps 200 characters)."""
+    return count_tokens(knowledge_chunks[:200] if stage == "STAGE_4" else knowledge_chunks)
+
+
+def build_budgeted_prompt(user_query, stage, conversation=None, knowledge_chunks="",
+                          selected_vendor=None, budget=None):
+    """
+    Build the dynamic (user message) part of a turn's prompt so that, together with
+    the stage's static prefix, it fits the stage's token budget.
+
+    `conversation` is the session's SessionState (or None for a new session). The
+    last RECENT_TURNS_VERBATIM turns are sent verbatim and older ones as a running
+    summary plus the structured selections; if the prompt is still over budget,
+    fewer verbatim turns are kept, then the knowledge chunks are truncated.
+
+    Returns (user_message, metrics) where metrics has the budget, estimated tokens
+    of static prefix plus user message with the full transcript ("tokens_before")
+    and as sent ("tokens_after"), per-section counts and the number of verbatim
+    turns kept.
+    """
+    budget = budget or PROMPT_TOKEN_BUDGETS.get(stage, max(PROMPT_TOKEN_BUDGETS.values()))
+    turn_count = len(conversation.turns) if conversation else 0
+
+    # Size the sections separately and assemble the prompt once at the end
+    fixed_tokens = static_tokens(stage) + count_tokens(
+        build_dynamic_prompt(user_query, stage, selected_vendor=selected_vendor)
+    )
+    knowledge_tokens_before = knowledge_sent_tokens(knowledge_chunks, stage)
+    knowledge_tokens = knowledge_tokens_before + KNOWLEDGE_HEADER_TOKENS if knowledge_chunks else 0
+
+    def window(recent_turns):
+        context = conversation.render_window(recent_turns) if conversation else ""
+        return context, count_tokens(context) + CONVERSATION_HEADER_TOKENS if context else 0
+
+    recent_turns = min(RECENT_TURNS_VERBATIM, turn_count)
+    context, context_tokens = window(recent_turns)
+    while fixed_tokens + context_tokens + knowledge_tokens > budget and recent_turns > 0:
+        recent_turns -= 1
+        context, context_tokens = window(recent_turns)
+
+    overflow = fixed_tokens + context_tokens + knowledge_tokens - budget
+    if overflow > 0 and knowledge_chunks and stage != "STAGE_4":
+        knowledge_chunks = truncate_to_tokens(knowledge_chunks, count_tokens(knowledge_chunks) - overflow)
+
+    def assemble(chunks):
+        return build_dynamic_prompt(
+            user_query=user_query,
+            stage=stage,
+            session_context=context,
+            knowledge_chunks=chunks,
+            selected_vendor=selected_vendor
+        )
+
+    prompt = assemble(knowledge_chunks)
+    tokens = static_tokens(stage) + count_tokens(prompt)
+    # Section estimates do not add up exactly; trim the knowledge again if still over
+    while tokens > budget and knowledge_chunks and stage != "STAGE_4":
+        knowledge_chunks = truncate_to_tokens(knowledge_chunks, count_tokens(knowledge_chunks) - max(tokens - budget, 1))
+        prompt = assemble(knowledge_chunks)
+        tokens = static_tokens(stage) + count_tokens(prompt)
+
+    # The untrimmed prompt differs only in the conversation and knowledge sections
+    transcript_tokens = conversation.transcript_tokens if conversation else 0
+    context_tokens = count_tokens(context)
+    knowledge_tokens = knowledge_sent_tokens(knowledge_chunks, stage)
+    metrics = {
+        "budget": budget,
+        "tokens_before": tokens - context_tokens - knowledge_tokens + transcript_tokens + knowledge_tokens_before,
+        "tokens_after": tokens,
+        "sections": {
+            "static": static_tokens(stage),
+            "dynamic": tokens - static_tokens(stage),
+            "conversation": context_tokens,
+            "knowledge": knowledge_tokens,
+            "user_query": count_tokens(user_query),
+        },
+        "verbatim_turns": recent_turns,
+        "summarised_turns": turn_count - recent_turns,
+    }
+    return prompt, metrics
@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+
+import numpy as np
+
+
+# Get the project root directory (parent of scripts)
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+DEFAULT_NUMPY_INDEX_DIR = os.path.join(project_root, 'vector_db', 'numpy_index')
+
+EMBEDDINGS_FILENAME = "embeddings.npy"
+RECORDS_FILENAME = "records.json"
+# Names the version directory inside the index dir that readers load
+CURRENT_FILENAME = "CURRENT"
+
+
+def resolve_index_dir(index_dir=DEFAULT_NUMPY_INDEX_DIR):
+    """Directory holding the live index files: the version CURRENT points to, or index_dir itself for older exports."""
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILENAME), 'r', encoding='utf-8') as f:
+            return os.path.join(index_dir, f.read().strip())
+    except FileNotFoundError:
+        return index_dir
+
+
+def numpy_index_exists(index_dir=DEFAULT_NUMPY_INDEX_DIR):
+    return os.path.exists(os.path.join(resolve_index_dir(index_dir), RECORDS_FILENAME))
+
+
+class ChromaBackend:
+    """Retrieval through the Chroma collection (HNSW + SQLite)."""
+
+    name = "chroma"
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def query(self, embeddings, top_k, category_filter=None):
+        """Return one {"ids", "documents", "metadatas"} dict per query embedding."""
+        embeddings = np.asarray(embeddings, dtype=np.float32).tolist()
+
+        # Build where clause for category filtering
+        where_clause = None
+        if category_filter:
+            where_clause = {"category": category_filter}
+
+        results = self.collection.query(
+            query_embeddings=embeddings,
+            n_results=top_k,
+            where=where_clause if where_clause else None
+        )
+
+        ids = results.get("ids") or [[] for _ in embeddings]  # List[List[str]]
+        documents = results.get("documents") or [[] for _ in embeddings]  # List[List[str]]
+        metadatas = results.get("metadatas") or [[] for _ in embeddings]  # List[List[dict]]
+
+        return [
+            {
+                "ids": ids[i],
+                "documents": documents[i],
+                "metadatas": metadatas[i]
+            }
+            for i in range(len(embeddings))
+        ]
+
+
+class NumpyBackend:
+    """
+    Exact in-process retrieval over a memory-mapped matrix of normalised embeddings.
+
+    Top-k is a single matmul plus argpartition; the category filter is a boolean
+    mask over the rows, built once per category. A float16 index is widened to
+    float32 once here, so queries never convert the matrix.
+    """
+
+    name = "numpy"
+
+    def __init__(self, index_dir=DEFAULT_NUMPY_INDEX_DIR):
+        # Resolve the version once so both files come from the same export
+        self.index_dir = resolve_index_dir(index_dir)
+        embeddings = np.load(os.path.join(self.index_dir, EMBEDDINGS_FILENAME), mmap_mode="r")
+        if embeddings.dtype != np.float32:
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+        self.embeddings = embeddings
+        with open(os.path.join(self.index_dir, RECORDS_FILENAME), 'r', encoding='utf-8') as f:
+            records = json.load(f)
+        if len(records["ids"]) != self.embeddings.shape[0]:
+            raise ValueError(f"NumPy index at {self.index_dir} has {self.embeddings.shape[0]} vectors "
+                             f"but {len(records['ids'])} records; export it again")
+        self.ids = records["ids"]
+        self.documents = records["documents"]
+        self.metadatas = records["metadatas"]
+        self.categories = np.array([meta.get("category", "") if meta else "" for meta in self.metadatas])
+        self.category_masks = {}
+
+    def category_mask(self, category):
+        mask = self.category_masks.get(category)
+        if mask is None:
+            mask = self.categories == category
+            self.category_masks[category] = mask
+        return mask
+
+    def query(self, embeddings, top_k, category_filter=None):
+        """Return one {"ids", "documents", "metadatas"} dict per query embedding."""
+        queries = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+        scores = queries @ self.embeddings.T
+        candidates = scores.shape[1]
+        if category_filter:
+            mask = self.category_mask(category_filter)
+            scores[:, ~mask] = -np.inf
+            candidates = int(mask.sum())
+
+        k = min(top_k, candidates)
+        results = []
+        for row in scores:
+            if k <= 0:
+                top = np.empty(0, dtype=np.int64)
+            else:
+                top = np.argpartition(-row, k - 1)[:k]
+                # Highest score first; ties broken by row order so results are deterministic
+                top = top[np.lexsort((top, -row[top]))]
+            results.append({
+                "ids": [self.ids[i] for i in top],
+                "documents": [self.documents[i] for i in top],
+                "metadatas": [self.metadatas[i] for i in top]
+            })
+        return results
+
+
+def export_numpy_index(collection, index_dir=DEFAULT_NUMPY_INDEX_DIR, dtype="float32"):
+    """
+    Dump the collection's vectors (normalised) and records for the NumPy backend.
+
+    Each export goes to a new version directory and CURRENT is switched to it in
+    one rename, so a concurrent load never pairs records and vectors from
+    different exports. The previous version is kept for loads still reading it.
+    """
+    data = collection.get(include=["embeddings", "documents", "metadatas"])
+    embeddings = np.asarray(data["embeddings"], dtype=np.float32)
+    if embeddings.size:
+        embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    embeddings = embeddings.astype(dtype)
+
+    version = f"v{time.time_ns()}"
+    version_dir = os.path.join(index_dir, version)
+    os.makedirs(version_dir)
+    with open(os.path.join(version_dir, EMBEDDINGS_FILENAME), 'wb') as f:
+        np.save(f, embeddings)
+    with open(os.path.join(version_dir, RECORDS_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump({
+            "ids": data["ids"],
+            "documents": data["documents"],
+            "metadatas": data["metadatas"],
+        }, f)
+
+    current_path = os.path.join(index_dir, CURRENT_FILENAME)
+    previous = os.path.basename(resolve_index_dir(index_dir))
+    with open(current_path + ".tmp", 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(current_path + ".tmp", current_path)
+
+    for name in os.listdir(index_dir):
+        if name.startswith("v") and name not in (version, previous):
+            shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+    return len(data["ids"])
+
+
+def benchmark(queries, repeats=20, top_k=5, dtype="float32"):
+    """Compare latency and results of the Chroma and NumPy backends on the live index."""
+    sys.path.append(script_dir)
+    from prompt_utils import ALLOWED_CATEGORIES
+    from query_db import get_model, get_collection
+
+    collection = get_collection()
+    export_numpy_index(collection, dtype=dtype)
+    backends = [ChromaBackend(collection), NumpyBackend()]
+    embeddings = get_model().encode(queries)
+
+    cases = [(None, "no filter")] + [(category, category) for category in ALLOWED_CATEGORIES]
+    results = {}
+    for backend in backends:
+        timings = []
+        for category, _ in cases:
+            for _ in range(repeats):
+                start = time.perf_counter()
+                backend.query(embeddings, top_k, category)
+                timings.append((time.perf_counter() - start) / len(queries))
+        results[backend.name] = {
+            "per_query_ms": 1000 * float(np.median(timings)),
+            # Compare chunk texts: chunks with identical content tie and may come back in either order
+            "documents": [[r["documents"] for r in backend.query(embeddings, top_k, category)] for category, _ in cases],
+        }
+
+    mismatches = 0
+    for case_index, (_, label) in enumerate(cases):
+        for query_index, query in enumerate(queries):
+            chroma_docs = results["chroma"]["documents"][case_index][query_index]
+            numpy_docs = results["numpy"]["documents"][case_index][query_index]
+            if chroma_docs != numpy_docs:
+                mismatches += 1
+                print(f"⚠️  Mismatch for '{query}' ({label}): "
+                      f"chroma={[doc[:40] for doc in chroma_docs]} numpy={[doc[:40] for doc in numpy_docs]}")
+
+    for name, result in results.items():
+        print(f"⏱️  {name}: {result['per_query_ms']:.3f} ms/query (median, top_k={top_k})")
+    total = len(cases) * len(queries)
+    print(f"✅ {total - mismatches}/{total} result lists identical between backends.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the NumPy vector index or benchmark it against Chroma.")
+    parser.add_argument("--export", action="store_true", help="Export the Chroma collection to the NumPy index.")
+    parser.add_argument("--dtype", default=os.getenv("NUMPY_INDEX_DTYPE", "float32"), choices=["float32", "float16"])
+    parser.add_argument("--bench", action="store_true", help="Benchmark both backends on sample queries.")
+    args = parser.parse_args()
+
+    if args.export:
+        sys.path.append(script_dir)
+        from query_db import get_collection
+        count = export_numpy_index(get_collection(), dtype=args.dtype)
+        print(f"✅ Exported {count} vectors to '{DEFAULT_NUMPY_INDEX_DIR}'.")
+    if args.bench:
+        benchmark(dtype=args.dtype, queries=[
+            "I want KYC",
+            "show me banking services",
+            "PAN Basic (verification) service details",
+            "CobaltEagle health metrics",
+            "verify a vehicle registration certificate",
+            "employment verification using mobile number",
+        ])
@@ -0,0 +1,157 @@
+import re
+import json
+
+import numpy as np
+
+
+# Priority key (see selections.PRIORITY_KEYWORDS) -> vendor health metric it is judged on
+PRIORITY_METRICS = {
+    "success_rate": "successRate",
+    "latency": "avgLatency",
+    "p95_latency": "p95",
+    "p99_latency": "p99",
+    "server_errors": "fiveXXRate",
+    "user_side_issues": "userSideIssues",
+}
+# Used when the user has not stated any priorities
+DEFAULT_PRIORITIES = {"success_rate": "high", "latency": "low"}
+# Metrics shown in the ranked table sent to the LLM: (column, header)
+TABLE_COLUMNS = [
+    ("successRate", "success %"),
+    ("userSideIssues", "user-side %"),
+    ("fiveXXRate", "5XX %"),
+    ("avgLatency", "avg s"),
+    ("p50", "p50 s"),
+    ("p95", "p95 s"),
+    ("p99", "p99 s"),
+    ("totalTransactions", "txns"),
+]
+
+_NUMBER_PATTERN = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+def parse_metric(value):
+    """Numeric value of a health metric: 87.79 for "87.79%", 10.29 for "10.29 Secs"."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _NUMBER_PATTERN.search(str(value or ""))
+    return float(match.group()) if match else float("nan")
+
+
+class VendorTable:
+    """
+    Vendor health metrics as a float matrix: one row per vendor (file order), one
+    column per metric. Percentages are in percent, latencies in seconds, missing
+    values are NaN. A derived "fiveXXRate" column holds 5XX responses as a
+    percentage of totalTransactions.
+    """
+
+    def __init__(self, names, metrics, values):
+        self.names = list(names)
+        self.metrics = list(metrics)
+        self.values = values
+        self.row_of = {name: i for i, name in enumerate(self.names)}
+        self.column_of = {metric: j for j, metric in enumerate(self.metrics)}
+
+    @classmethod
+    def from_rows(cls, rows):
+        metrics = []
+        for row in rows:
+            metrics.extend(key for key in row if key not in ("name", "serialNumber") and key not in metrics)
+        values = np.full((len(rows), len(metrics) + 1), np.nan, dtype=np.float64)
+        for i, row in enumerate(rows):
+            for j, metric in enumerate(metrics):
+                if metric in row:
+                    values[i, j] = parse_metric(row[metric])
+        table = cls([row.get("name", "") for row in rows], metrics + ["fiveXXRate"], values)
+        total = table.column("totalTransactions")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values[:, -1] = np.where(total > 0, 100 * table.column("fiveXX") / total, np.nan)
+        return table
+
+    def column(self, metric):
+        j = self.column_of.get(metric)
+        return self.values[:, j] if j is not None else np.full(len(self.names), np.nan)
+
+    def get(self, vendor, metric):
+        i, j = self.row_of.get(vendor), self.column_of.get(metric)
+        return float(self.values[i, j]) if i is not None and j is not None else float("nan")
+
+
+def load_vendor_table(path=None):
+    """The vendor health table from the knowledge base snapshot, or from a vendor_health.json at `path`."""
+    if path is None:
+        from kb_snapshot import get_snapshot
+        return VendorTable.from_rows(list(get_snapshot().vendor_metrics.values()))
+    with open(path, 'r', encoding='utf-8') as f:
+        return VendorTable.from_rows(json.load(f)["data"]["rowData"])
+
+
+def get_vendor_table():
+    """Parsed vendor health table of the current knowledge base state, loaded on first use."""
+    # Imported here: prompt_utils imports this module
+    from prompt_utils import current_kb
+    return current_kb().vendor_table
+
+
+def score_vendors(priorities=None, weights=None, candidates=None, table=None):
+    """
+    Score vendors against the user's priorities.
+
+    `priorities` maps priority keys to "high"/"low" (DEFAULT_PRIORITIES when empty)
+    and `weights` optionally maps the same keys to relative weights (default 1).
+    Each metric is min-max normalised over the candidates, flipped for "low", and
+    the weighted mean is the score in [0, 1]; a missing metric contributes 0.
+    Returns (vendor names, scores) in table order.
+    """
+    table = table or get_vendor_table()
+    priorities = {key: direction for key, direction in (priorities or {}).items() if key in PRIORITY_METRICS}
+    priorities = priorities or DEFAULT_PRIORITIES
+    rows = np.arange(len(table.names))
+    if candidates is not None:
+        candidates = set(candidates)
+        rows = np.array([i for i, name in enumerate(table.names) if name in candidates], dtype=np.int64)
+    names = [table.names[i] for i in rows]
+    if not len(rows):
+        return names, np.zeros(0)
+
+    keys = list(priorities)
+    columns = np.stack([table.column(PRIORITY_METRICS[key])[rows] for key in keys], axis=1)
+    missing = np.isnan(columns)
+    low = np.where(missing, np.inf, columns).min(axis=0)
+    high = np.where(missing, -np.inf, columns).max(axis=0)
+    span = high - low
+    with np.errstate(divide="ignore", invalid="ignore"):
+        normalised = np.where(span > 0, (columns - low) / span, 1.0)
+    lower_is_better = np.array([priorities[key] == "low" for key in keys])
+    normalised = np.where(lower_is_better, 1.0 - normalised, normalised)
+    normalised[missing] = 0.0
+
+    weight = np.array([float((weights or {}).get(key, 1.0)) for key in keys])
+    scores = normalised @ weight / weight.sum()
+    return names, scores
+
+
+def rank_vendors(priorities=None, candidates=None, weights=None):
+    """[(vendor, score)] best first; ties keep knowledge-base order."""
+    names, scores = score_vendors(priorities, weights, candidates)
+    order = np.argsort(-scores, kind="stable")
+    return [(names[i], float(scores[i])) for i in order]
+
+
+def format_ranking_table(ranking, priorities=None):
+    """Compact ranked table of vendors and their health metrics for the prompt."""
+    table = get_vendor_table()
+    priorities = {key: d for key, d in (priorities or {}).items() if key in PRIORITY_METRICS} or DEFAULT_PRIORITIES
+    stated = ", ".join(f"{direction} {key.replace('_', ' ')}" for key, direction in priorities.items())
+    lines = [
+        f"VENDOR RANKING BY {stated.upper()} (score 0-1, higher is better):",
+        " | ".join(["rank", "vendor", "score"] + [header for _, header in TABLE_COLUMNS]),
+    ]
+    for rank, (vendor, score) in enumerate(ranking, start=1):
+        cells = []
+        for metric, _ in TABLE_COLUMNS:
+            value = table.get(vendor, metric)
+            cells.append("-" if value != value else f"{value:.0f}" if metric == "totalTransactions" else f"{value:.2f}")
+        lines.append(" | ".join([str(rank), vendor, f"{score:.2f}"] + cells))
+    return "\n".join(lines)
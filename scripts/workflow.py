@@ -0,0 +1,142 @@
+import os
+import json
+
+from jsonschema import Draft7Validator
+
+from prompt_utils import current_kb, service_code, vendors_for_service
+from vendor_ranking import rank_vendors, get_vendor_table, PRIORITY_METRICS, DEFAULT_PRIORITIES
+
+
+WORKFLOW_URL = "https://testapi.tenacio.io/api/v1/worklow/"
+# Ask the LLM for the plain-English REASONING instead of using the templated explanation
+WORKFLOW_LLM_REASONING = os.getenv("WORKFLOW_LLM_REASONING", "false").lower() in ("1", "true", "yes")
+RANKED_VENDOR_COUNT = 2
+
+def workflow_schema(kb=None):
+    """JSON schema of the STAGE_4 payload shown in STAGE_INSTRUCTIONS["STAGE_4"], for one knowledge base state."""
+    kb = kb or current_kb()
+    return {
+        "type": "object",
+        "properties": {
+            "selected_service": {"type": "string", "enum": sorted({service_code(name) for name in kb.services})},
+            "selected_vendor": {"type": "string", "enum": list(kb.vendors)},
+            "user_priorities": {
+                "type": "object",
+                "propertyNames": {"enum": list(PRIORITY_METRICS)},
+                "additionalProperties": {"enum": ["high", "low"]},
+            },
+            "ranked_vendors": {
+                "type": "array",
+                "items": {"type": "string", "enum": list(kb.vendors)},
+                "minItems": 1,
+                "maxItems": RANKED_VENDOR_COUNT,
+                "uniqueItems": True,
+            },
+            "backup_vendor": {"type": "string", "enum": list(kb.vendors)},
+            "workflow_generation": {"const": WORKFLOW_URL},
+        },
+        "required": ["selected_service", "selected_vendor", "user_priorities",
+                     "ranked_vendors", "backup_vendor", "workflow_generation"],
+        "additionalProperties": False,
+    }
+
+
+# (knowledge base version, validator) for the last version seen
+_validator = (None, None)
+
+
+def get_validator():
+    """Validator for the current knowledge base state's schema, rebuilt when the state changes."""
+    global _validator
+    kb = current_kb()
+    version, validator = _validator
+    if version != kb.version:
+        validator = Draft7Validator(workflow_schema(kb))
+        _validator = (kb.version, validator)
+    return validator
+
+
+class WorkflowError(ValueError):
+    """The session does not have what the workflow payload needs, or the payload is invalid."""
+
+
+def build_workflow(selections):
+    """
+    Build and validate the STAGE_4 workflow payload from a session's Selections.
+
+    Returns (payload, ranking) where ranking is [(vendor, score)] for the other
+    vendors, best first. Raises WorkflowError when no service or vendor has been
+    chosen yet or the payload fails workflow_schema().
+    """
+    service = selections.selected_service
+    vendor = selections.vendor
+    if not service or not vendor:
+        raise WorkflowError(f"missing {'service' if not service else 'vendor'} selection")
+
+    # Rank among the vendors presented in STAGE_3 when there are enough of them,
+    # otherwise among all vendors serving the service
+    service_vendors = vendors_for_service(service) or current_kb().vendors
+    others = [name for name in selections.vendors if name != vendor and name in service_vendors]
+    if len(others) < RANKED_VENDOR_COUNT:
+        others = [name for name in service_vendors if name != vendor]
+    ranking = rank_vendors(selections.priorities, candidates=others)
+    ranked = [name for name, _ in ranking[:RANKED_VENDOR_COUNT]]
+
+    payload = {
+        "selected_service": service_code(service),
+        "selected_vendor": vendor,
+        "user_priorities": dict(selections.priorities),
+        "ranked_vendors": ranked,
+        "backup_vendor": ranked[0] if ranked else None,
+        "workflow_generation": WORKFLOW_URL,
+    }
+    errors = sorted(get_validator().iter_errors(payload), key=lambda error: list(error.path))
+    if errors:
+        raise WorkflowError("; ".join(f"{'/'.join(map(str, e.path)) or 'payload'}: {e.message}" for e in errors))
+    return payload, ranking
+
+
+def describe_metrics(vendor, priorities):
+    """e.g. "successRate 94.12, avgLatency 1.20" for the metrics behind the priorities."""
+    table = get_vendor_table()
+    metrics = [PRIORITY_METRICS[key] for key in priorities or DEFAULT_PRIORITIES]
+    return ", ".join(f"{metric} {table.get(vendor, metric):.2f}" for metric in metrics)
+
+
+def template_reasoning(payload):
+    """Fact-based explanation of the payload built from the vendor health metrics."""
+    priorities = payload["user_priorities"] or DEFAULT_PRIORITIES
+    stated = ", ".join(f"{direction} {key.replace('_', ' ')}" for key, direction in priorities.items())
+    lines = [
+        f"{payload['selected_vendor']} is kept as the primary vendor because you selected it "
+        f"({describe_metrics(payload['selected_vendor'], priorities)}).",
+        f"The other vendors were ranked by {stated}"
+        f"{'' if payload['user_priorities'] else ' (no priorities were stated, so these defaults were used)'}:",
+    ]
+    for rank, vendor in enumerate(payload["ranked_vendors"], start=1):
+        lines.append(f"  {rank}. {vendor} ({describe_metrics(vendor, priorities)})")
+    lines.append(f"{payload['backup_vendor']} is the backup vendor as the best of the ranked alternatives.")
+    return "\n".join(lines)
+
+
+def reasoning_prompt(payload):
+    """Prompt asking the LLM only for the REASONING paragraph of a finished payload."""
+    priorities = payload["user_priorities"] or DEFAULT_PRIORITIES
+    vendors = [payload["selected_vendor"]] + payload["ranked_vendors"]
+    metrics = "\n".join(f"- {vendor}: {describe_metrics(vendor, priorities)}" for vendor in vendors)
+    return (
+        "THE WORKFLOW JSON BELOW IS FINAL. DO NOT REPEAT OR CHANGE IT.\n\n"
+        f"{json.dumps(payload, indent=2)}\n\n"
+        f"VENDOR HEALTH METRICS:\n{metrics}\n\n"
+        "IN 2-4 SENTENCES OF PLAIN ENGLISH, EXPLAIN WHY THE RANKED AND BACKUP VENDORS WERE CHOSEN "
+        "USING ONLY THE METRICS ABOVE. OUTPUT ONLY THE EXPLANATION."
+    )
+
+
+def format_workflow_reply(payload, reasoning):
+    """Assistant reply in the STAGE_4 output format (header, JSON_OUTPUT, REASONING)."""
+    return (
+        "STAGE_4\n\n"
+        f"JSON_OUTPUT:\n```json\n{json.dumps(payload, indent=2)}\n```\n\n"
+        f"REASONING:\n{reasoning}"
+    )
@@ -0,0 +1,53 @@
+import pytest
+
+from query_db import ChunkIndex, build_chunk_index
+
+
+@pytest.fixture
+def index():
+    metadatas = [
+        {"service_name": "PAN ADVANCED", "category": "ONBOARDING KYC/AML", "type": "overview"},
+        {"service_name": "PAN ADVANCED", "category": "ONBOARDING KYC/AML", "type": "request_schema"},
+        {"vendor_name": "CobaltEagle", "type": "vendor_health"},
+        {"service_name": "Mobile to RC Number", "category": "ASSET VERIFICATION", "type": "overview"},
+        None,
+    ]
+    return ChunkIndex([f"id-{i}" for i in range(5)], [f"doc {i}" for i in range(5)], metadatas)
+
+
+def test_lookup_by_one_key_keeps_index_order(index):
+    assert index.get(category="ONBOARDING KYC/AML")["ids"] == ["id-0", "id-1"]
+    assert index.get(vendor_name="CobaltEagle")["documents"] == ["doc 2"]
+
+
+def test_keys_are_intersected(index):
+    result = index.get(service_name="PAN ADVANCED", type="request_schema")
+    assert result["ids"] == ["id-1"]
+    assert result["metadatas"][0]["type"] == "request_schema"
+    assert index.get(service_name="PAN ADVANCED", type="vendor_health")["ids"] == []
+
+
+def test_service_names_match_by_code(index):
+    assert index.get(service_name="PAN_ADVANCED")["ids"] == ["id-0", "id-1"]
+    assert index.get(service_name="mobile to rc number")["ids"] == ["id-3"]
+
+
+def test_no_keys_returns_everything_and_none_is_ignored(index):
+    assert index.get()["ids"] == [f"id-{i}" for i in range(5)]
+    assert index.get(category=None, type="overview")["ids"] == ["id-0", "id-3"]
+
+
+def test_unknown_field_is_rejected(index):
+    with pytest.raises(ValueError, match="Unknown chunk index field"):
+        index.get(colour="blue")
+
+
+def test_numpy_backend_records_are_reused():
+    class Backend:
+        ids = ["a"]
+        documents = ["doc"]
+        metadatas = [{"type": "overview"}]
+
+    index = build_chunk_index(Backend)
+    assert index.get(type="overview")["ids"] == ["a"]
+    assert index.metadatas is Backend.metadatas
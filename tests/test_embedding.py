@@ -0,0 +1,95 @@
+import os
+import sys
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+import embedding
+from embedding import EMBEDDING_MODEL_NAME, iter_changed_chunks, load_manifest, manifest_encoder
+
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts')
+
+
+def test_importing_the_indexer_loads_no_encoder_or_chroma():
+    # The KB watcher imports embedding.py inside serving processes that may never load torch
+    code = ("import sys, kb_watcher, embedding; "
+            "assert not {'torch', 'sentence_transformers', 'chromadb'} & set(sys.modules), sys.modules.keys()")
+    subprocess.run([sys.executable, "-c", code], cwd=SCRIPTS_DIR, check=True)
+
+
+def test_manifest_records_its_encoder(tmp_path):
+    assert manifest_encoder(load_manifest(str(tmp_path))) is None
+    assert manifest_encoder({"model": EMBEDDING_MODEL_NAME, "files": {}}) == "torch"
+    assert manifest_encoder({"model": EMBEDDING_MODEL_NAME, "encoder": "onnx", "files": {}}) == "onnx"
+
+
+def fake_chunker(relative_path, document):
+    """One chunk per key of a document like {"name": "text"}; a document that is not a dict is unchunkable."""
+    return [(f"{relative_path}:{name}", text, {"file_path": relative_path}) for name, text in document.items()]
+
+
+def snapshot(documents):
+    return SimpleNamespace(
+        sources={path: {"hash": str(sorted(document.items()) if isinstance(document, dict) else document)}
+                 for path, document in documents.items()},
+        documents=documents,
+    )
+
+
+def index(documents, old_files=None, full=False):
+    """(yielded chunk IDs, new manifest files, stale IDs) for one indexing pass."""
+    new_files, stale_ids = {}, []
+    changed = [chunk_id for chunk_id, _, _ in
+               iter_changed_chunks(snapshot(documents), old_files or {}, new_files, stale_ids, full)]
+    return changed, new_files, stale_ids
+
+
+@pytest.fixture(autouse=True)
+def chunker(monkeypatch):
+    monkeypatch.setattr(embedding, "chunk_document", fake_chunker)
+
+
+def test_unchanged_files_are_skipped_without_chunking(monkeypatch):
+    documents = {"a.json": {"x": "one"}, "b.json": {"y": "two"}}
+    _, files, _ = index(documents)
+
+    chunked = []
+    monkeypatch.setattr(embedding, "chunk_document", lambda path, doc: chunked.append(path) or fake_chunker(path, doc))
+    changed, new_files, stale = index(documents, files)
+    assert (changed, stale, chunked) == ([], [], [])
+    assert new_files == files
+
+
+def test_only_changed_chunks_of_a_changed_file_are_yielded():
+    _, files, _ = index({"a.json": {"x": "one", "y": "two"}})
+    changed, new_files, stale = index({"a.json": {"x": "one", "y": "changed"}}, files)
+
+    assert changed == ["a.json:y"]
+    assert stale == []
+    assert new_files["a.json"]["chunks"]["a.json:x"] == files["a.json"]["chunks"]["a.json:x"]
+
+
+def test_full_reindex_yields_every_chunk():
+    documents = {"a.json": {"x": "one", "y": "two"}}
+    _, files, _ = index(documents)
+    changed, _, _ = index(documents, files, full=True)
+    assert changed == ["a.json:x", "a.json:y"]
+
+
+def test_removed_chunks_and_files_become_stale():
+    _, files, _ = index({"a.json": {"x": "one", "y": "two"}, "b.json": {"z": "three"}})
+    changed, new_files, stale = index({"a.json": {"x": "one"}}, files)
+
+    assert changed == []
+    assert sorted(stale) == ["a.json:y", "b.json:z"]
+    assert set(new_files) == {"a.json"}
+
+
+def test_a_file_the_chunker_rejects_keeps_its_old_entry():
+    _, files, _ = index({"a.json": {"x": "one"}})
+    changed, new_files, stale = index({"a.json": "not a dict"}, files)
+
+    assert (changed, stale) == ([], [])
+    assert new_files["a.json"] == files["a.json"]
@@ -0,0 +1,85 @@
+import time
+
+import numpy as np
+
+from embedding_cache import PROBE_LENGTH, EmbeddingCache, encode_with_cache
+
+
+class CountingModel:
+    def __init__(self, dim=4):
+        self.dim = dim
+        self.encoded = []
+
+    def encode(self, texts, **kwargs):
+        self.encoded.extend(texts)
+        return np.array([[len(text), i, 1.0, 0.0][:self.dim] for i, text in enumerate(texts)], dtype=np.float32)
+
+
+def test_round_trip_and_reopen(tmp_path):
+    cache = EmbeddingCache("model", cache_dir=tmp_path, max_entries=8)
+    vectors = np.arange(8, dtype=np.float32).reshape(2, 4)
+    cache.put_many(["a", "b"], vectors)
+    cache.flush()
+
+    reopened = EmbeddingCache("model", cache_dir=tmp_path, max_entries=8)
+    got = reopened.get_many(["a", "b", "c"])
+    np.testing.assert_array_equal(got[0], vectors[0])
+    np.testing.assert_array_equal(got[1], vectors[1])
+    assert got[2] is None
+    assert reopened.stats()["entries"] == 2
+
+
+def test_processes_sharing_a_directory_do_not_overwrite_each_others_slots(tmp_path):
+    # Two prefork workers: each opens the cache before the other has written anything
+    first = EmbeddingCache("model", cache_dir=tmp_path, max_entries=8)
+    second = EmbeddingCache("model", cache_dir=tmp_path, max_entries=8)
+    first.put_many(["a"], np.full((1, 4), 1, dtype=np.float32))
+    second.put_many(["b"], np.full((1, 4), 2, dtype=np.float32))
+
+    for cache in (first, second):
+        a, b = cache.get_many(["a", "b"])
+        np.testing.assert_array_equal(a, np.full(4, 1, dtype=np.float32))
+        np.testing.assert_array_equal(b, np.full(4, 2, dtype=np.float32))
+    assert first.stats()["entries"] == 2
+
+
+def test_full_cache_evicts_least_recently_used(tmp_path):
+    # No larger than the probe window, so every text may use every slot
+    cache = EmbeddingCache("model", cache_dir=tmp_path, max_entries=PROBE_LENGTH)
+    texts = [f"text {i}" for i in range(PROBE_LENGTH)]
+    cache.put_many(texts, np.ones((PROBE_LENGTH, 4), dtype=np.float32))
+    # Touch everything but "text 0" so it is the oldest
+    time.sleep(0.01)
+    cache.get_many(texts[1:])
+    cache.put_many(["new"], np.zeros((1, 4), dtype=np.float32))
+
+    assert cache.get_many(["text 0"]) == [None]
+    assert cache.get_many(["new"])[0] is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_encode_with_cache_only_encodes_misses(tmp_path):
+    cache = EmbeddingCache("model", cache_dir=tmp_path, max_entries=8)
+    model = CountingModel()
+    first = encode_with_cache(model, ["x", "yy"], cache)
+    second = encode_with_cache(model, ["yy", "zzz"], cache)
+
+    assert model.encoded == ["x", "yy", "zzz"]
+    np.testing.assert_array_equal(second[0], first[1])
+
+
+def test_texts_are_found_in_their_probe_window(tmp_path):
+    cache = EmbeddingCache("model", cache_dir=tmp_path, max_entries=64)
+    texts = [f"text {i}" for i in range(48)]
+    vectors = np.arange(48 * 4, dtype=np.float32).reshape(48, 4)
+    cache.put_many(texts, vectors)
+
+    digests = [cache.key(text) for text in texts]
+    slots = cache._find(digests)
+    found = slots >= 0
+    assert all(slot in window for slot, window in zip(slots[found], cache._probe_slots(digests)[found]))
+    # A crowded window evicts within itself; nothing else is lost and no slot is shared
+    assert len(set(slots[found].tolist())) == found.sum() == 48 - cache.stats()["evictions"]
+    for vector, cached in zip(vectors, cache.get_many(texts)):
+        if cached is not None:
+            np.testing.assert_array_equal(cached, vector)
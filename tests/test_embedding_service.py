@@ -0,0 +1,120 @@
+import os
+import time
+import asyncio
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pytest
+
+from embedding_service import EmbeddingService, EmbeddingServiceClient, EmbeddingServiceError
+
+
+class FakeModel:
+    """Encodes a text as [len(text), 1]; fails any batch containing "boom"."""
+
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, texts, batch_size=None):
+        self.batches.append(list(texts))
+        if "boom" in texts:
+            raise RuntimeError("model exploded")
+        return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def socket_path():
+    # Unix socket paths are limited to ~100 bytes, so not under pytest's tmp_path
+    directory = tempfile.mkdtemp(prefix="embed-")
+    yield os.path.join(directory, "service.sock")
+
+
+@contextmanager
+def running(service, socket_path):
+    """Serve on a private event loop thread until the block ends."""
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(service.serve(socket_path))
+
+    def serve():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while not os.path.exists(socket_path) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    def stop():
+        # The connection handlers too, or serve() waits for clients to hang up
+        for pending in asyncio.all_tasks(loop):
+            pending.cancel()
+
+    try:
+        yield service
+    finally:
+        loop.call_soon_threadsafe(stop)
+        thread.join(5)
+        # Let the cancelled handlers close their transports
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
+
+
+def test_full_batches_go_out_without_waiting(socket_path):
+    model = FakeModel()
+    with running(EmbeddingService(model, max_batch_size=4, max_wait_ms=10_000), socket_path):
+        start = time.perf_counter()
+        vectors = EmbeddingServiceClient(socket_path).encode([f"text {i}" for i in range(8)])
+        elapsed = time.perf_counter() - start
+
+    assert [len(batch) for batch in model.batches] == [4, 4]
+    assert elapsed < 5
+    np.testing.assert_array_equal(vectors[:, 0], [6] * 8)
+
+
+def test_a_partial_batch_goes_out_at_its_deadline(socket_path):
+    model = FakeModel()
+    with running(EmbeddingService(model, max_batch_size=100, max_wait_ms=100), socket_path):
+        start = time.perf_counter()
+        vector = EmbeddingServiceClient(socket_path).encode("abc")
+        elapsed = time.perf_counter() - start
+
+    assert model.batches == [["abc"]]
+    assert 0.1 <= elapsed < 5
+    np.testing.assert_array_equal(vector, [3, 1])
+
+
+def test_a_failed_encode_only_fails_its_own_batch(socket_path):
+    model = FakeModel()
+    results = {}
+
+    def request(text):
+        try:
+            results[text] = EmbeddingServiceClient(socket_path).encode([text])
+        except EmbeddingServiceError as e:
+            results[text] = e
+
+    with running(EmbeddingService(model, max_batch_size=1, max_wait_ms=50), socket_path):
+        threads = [threading.Thread(target=request, args=(text,)) for text in ("boom", "fine")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert isinstance(results["boom"], EmbeddingServiceError)
+    assert "model exploded" in str(results["boom"])
+    np.testing.assert_array_equal(results["fine"], [[4, 1]])
+
+
+def test_client_reconnects_after_a_service_restart(socket_path):
+    client = EmbeddingServiceClient(socket_path)
+    with running(EmbeddingService(FakeModel(), max_wait_ms=1), socket_path):
+        client.encode(["before"])
+    with running(EmbeddingService(FakeModel(), max_wait_ms=1), socket_path):
+        vectors = client.encode(["after"])
+
+    np.testing.assert_array_equal(vectors, [[5, 1]])
+    assert client.counters["reconnects"] == 1
@@ -0,0 +1,101 @@
+import pytest
+
+from prompt_utils import ALLOWED_HEALTH_METRICS, current_kb
+from entity_matcher import MATCHER, EntityMatcher, find_unknown_vendors, matcher_scan, trie_pattern, vendor_like_names
+
+
+@pytest.fixture
+def matcher():
+    return EntityMatcher(
+        vendors=["AzureRaven", "GoldenOtter"],
+        services=["Phone to Address Advanced", "Phone to Address Advanced (BFSI)", "PAN ADVANCED"],
+        categories=["ONBOARDING KYC/AML", "BANKING AND PAYMENTS"],
+        metrics=["successRate", "p95"],
+    )
+
+
+def test_trie_pattern_matches_every_word():
+    import re
+    pattern = re.compile(f"^(?:{trie_pattern(['pan', 'pan advanced', 'phone'])})$")
+    assert all(pattern.match(word) for word in ["pan", "pan advanced", "phone"])
+    assert not pattern.match("pa")
+
+
+def test_longest_name_wins(matcher):
+    mentions = matcher.find("Try Phone to Address Advanced (BFSI) today")
+    assert [(m.type, m.name) for m in mentions] == [("service", "Phone to Address Advanced (BFSI)")]
+
+
+def test_matching_is_case_insensitive_and_whole_word(matcher):
+    assert matcher.mentioned("pan advanced or AZURERAVEN", "service") == ["PAN ADVANCED"]
+    assert matcher.mentioned("pan advanced or AZURERAVEN", "vendor") == ["AzureRaven"]
+    assert matcher.mentioned("AzureRavens", "vendor") == []
+
+
+def test_selection_intents(matcher):
+    text = "Let's go with GoldenOtter; AzureRaven has a better p95. I'm interested in the banking and payments category."
+    assert matcher.selected(text, "vendor") == ["GoldenOtter"]
+    assert matcher.mentioned(text, "vendor") == ["GoldenOtter", "AzureRaven"]
+    assert matcher.mentioned(text, "metric") == ["p95"]
+    assert matcher.selected(text, "category") == ["BANKING AND PAYMENTS"]
+    assert matcher.selected("I want ONBOARDING KYC/AML", "category") == ["ONBOARDING KYC/AML"]
+    assert matcher.selected("ONBOARDING KYC/AML is popular", "category") == []
+
+
+def test_current_matcher_uses_the_knowledge_base():
+    found = matcher_scan("Please select CobaltEagle for PAN ADVANCED")
+    assert found["selected_vendor"] == ["CobaltEagle"]
+    assert found["service"] == ["PAN ADVANCED"]
+    assert MATCHER.mentioned("cobalteagle", "vendor") == ["CobaltEagle"]
+
+
+def test_vendor_like_names_walks_json():
+    assert vendor_like_names({"BlueHeron": ["a WhatsApp user", {"x": "GoDigit"}], "n": 1}) == {
+        "BlueHeron", "WhatsApp", "GoDigit"}
+
+
+ACCEPTED_REPLIES = [
+    # Knowledge base terms: a feature of Social Media Presence and vendors that only appear in service files
+    "STAGE_2\nSocial Media Presence checks whether the user is active on WhatsApp.",
+    "STAGE_3\nSocial Media Presence is served by JadeToucan and IndigoBison. Go with RubyParrot?",
+    "STAGE_3\nProfilePlus: successRate 91%. DataEnrichPro vendor is also available.",
+    # Product names in free text are not vendor claims
+    "The user's LinkedIn profile and DigiLocker documents are checked; our SDK is JavaScript.",
+    "STAGE_3\nRecommended vendors: AzureRaven, CobaltEagle and GoldenOtter.",
+]
+
+
+@pytest.mark.parametrize("text", ACCEPTED_REPLIES)
+def test_known_or_free_text_names_are_not_flagged(text):
+    assert find_unknown_vendors(text) == []
+
+
+@pytest.mark.parametrize("text", ACCEPTED_REPLIES)
+def test_guardrail_accepts_replies_with_knowledge_base_terms(text):
+    main = pytest.importorskip("main")
+    kb = current_kb()
+    assert main.validate_response(text, kb.vendors, kb.services, kb.categories, ALLOWED_HEALTH_METRICS) == (True, text)
+
+
+@pytest.mark.parametrize("text, unknown", [
+    ("I recommend BlueHeron for this.", ["BlueHeron"]),
+    ("Vendors: AzureRaven, BlueHeron and RedFox.", ["BlueHeron", "RedFox"]),
+    ("BlueHeron: successRate 99%, avgLatency 0.4 Secs", ["BlueHeron"]),
+    ("The BlueHeron vendor is fastest.", ["BlueHeron"]),
+])
+def test_made_up_vendors_are_flagged(text, unknown):
+    assert find_unknown_vendors(text) == unknown
+
+
+def test_guardrail_accepts_json_vendors_from_service_files():
+    main = pytest.importorskip("main")
+    kb = current_kb()
+    assert {"JadeToucan", "IndigoBison", "RubyParrot", "ProfilePlus", "DataEnrichPro"} <= set(kb.all_vendors)
+    reply = ('STAGE_3\nJSON_OUTPUT: {"vendors": ["JadeToucan", "IndigoBison", "RubyParrot", '
+             '"ProfilePlus", "DataEnrichPro"]}\n')
+    assert main.validate_response(reply, kb.all_vendors, kb.services, kb.categories, ALLOWED_HEALTH_METRICS)[0]
+
+    valid, problems = main.validate_response('JSON_OUTPUT: {"selected_vendor": "BlueHeron"}\n', kb.all_vendors,
+                                             kb.services, kb.categories, ALLOWED_HEALTH_METRICS)
+    assert not valid
+    assert "BlueHeron" in problems
@@ -0,0 +1,113 @@
+import time
+
+import pytest
+
+from llm_cache import LLMResponseCache, cache_key
+
+
+def test_keys_differ_by_fingerprint():
+    params = {"temperature": 0}
+    assert cache_key("m", "sys", "hi", params, "kb-1") != cache_key("m", "sys", "hi", params, "kb-2")
+    assert cache_key("m", "sys", "hi", params, "kb-1") == cache_key("m", "sys", "hi", dict(params), "kb-1")
+
+
+def test_instances_on_other_versions_share_the_file_without_clearing_it(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    old_key = cache_key("m", "sys", "hi", {}, "kb-1")
+    new_key = cache_key("m", "sys", "hi", {}, "kb-2")
+    old = LLMResponseCache(path)
+    old.put(old_key, "old reply")
+    new = LLMResponseCache(path)
+    new.put(new_key, "new reply")
+
+    assert old.get(old_key) == "old reply"
+    assert new.get(new_key) == "new reply"
+    assert new.stats()["entries"] == 2
+
+
+def test_entries_expire_and_storing_again_keeps_their_age(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite3"), ttl=0.2)
+    cache.put("k", "reply")
+    time.sleep(0.12)
+    cache.put("k", "reply")
+    assert cache.get("k") == "reply"
+    time.sleep(0.12)
+    assert cache.get("k") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite3"), max_entries=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    cache.get("a")
+    cache.put("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.stats()["evictions"] == 1
+
+
+class FakeTicket:
+    waited = 0.0
+
+    def settle(self, tokens):
+        pass
+
+
+class FakeClient:
+    def __init__(self, reply):
+        self.reply = reply
+        self.calls = 0
+
+    def complete(self, model, messages, **params):
+        self.calls += 1
+        return self.reply
+
+    def stream(self, model, messages, on_token=None, **params):
+        self.calls += 1
+        return self.reply, {"ttft_s": 0.0, "total_s": 0.0}
+
+
+@pytest.fixture
+def turn(tmp_path, monkeypatch):
+    main = pytest.importorskip("main")
+    from state_manager import SessionManager
+    from session_store import MemorySessionStore
+
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(main, "get_llm_cache", lambda: cache)
+    monkeypatch.setattr(main, "retrieve_context_chunks", lambda *args, **kwargs: "")
+    monkeypatch.setattr(main, "admit_llm_call", lambda *args, **kwargs: (FakeTicket(), 0))
+
+    def run(reply, stream):
+        client = FakeClient(reply)
+        monkeypatch.setattr(main, "get_client", lambda: client)
+        sm = SessionManager(MemorySessionStore())
+        result = main.run_turn(sm, "session", "I want KYC", stream=stream)
+        return result, client, cache
+
+    return run
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_rejected_replies_are_not_cached(turn, stream):
+    reply = 'Done.\nJSON_OUTPUT: {"selected_vendor": "NotAVendor"}\n'
+    result, client, cache = turn(reply, stream)
+    assert not result["valid"]
+    assert cache.stats()["entries"] == 0
+
+    result, client, _ = turn(reply, stream)
+    assert client.calls == 1
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_valid_replies_are_cached_after_validation(turn, stream):
+    reply = "Which category are you interested in?"
+    result, client, cache = turn(reply, stream)
+    assert result["valid"]
+    assert "cache_entry" not in result["llm_metrics"]
+    assert cache.stats()["entries"] == 1
+
+    result, client, _ = turn(reply, stream)
+    assert result["reply"] == reply
+    assert client.calls == 0
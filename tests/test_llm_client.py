@@ -0,0 +1,159 @@
+import time
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+import llm_client
+from llm_client import AsyncLLMClient, LLMClient, LLMError
+from stub_llm_server import CANNED_REPLIES, DEFAULT_REPLY, StubLLMServer, send_json
+
+
+MESSAGES = [{"role": "system", "content": "CURRENT STAGE: STAGE_2"}, {"role": "user", "content": "hi"}]
+
+
+class FailFirst:
+    """Answer the first requests with the given statuses, then hand over to the stub."""
+
+    def __init__(self, app, statuses, retry_after=None):
+        self.app = app
+        self.statuses = list(statuses)
+        self.retry_after = retry_after
+        self.requests = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].endswith("/chat/completions"):
+            self.requests += 1
+            if self.statuses:
+                status = self.statuses.pop(0)
+                headers = [(b"retry-after", self.retry_after.encode())] if self.retry_after else []
+                await send_json(send, status, {"error": {"message": f"injected {status}"}}, headers=headers)
+                return
+        await self.app(scope, receive, send)
+
+
+def stub(**kwargs):
+    kwargs.setdefault("latency_ms", 0)
+    kwargs.setdefault("tokens_per_second", 0)
+    return StubLLMServer(jitter=0, **kwargs)
+
+
+def attach(client, app):
+    """Point a client's pooled HTTP client at an in-process ASGI app."""
+    client.http = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://stub/v1")
+    return client
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(llm_client, "_jitter", lambda retry_state: 0.0)
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_transient_errors_are_retried(status):
+    app = FailFirst(stub(), [status, status])
+
+    async def run():
+        client = attach(AsyncLLMClient(max_attempts=4), app)
+        try:
+            return await client.complete("model", MESSAGES), client.stats
+        finally:
+            await client.aclose()
+
+    reply, stats = asyncio.run(run())
+    assert reply == CANNED_REPLIES["STAGE_2"]
+    assert app.requests == 3
+    assert stats["retries"] == 2 and stats["failures"] == 0
+
+
+def test_retry_after_is_honoured():
+    app = FailFirst(stub(), [429], retry_after="0.2")
+
+    async def run():
+        client = attach(AsyncLLMClient(), app)
+        start = time.perf_counter()
+        try:
+            await client.complete("model", MESSAGES)
+            return time.perf_counter() - start
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(run()) >= 0.2
+    assert app.requests == 2
+
+
+@pytest.mark.parametrize("status", [400, 401, 404])
+def test_client_errors_are_not_retried(status):
+    app = FailFirst(stub(), [status])
+
+    async def run():
+        client = attach(AsyncLLMClient(max_attempts=4), app)
+        try:
+            with pytest.raises(LLMError) as error:
+                await client.complete("model", MESSAGES)
+            return error.value, client.stats
+        finally:
+            await client.aclose()
+
+    error, stats = asyncio.run(run())
+    assert error.status == status
+    assert app.requests == 1
+    assert stats["retries"] == 0 and stats["failures"] == 1
+
+
+def test_gives_up_after_max_attempts():
+    app = FailFirst(stub(), [503] * 5)
+
+    async def run():
+        client = attach(AsyncLLMClient(max_attempts=3), app)
+        try:
+            with pytest.raises(LLMError):
+                await client.complete("model", MESSAGES)
+        finally:
+            await client.aclose()
+
+    asyncio.run(run())
+    assert app.requests == 3
+
+
+def test_stream_reassembles_tokens():
+    tokens = []
+
+    async def run():
+        client = attach(AsyncLLMClient(), FailFirst(stub(), [503]))
+        try:
+            return await client.stream("model", [{"role": "user", "content": "hi"}], on_token=tokens.append)
+        finally:
+            await client.aclose()
+
+    reply, metrics = asyncio.run(run())
+    assert reply == DEFAULT_REPLY
+    assert len(tokens) > 1 and "".join(tokens) == reply
+    assert 0 <= metrics["ttft_s"] <= metrics["total_s"]
+
+
+def test_blocking_facade_is_shared_by_threads():
+    client = LLMClient(max_concurrency=4)
+    client._run(_attach_async(client.client, stub(latency_ms=20)))
+    results = [None] * 12
+
+    def worker(i):
+        messages = [{"role": "system", "content": f"CURRENT STAGE: STAGE_{i % 4 + 1}"}]
+        results[i] = client.complete("model", messages)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(results))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = client.stats
+    client.close()
+
+    assert results == [CANNED_REPLIES[f"STAGE_{i % 4 + 1}"] for i in range(len(results))]
+    assert stats["requests"] == len(results) and stats["in_flight"] == 0
+
+
+async def _attach_async(client, app):
+    await client.http.aclose()
+    attach(client, app)
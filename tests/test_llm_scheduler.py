@@ -0,0 +1,93 @@
+import time
+import threading
+
+import pytest
+
+from llm_scheduler import LLMOverloaded, LLMScheduler, TokenBucket
+
+
+def test_bucket_starts_full_and_refills_per_minute():
+    bucket = TokenBucket(60, now=0.0)
+    assert bucket.wait_time(60, now=0.0) == 0.0
+    bucket.take(60)
+    assert bucket.wait_time(1, now=0.0) == pytest.approx(1.0)
+    assert bucket.wait_time(1, now=0.5) == pytest.approx(0.5)
+    # Refills never exceed one minute's worth
+    assert bucket.wait_time(1, now=1000.0) == 0.0
+    assert bucket.level == 60
+
+
+def test_bucket_requests_are_capped_at_capacity_and_may_go_into_debt():
+    bucket = TokenBucket(60, now=0.0)
+    assert bucket.wait_time(600, now=0.0) == 0.0
+    bucket.take(600)
+    assert bucket.level == 0
+    bucket.adjust(30)
+    assert bucket.wait_time(1, now=0.0) == pytest.approx(31.0)
+    bucket.adjust(-1000)
+    assert bucket.level == 60
+
+
+def test_time_scale_speeds_up_refill():
+    bucket = TokenBucket(60, now=0.0, time_scale=10)
+    bucket.take(60)
+    assert bucket.wait_time(10, now=0.0) == pytest.approx(1.0)
+
+
+def test_calls_within_quota_are_admitted_at_once():
+    scheduler = LLMScheduler(rpm=10, tpm=1000, max_wait=1)
+    tickets = [scheduler.admit(100) for _ in range(10)]
+    assert all(ticket.waited < 0.1 for ticket in tickets)
+    assert scheduler.stats()["admitted"] == 10
+
+
+def test_call_that_cannot_start_in_time_is_shed_with_retry_after():
+    scheduler = LLMScheduler(rpm=0, tpm=600, max_wait=0.5)
+    scheduler.admit(600)
+    with pytest.raises(LLMOverloaded) as error:
+        scheduler.admit(300, priority=3)
+    assert error.value.retry_after == pytest.approx(30.0, rel=0.01)
+    assert scheduler.stats()["shed_by_priority"] == {3: 1}
+
+
+def test_settle_refunds_unused_tokens():
+    scheduler = LLMScheduler(rpm=0, tpm=600, max_wait=0.2)
+    ticket = scheduler.admit(600)
+    ticket.settle(100)
+    assert scheduler.admit(400).waited < 0.1
+
+
+def test_full_queue_only_sheds_calls_that_would_wait():
+    scheduler = LLMScheduler(rpm=0, tpm=60, max_queue=0)
+    assert scheduler.admit(30).waited == 0.0
+    with pytest.raises(LLMOverloaded, match="queue full"):
+        scheduler.admit(60)
+    assert scheduler.stats()["admitted"] == 1
+
+
+def wait_for_queue_depth(scheduler, depth, timeout=5):
+    deadline = time.monotonic() + timeout
+    while scheduler.stats()["queue_depth"] < depth:
+        assert time.monotonic() < deadline, "calls did not queue"
+        time.sleep(0.001)
+
+
+def test_waiting_calls_are_admitted_by_priority():
+    # 60 tokens per minute: nothing queued below can start until the first call's tokens are refunded
+    scheduler = LLMScheduler(rpm=0, tpm=60, max_wait=30)
+    ticket = scheduler.admit(60)
+    order = []
+
+    def call(priority):
+        scheduler.admit(20, priority=priority)
+        order.append(priority)
+
+    threads = []
+    for depth, priority in enumerate((3, 2, 0), start=1):
+        threads.append(threading.Thread(target=call, args=(priority,)))
+        threads[-1].start()
+        wait_for_queue_depth(scheduler, depth)
+    ticket.settle(0)
+    for thread in threads:
+        thread.join()
+    assert order == [0, 2, 3]
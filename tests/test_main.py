@@ -0,0 +1,53 @@
+import pytest
+
+from session_store import MemorySessionStore
+from state_manager import SessionManager
+
+main = pytest.importorskip("main")
+
+
+class CountingStore(MemorySessionStore):
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+
+    def get(self, session_id):
+        self.reads += 1
+        return super().get(session_id)
+
+
+class FakeTicket:
+    waited = 0.0
+
+    def settle(self, tokens):
+        pass
+
+
+class FakeClient:
+    def complete(self, model, messages, **params):
+        return "Which category are you interested in?"
+
+
+@pytest.fixture
+def sm(monkeypatch):
+    calls = []
+    monkeypatch.setattr(main, "get_client", lambda: FakeClient())
+    monkeypatch.setattr(main, "get_llm_cache", lambda: None)
+    monkeypatch.setattr(main, "admit_llm_call", lambda *args, **kwargs: (FakeTicket(), 0))
+    monkeypatch.setattr(main, "retrieve_context_chunks",
+                        lambda *args, **kwargs: calls.append((args, kwargs)) or "")
+    sm = SessionManager(CountingStore())
+    sm.retrieval_calls = calls
+    return sm
+
+
+def test_a_turn_reads_the_session_once_before_updating_it(sm):
+    main.run_turn(sm, "s", "hello", stream=False)
+    sm.store.reads = 0
+    main.run_turn(sm, "s", "I want KYC", stream=False)
+
+    # One read for the turn itself, one by update() when storing it
+    assert sm.store.reads == 2
+    args, kwargs = sm.retrieval_calls[-1]
+    assert kwargs["selections"] is sm.get_conversation("s").selections
+    assert len(sm.get_turns("s")) == 2
@@ -0,0 +1,36 @@
+import os
+import sys
+import subprocess
+
+import prompt_utils
+from kb_snapshot import get_snapshot
+
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts')
+
+
+def test_import_reads_and_writes_nothing(tmp_path):
+    snapshot_path = tmp_path / "kb_snapshot.json"
+    env = dict(os.environ, KB_SNAPSHOT_PATH=str(snapshot_path))
+    code = "import kb_snapshot, prompt_utils; assert prompt_utils._kb is None and kb_snapshot._snapshot is None"
+    subprocess.run([sys.executable, "-c", code], cwd=SCRIPTS_DIR, env=env, check=True)
+    assert not snapshot_path.exists()
+
+
+def test_current_kb_loads_once_and_module_names_follow_it(monkeypatch):
+    monkeypatch.setattr(prompt_utils, "_kb", None)
+    state = prompt_utils.current_kb()
+    assert state.version == get_snapshot().hash
+    assert prompt_utils.current_kb() is state
+    assert prompt_utils.ALLOWED_VENDORS == state.vendors
+    assert prompt_utils.KB_VERSION == state.version
+
+
+def test_pinned_kb_survives_a_swap(monkeypatch):
+    state = prompt_utils.current_kb()
+    monkeypatch.setattr(prompt_utils, "_kb", state)
+    replacement = prompt_utils.KnowledgeBaseState(state.snapshot)
+    with prompt_utils.pinned_kb() as pinned:
+        prompt_utils.swap_kb(replacement)
+        assert pinned is state and prompt_utils.current_kb() is state
+    assert prompt_utils.current_kb() is replacement
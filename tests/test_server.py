@@ -0,0 +1,100 @@
+import json
+import time
+import asyncio
+
+import pytest
+
+server = pytest.importorskip("server")
+
+
+def fake_turn(sm, session_id, message, on_token=None, stream=False):
+    if message == "fail":
+        raise RuntimeError("LLM request failed")
+    time.sleep(0.02)
+    if on_token:
+        on_token("Hello")
+    return {"stage": "STAGE_1", "reply": f"echo {message}", "valid": True, "shed": False,
+            "llm_metrics": {"ttft_s": 0.0, "total_s": 0.0, "cached": None}}
+
+
+@pytest.fixture
+def app(monkeypatch):
+    from session_store import MemorySessionStore
+    from state_manager import SessionManager
+
+    monkeypatch.setattr(server, "run_turn", fake_turn)
+    chat_server = server.ChatServer(workers=4)
+    chat_server.sm = SessionManager(MemorySessionStore())
+    yield chat_server
+    chat_server.executor.shutdown()
+
+
+def test_session_locks_are_dropped_when_unused(app):
+    async def run():
+        results = await asyncio.gather(*(app.chat(f"session-{i % 3}", f"message {i}") for i in range(9)))
+        return results
+
+    results = asyncio.run(run())
+    assert [result["reply"] for result in results] == [f"echo message {i}" for i in range(9)]
+    assert app.locks == {}
+    assert app.health()["session_locks"] == 0
+
+
+def test_turns_of_one_session_run_one_at_a_time(app, monkeypatch):
+    running = []
+
+    def tracking_turn(sm, session_id, message, on_token=None, stream=False):
+        running.append(session_id)
+        assert running.count(session_id) == 1
+        time.sleep(0.02)
+        running.remove(session_id)
+        return fake_turn(sm, session_id, message)
+
+    monkeypatch.setattr(server, "run_turn", tracking_turn)
+
+    async def run():
+        await asyncio.gather(*(app.chat("same", str(i)) for i in range(4)))
+
+    asyncio.run(run())
+    assert app.locks == {}
+
+
+def websocket(app, messages, fail_after=None):
+    """Run /ws for `messages`; sends raise RuntimeError after `fail_after` frames, like a closed socket."""
+    events = [{"type": "websocket.connect"}]
+    events += [{"type": "websocket.receive", "text": message} for message in messages]
+    events.append({"type": "websocket.disconnect"})
+    sent = []
+
+    async def receive():
+        return events.pop(0)
+
+    async def send(event):
+        if event["type"] == "websocket.send":
+            if fail_after is not None and len(sent) >= fail_after:
+                raise RuntimeError("Unexpected ASGI message 'websocket.send', after sending 'websocket.close'")
+            sent.append(json.loads(event["text"]))
+
+    scope = {"type": "websocket", "path": "/ws", "query_string": b"session_id=ws"}
+    asyncio.run(app(scope, receive, send))
+    return sent, events
+
+
+def test_websocket_streams_tokens_then_the_reply(app):
+    sent, _ = websocket(app, ["hi"])
+    assert [frame["type"] for frame in sent] == ["session", "token", "reply"]
+    assert sent[2]["reply"] == "echo hi"
+
+
+def test_turn_failures_are_reported_not_treated_as_disconnects(app):
+    sent, events = websocket(app, ["fail", "hi"])
+    assert [frame["type"] for frame in sent] == ["session", "error", "token", "reply"]
+    assert sent[1] == {"type": "error", "error": "turn failed"}
+    assert events == []
+
+
+def test_disconnect_mid_turn_ends_the_connection(app):
+    sent, events = websocket(app, ["hi", "again"], fail_after=1)
+    assert [frame["type"] for frame in sent] == ["session"]
+    # The second message is never read
+    assert len(events) == 2
@@ -0,0 +1,174 @@
+import time
+import threading
+
+import pytest
+
+from session_store import MemorySessionStore, SQLiteSessionStore
+from state_manager import SessionManager, Turn
+
+
+def sqlite_store(tmp_path, **kwargs):
+    # A long flush interval keeps the writer thread out of the way; tests flush explicitly
+    kwargs.setdefault("flush_interval_ms", 60_000)
+    return SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"), **kwargs)
+
+
+def add_turn(store, session_id, text):
+    state = store.get(session_id) or store.create(session_id)
+    turn = Turn(text, f"reply to {text}", state.stage)
+    state.add_turn(turn)
+    store.append(session_id, state, turn)
+    return state
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    store = MemorySessionStore() if request.param == "memory" else sqlite_store(tmp_path)
+    yield store
+    store.close()
+
+
+def test_sessions_round_trip(store):
+    sm = SessionManager(store)
+    sm.update("s", "I want banking", "STAGE_1 We offer BANKING AND PAYMENTS.")
+    sm.update("s", "yes", "STAGE_1 Great, BANKING AND PAYMENTS it is.")
+    assert sm.get_stage("s") == "STAGE_2"
+    assert [turn.user for turn in sm.get_turns("s")] == ["I want banking", "yes"]
+    assert sm.get_selections("s").category == "BANKING AND PAYMENTS"
+    assert store.get("unknown") is None
+
+
+def test_sqlite_sessions_survive_a_new_store(tmp_path):
+    first = sqlite_store(tmp_path)
+    add_turn(first, "s", "one")
+    add_turn(first, "s", "two")
+    first.close()
+
+    state = sqlite_store(tmp_path).get("s")
+    assert [turn.user for turn in state.turns] == ["one", "two"]
+
+
+def test_evicted_hot_entry_keeps_its_version(tmp_path):
+    store = sqlite_store(tmp_path, hot_capacity=1)
+    add_turn(store, "a", "first")
+    store.flush()
+
+    state = store.get("a")
+    store.create("b")  # evicts "a" from the hot tier between get() and append()
+    turn = Turn("second", "reply", state.stage)
+    state.add_turn(turn)
+    store.append("a", state, turn)
+    store.flush()
+
+    assert store.counters["conflicts"] == 0
+    assert [turn.user for turn in store.get("a").turns] == ["first", "second"]
+
+
+def test_concurrent_writers_merge_turns(tmp_path):
+    # Two worker processes serving the same session at once
+    first, second = sqlite_store(tmp_path), sqlite_store(tmp_path)
+    add_turn(first, "s", "start")
+    first.flush()
+
+    first_state, second_state = first.get("s"), second.get("s")
+    first_state.stage = "STAGE_2"
+    for store, state, text in ((first, first_state, "from first"), (second, second_state, "from second")):
+        turn = Turn(text, "reply", "STAGE_1")
+        state.add_turn(turn)
+        store.append("s", state, turn)
+    first.flush()
+    second.flush()
+
+    assert second.counters["conflicts"] == 1
+    assert first.counters["conflicts"] == 0
+    merged = second.get("s")
+    assert [turn.user for turn in merged.turns] == ["start", "from first", "from second"]
+    # Fields other than turns are last-writer-wins
+    assert merged.stage == "STAGE_1"
+    assert first.get("s").stage == "STAGE_1"
+
+
+def test_sessions_keep_at_most_max_turns(tmp_path):
+    store = sqlite_store(tmp_path, max_turns=3)
+    for i in range(5):
+        add_turn(store, "s", f"turn {i}")
+    store.flush()
+    store.hot.clear()
+
+    state = store.get("s")
+    assert [turn.user for turn in state.turns] == ["turn 2", "turn 3", "turn 4"]
+    assert state.dropped_turns == 2
+
+
+def test_memory_store_evicts_least_recently_active():
+    store = MemorySessionStore(max_sessions=2)
+    for session_id in ("a", "b", "c"):
+        add_turn(store, session_id, "hi")
+    assert store.get("a") is None
+    assert store.get("c") is not None
+    assert store.counters["evicted"] == 1
+
+
+def test_expired_session_does_not_come_back(tmp_path):
+    store = sqlite_store(tmp_path, ttl=60)
+    add_turn(store, "s", "old secret message")
+    store.flush()
+    store.hot.clear()
+    store.ttl = 0.01
+    time.sleep(0.05)
+
+    sm = SessionManager(store)
+    assert store.get("s") is None
+    add_turn(store, "s", "new message")
+    store.flush()
+    store.hot.clear()
+
+    assert [turn.user for turn in sm.get_turns("s")] == ["new message"]
+    assert store.counters["conflicts"] == 0
+    assert store.counters["expired"] == 1
+
+
+def test_flush_never_merges_into_an_expired_row(tmp_path):
+    # Another worker created the session fresh while this store's row had expired but was not swept
+    store = sqlite_store(tmp_path, ttl=60)
+    add_turn(store, "s", "old secret message")
+    store.flush()
+    store.ttl = 0.01
+    time.sleep(0.05)
+
+    other = sqlite_store(tmp_path, ttl=0.01)
+    add_turn(other, "s", "new message")
+    other.flush()
+    other.hot.clear()
+
+    assert [turn.user for turn in other.get("s").turns] == ["new message"]
+    assert other.counters["conflicts"] == 0
+
+
+def test_flush_checks_versions_inside_its_write_transaction(tmp_path):
+    first, second = sqlite_store(tmp_path), sqlite_store(tmp_path)
+    add_turn(first, "s", "start")
+    first.flush()
+    first_state, second_state = first.get("s"), second.get("s")
+    for store, state, text in ((first, first_state, "from a"), (second, second_state, "from b")):
+        turn = Turn(text, "reply", "STAGE_1")
+        state.add_turn(turn)
+        store.append("s", state, turn)
+
+    # Let the first store try to commit right after the second one read the session's version
+    expired = second._expired
+    racer = threading.Thread(target=first.flush)
+
+    def read_then_race(updated_at):
+        if not racer.is_alive() and racer.ident is None:
+            racer.start()
+            racer.join(0.3)
+        return expired(updated_at)
+
+    second._expired = read_then_race
+    second.flush()
+    racer.join()
+
+    assert first.counters["conflicts"] + second.counters["conflicts"] == 1
+    first.hot.clear()
+    assert sorted(turn.user for turn in first.get("s").turns) == ["from a", "from b", "start"]
@@ -0,0 +1,54 @@
+import pytest
+
+from session_store import MemorySessionStore
+from state_manager import CATEGORY_KEYWORDS, SERVICE_KEYWORDS, SessionManager
+
+
+BASELINE_VENDORS = ["azureraven", "emeraldwhale", "scarletpanther", "goldenotter", "crimsonfalcon",
+                    "sapphireswan", "onyxwolf", "cobalteagle", "silvertiger"]
+
+
+@pytest.fixture
+def sm():
+    return SessionManager(MemorySessionStore())
+
+
+@pytest.mark.parametrize("keyword", CATEGORY_KEYWORDS)
+def test_category_keywords_advance_stage_1(sm, keyword):
+    response = f"We offer {keyword.title()} and more. Which one do you need?"
+    assert sm.detect_stage(response, "yes", "STAGE_1") == "STAGE_2"
+    assert sm.detect_stage(response, "hmm", "STAGE_1") == "STAGE_1"
+
+
+@pytest.mark.parametrize("keyword", SERVICE_KEYWORDS)
+def test_service_keywords_advance_stage_2(sm, keyword):
+    response = f"Options: {keyword.upper()} options listed above."
+    assert sm.detect_stage(response, "option 2", "STAGE_2") == "STAGE_3"
+    assert sm.detect_stage(response, "hmm", "STAGE_2") == "STAGE_2"
+
+
+@pytest.mark.parametrize("vendor", BASELINE_VENDORS)
+def test_vendor_names_advance_stage_3(sm, vendor):
+    response = f"Top pick: {vendor}s with the best uptime."
+    assert sm.detect_stage(response, "okay", "STAGE_3") == "STAGE_4"
+    assert sm.detect_stage(response, "hmm", "STAGE_3") == "STAGE_3"
+
+
+def test_full_knowledge_base_names_still_count(sm):
+    assert sm.detect_stage("Try Others (Credit Risk)", "yes", "STAGE_1") == "STAGE_2"
+    assert sm.detect_stage("Digilocker Aadhaar (Generate URL) fits", "1", "STAGE_2") == "STAGE_3"
+
+
+def test_json_output_confirms_without_keywords(sm):
+    assert sm.detect_stage('JSON_OUTPUT: {"category": "X"}', "", "STAGE_1") == "STAGE_2"
+    assert sm.detect_stage("Nothing to see", "yes", "STAGE_1") == "STAGE_1"
+    assert sm.detect_stage("anything", "", "STAGE_4") == "STAGE_4"
+
+
+def test_update_only_moves_forward(sm):
+    sm.update("s", "hi", "STAGE_1 We offer Banking and Payments.")
+    assert sm.get_stage("s") == "STAGE_1"
+    sm.update("s", "yes, banking", "STAGE_1 Great, Banking it is.")
+    assert sm.get_stage("s") == "STAGE_2"
+    sm.update("s", "no", "STAGE_1 Sorry.")
+    assert sm.get_stage("s") == "STAGE_2"
@@ -0,0 +1,58 @@
+from state_manager import SessionState, Turn
+from token_budget import (
+    build_budgeted_prompt, count_tokens, static_tokens, truncate_to_tokens,
+)
+
+
+def conversation(turns):
+    state = SessionState()
+    for i in range(turns):
+        state.add_turn(Turn(f"question {i} " + "detail " * 40, f"STAGE_1 answer {i}. " + "more " * 40, "STAGE_1"))
+    return state
+
+
+def test_count_tokens_counts_words_and_punctuation():
+    assert count_tokens("") == 0
+    assert count_tokens("Hello, world!") == 4
+    # Long identifiers fall back to one token per four characters
+    assert count_tokens("a" * 40) == 10
+
+
+def test_truncate_to_tokens_cuts_at_chunk_boundaries():
+    text = "\n\n".join(f"chunk {i} " + "word " * 20 for i in range(10))
+    truncated = truncate_to_tokens(text, 60)
+    assert count_tokens(truncated) <= 60
+    assert text.startswith(truncated)
+    assert truncate_to_tokens(text, 10_000) == text
+    assert truncate_to_tokens(text, 0) == ""
+
+
+def test_short_conversation_is_sent_verbatim():
+    state = conversation(2)
+    prompt, metrics = build_budgeted_prompt("hi", "STAGE_1", conversation=state)
+    assert metrics["verbatim_turns"] == 2
+    assert metrics["summarised_turns"] == 0
+    assert state.turns[0].user in prompt
+    assert metrics["tokens_after"] <= metrics["budget"]
+
+
+def test_older_turns_are_summarised():
+    state = conversation(10)
+    prompt, metrics = build_budgeted_prompt("hi", "STAGE_1", conversation=state)
+    assert metrics["verbatim_turns"] == 4
+    assert metrics["summarised_turns"] == 6
+    assert "EARLIER CONVERSATION (SUMMARY):" in prompt
+    assert state.turns[0].user not in prompt
+    assert metrics["tokens_after"] < metrics["tokens_before"]
+
+
+def test_prompt_fits_a_tight_budget():
+    state = conversation(6)
+    knowledge = "\n\n".join(f"Service {i}: " + "feature " * 50 for i in range(40))
+    budget = static_tokens("STAGE_2") + 700
+    prompt, metrics = build_budgeted_prompt("show services", "STAGE_2", conversation=state,
+                                            knowledge_chunks=knowledge, budget=budget)
+    assert metrics["tokens_after"] <= budget
+    assert metrics["verbatim_turns"] < 4
+    assert metrics["sections"]["knowledge"] < count_tokens(knowledge)
+    assert metrics["sections"]["static"] + metrics["sections"]["dynamic"] == metrics["tokens_after"]
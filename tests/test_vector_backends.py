@@ -0,0 +1,79 @@
+import os
+import json
+
+import numpy as np
+import pytest
+
+from vector_backends import (
+    CURRENT_FILENAME, EMBEDDINGS_FILENAME, RECORDS_FILENAME,
+    NumpyBackend, export_numpy_index, numpy_index_exists, resolve_index_dir,
+)
+
+
+class FakeCollection:
+    def __init__(self, embeddings, categories):
+        self.embeddings = embeddings
+        self.categories = categories
+
+    def get(self, include):
+        ids = [f"chunk-{i}" for i in range(len(self.embeddings))]
+        return {
+            "ids": ids,
+            "embeddings": self.embeddings,
+            "documents": [f"doc {i}" for i in range(len(ids))],
+            "metadatas": [{"category": category} for category in self.categories],
+        }
+
+
+COLLECTION = FakeCollection(
+    embeddings=[[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.7, 0.7, 0.0], [0.0, 0.0, 2.0]],
+    categories=["KYC", "Banking", "KYC", "Banking"],
+)
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+def test_query_ranks_by_cosine_similarity(tmp_path, dtype):
+    export_numpy_index(COLLECTION, index_dir=tmp_path, dtype=dtype)
+    backend = NumpyBackend(tmp_path)
+
+    assert backend.embeddings.dtype == np.float32
+    [result] = backend.query([[1.0, 0.1, 0.0]], top_k=2)
+    assert result["ids"] == ["chunk-0", "chunk-2"]
+    [result] = backend.query([[0.0, 0.0, 1.0]], top_k=2, category_filter="KYC")
+    assert set(result["ids"]) == {"chunk-0", "chunk-2"}
+    assert all(meta["category"] == "KYC" for meta in result["metadatas"])
+
+
+def test_export_switches_versions_atomically_and_keeps_the_previous_one(tmp_path):
+    assert not numpy_index_exists(tmp_path)
+    export_numpy_index(COLLECTION, index_dir=tmp_path)
+    first = resolve_index_dir(tmp_path)
+    export_numpy_index(COLLECTION, index_dir=tmp_path)
+    second = resolve_index_dir(tmp_path)
+    export_numpy_index(COLLECTION, index_dir=tmp_path)
+    third = resolve_index_dir(tmp_path)
+
+    assert numpy_index_exists(tmp_path)
+    assert len({first, second, third}) == 3
+    assert not os.path.exists(first)
+    assert os.path.exists(second)
+    with open(os.path.join(tmp_path, CURRENT_FILENAME)) as f:
+        assert os.path.join(tmp_path, f.read()) == third
+
+
+def test_load_rejects_records_from_another_export(tmp_path):
+    export_numpy_index(COLLECTION, index_dir=tmp_path)
+    version_dir = resolve_index_dir(tmp_path)
+    with open(os.path.join(version_dir, RECORDS_FILENAME), 'w') as f:
+        json.dump({"ids": ["a"], "documents": ["doc"], "metadatas": [{}]}, f)
+
+    with pytest.raises(ValueError, match="4 vectors but 1 records"):
+        NumpyBackend(tmp_path)
+
+
+def test_loads_unversioned_index(tmp_path):
+    np.save(os.path.join(tmp_path, EMBEDDINGS_FILENAME), np.eye(2, dtype=np.float32))
+    with open(os.path.join(tmp_path, RECORDS_FILENAME), 'w') as f:
+        json.dump({"ids": ["a", "b"], "documents": ["A", "B"], "metadatas": [{}, {}]}, f)
+
+    assert NumpyBackend(tmp_path).query([[0.0, 1.0]], top_k=1)[0]["ids"] == ["b"]
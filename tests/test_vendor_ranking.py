@@ -0,0 +1,82 @@
+import math
+
+import numpy as np
+import pytest
+
+from vendor_ranking import VendorTable, format_ranking_table, parse_metric, rank_vendors, score_vendors
+
+
+ROWS = [
+    {"serialNumber": 1, "name": "Fast", "successRate": "80.00%", "avgLatency": "0.50 Secs",
+     "totalTransactions": 1000, "fiveXX": 50},
+    {"serialNumber": 2, "name": "Reliable", "successRate": "99.00%", "avgLatency": "3.00 Secs",
+     "totalTransactions": 2000, "fiveXX": 20},
+    {"serialNumber": 3, "name": "Middle", "successRate": "90.00%", "avgLatency": "1.00 Secs"},
+]
+
+
+@pytest.fixture
+def table():
+    return VendorTable.from_rows(ROWS)
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("87.79%", 87.79), ("10.29 Secs", 10.29), (12, 12.0), ("-1.5", -1.5),
+])
+def test_parse_metric(value, expected):
+    assert parse_metric(value) == expected
+
+
+def test_parse_metric_without_a_number_is_nan():
+    assert math.isnan(parse_metric("n/a"))
+    assert math.isnan(parse_metric(None))
+
+
+def test_table_parses_metrics_and_derives_5xx_rate(table):
+    assert table.get("Fast", "successRate") == 80.0
+    assert table.get("Reliable", "avgLatency") == 3.0
+    assert table.get("Fast", "fiveXXRate") == pytest.approx(5.0)
+    assert table.get("Reliable", "fiveXXRate") == pytest.approx(1.0)
+    assert math.isnan(table.get("Middle", "fiveXXRate"))
+    assert math.isnan(table.get("Unknown", "successRate"))
+
+
+def test_scores_follow_the_stated_priority(table):
+    names, scores = score_vendors({"latency": "low"}, table=table)
+    assert names == ["Fast", "Reliable", "Middle"]
+    np.testing.assert_allclose(scores, [1.0, 0.0, 0.8])
+
+    _, scores = score_vendors({"success_rate": "high"}, table=table)
+    np.testing.assert_allclose(scores, [0.0, 1.0, 10 / 19])
+
+
+def test_weights_and_missing_metrics(table):
+    _, scores = score_vendors({"success_rate": "high", "latency": "low"},
+                              weights={"success_rate": 3}, table=table)
+    np.testing.assert_allclose(scores, [0.25, 0.75, (3 * 10 / 19 + 0.8) / 4])
+    # Middle has no 5XX data, which counts as the worst value
+    _, scores = score_vendors({"server_errors": "low"}, table=table)
+    np.testing.assert_allclose(scores, [0.0, 1.0, 0.0])
+
+
+def test_unknown_priorities_fall_back_to_the_defaults(table):
+    np.testing.assert_allclose(score_vendors({"price": "low"}, table=table)[1], score_vendors(table=table)[1])
+
+
+def test_candidates_limit_the_ranking(table):
+    names, scores = score_vendors({"latency": "low"}, candidates=["Reliable", "Middle"], table=table)
+    assert names == ["Reliable", "Middle"]
+    np.testing.assert_allclose(scores, [0.0, 1.0])
+    assert score_vendors(candidates=[], table=table)[0] == []
+
+
+def test_rank_vendors_and_table_use_the_knowledge_base():
+    ranking = rank_vendors({"success_rate": "high"})
+    scores = [score for _, score in ranking]
+    assert scores == sorted(scores, reverse=True)
+    assert ranking[0][1] == 1.0
+
+    lines = format_ranking_table(ranking[:2], {"success_rate": "high"}).splitlines()
+    assert lines[0].startswith("VENDOR RANKING BY HIGH SUCCESS RATE")
+    assert lines[2].startswith(f"1 | {ranking[0][0]} | 1.00 | ")
+    assert len(lines) == 4
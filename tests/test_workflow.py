@@ -0,0 +1,77 @@
+import pytest
+
+from prompt_utils import current_kb, vendors_for_service
+from selections import Selections
+from workflow import (
+    RANKED_VENDOR_COUNT, WORKFLOW_URL, WorkflowError,
+    build_workflow, format_workflow_reply, get_validator, template_reasoning, workflow_schema,
+)
+
+
+def selections(service="PAN ADVANCED", vendor="CobaltEagle", vendors=(), priorities=None):
+    chosen = Selections()
+    chosen.service = service
+    if vendor:
+        chosen.selected_vendors = {vendor}
+    chosen.vendors = list(vendors)
+    chosen.priorities = dict(priorities or {})
+    return chosen
+
+
+def test_schema_enums_come_from_the_knowledge_base():
+    kb = current_kb()
+    schema = workflow_schema(kb)
+    properties = schema["properties"]
+    assert "PAN_ADVANCED" in properties["selected_service"]["enum"]
+    assert properties["selected_vendor"]["enum"] == kb.vendors
+    assert properties["ranked_vendors"]["maxItems"] == RANKED_VENDOR_COUNT
+    assert set(schema["required"]) == set(properties)
+    assert get_validator() is get_validator()
+
+
+def test_build_workflow_ranks_the_other_vendors():
+    payload, ranking = build_workflow(selections(priorities={"latency": "low"}))
+
+    assert payload["selected_service"] == "PAN_ADVANCED"
+    assert payload["selected_vendor"] == "CobaltEagle"
+    assert payload["user_priorities"] == {"latency": "low"}
+    assert payload["workflow_generation"] == WORKFLOW_URL
+    assert payload["ranked_vendors"] == [name for name, _ in ranking[:RANKED_VENDOR_COUNT]]
+    assert payload["backup_vendor"] == payload["ranked_vendors"][0]
+    assert "CobaltEagle" not in payload["ranked_vendors"]
+    serving = vendors_for_service("PAN ADVANCED")
+    assert all(name in serving for name in payload["ranked_vendors"])
+    scores = [score for _, score in ranking]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_build_workflow_prefers_the_vendors_presented_in_stage_3():
+    serving = [name for name in vendors_for_service("PAN ADVANCED") if name != "CobaltEagle"]
+    presented = serving[-RANKED_VENDOR_COUNT:]
+    payload, ranking = build_workflow(selections(vendors=["CobaltEagle", *presented]))
+    assert sorted(name for name, _ in ranking) == sorted(presented)
+
+
+@pytest.mark.parametrize("chosen, missing", [
+    (selections(service=None), "service"),
+    (selections(vendor=None), "vendor"),
+])
+def test_build_workflow_needs_a_service_and_a_vendor(chosen, missing):
+    with pytest.raises(WorkflowError, match=f"missing {missing}"):
+        build_workflow(chosen)
+
+
+def test_invalid_payload_is_rejected():
+    with pytest.raises(WorkflowError, match="user_priorities"):
+        build_workflow(selections(priorities={"price": "low"}))
+
+
+def test_reply_contains_the_payload_and_reasoning():
+    payload, _ = build_workflow(selections())
+    reasoning = template_reasoning(payload)
+    reply = format_workflow_reply(payload, reasoning)
+
+    assert reply.startswith("STAGE_4\n\nJSON_OUTPUT:\n```json\n")
+    assert reply.endswith(f"REASONING:\n{reasoning}")
+    assert payload["backup_vendor"] in reasoning
+    assert "no priorities were stated" in reasoning